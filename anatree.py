@@ -0,0 +1,88 @@
+# Columnar reader for the TauFinder anatree: branches are read in bulk (RDataFrame, multithreaded) into numpy arrays
+#   columns = read_anatree('Taus_loose.root', ['t_pt', 't_isoE', 'nrej_isoE'])
+# Per-event scalars (ntau, nrej_isoE) give one value per event, per-tau arrays (t_pt[ntau], ..., event_num[ntau])
+# are flattened to one value per tau candidate; columns['tau_offsets'][i]:columns['tau_offsets'][i + 1] are the taus of event i
+# and columns['tau_event'] is the event (index in the columns read) of every tau
+# Large trees are read in blocks of events with the same columns, so memory does not grow with the tree:
+#   for columns in iter_anatree('Taus_loose.root', ['t_pt', 't_isoE'], chunk_size=100000):
+import numpy as np
+import ROOT
+
+TREE_NAME = 'anatree'
+
+
+def add_anatree_args(parser):
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Threads reading the anatree in one go (0: all cores, 1: no multithreading); '
+                             'not used by chunked scans unless --chunkSize is 0')
+    parser.add_argument('--chunkSize', type=int, default=100000,
+                        help='Number of events read at a time by scripts that scan the tree in chunks, single-threaded '
+                             'with bounded memory (0: the whole tree at once with --threads, faster but holds it all in memory)')
+
+
+def has_tree(path, tree_name=TREE_NAME):
+    file = ROOT.TFile.Open(path)
+    found = bool(file) and bool(file.Get(tree_name))
+    if file: file.Close()
+    return found
+
+
+# Column with the number of taus of each event, computed by RDataFrame from the first per-tau (RVec) branch
+TAU_COUNT = '__tau_count'
+
+
+# Read the branches and the tau count of a frame: AsNumpy output -> {branch: array} plus 'tau_offsets' and 'tau_event'
+# Per-tau branches (one RVec per event) are flattened by numpy in one concatenate, without a Python loop over events
+def _read_columns(frame, branches):
+    per_tau = [branch for branch in branches if 'RVec' in str(frame.GetColumnType(branch))
+               or 'vector' in str(frame.GetColumnType(branch))]
+    columns_read = list(branches)
+    if per_tau:
+        frame = frame.Define(TAU_COUNT, f'static_cast<long long>({per_tau[0]}.size())')
+        columns_read.append(TAU_COUNT)
+    read = frame.AsNumpy(columns_read)
+    n_events = len(read[branches[0]])
+    columns = {}
+    for branch in branches:
+        values = read[branch]
+        if branch in per_tau:
+            columns[branch] = np.concatenate(values) if n_events else np.zeros(0)
+        else:
+            columns[branch] = values
+    counts = read[TAU_COUNT].astype(np.int64) if per_tau else np.zeros(n_events, dtype=np.int64)
+    columns['tau_offsets'] = np.concatenate([[0], np.cumsum(counts)])
+    columns['tau_event'] = np.repeat(np.arange(n_events), counts)
+    return columns
+
+
+# {branch: numpy array} of the given branches plus 'tau_offsets', None if the file has no anatree
+# With more than one thread the events come in no particular order, but the same order for every branch
+def read_anatree(path, branches, threads=0, tree_name=TREE_NAME):
+    if not has_tree(path, tree_name):
+        return None
+    if threads != 1 and not ROOT.IsImplicitMTEnabled():
+        ROOT.EnableImplicitMT(threads)
+    return _read_columns(ROOT.RDataFrame(tree_name, path), branches)
+
+
+# The columns of read_anatree for chunk_size events at a time, in tree order (chunk_size 0 reads everything in one chunk)
+# Chunks are single-threaded, RDataFrame ranges do not support multithreading: implicit multithreading is switched off
+# while the chunks are read and switched back on when the scan ends or the generator is closed
+def iter_anatree(path, branches, chunk_size=100000, threads=0, tree_name=TREE_NAME):
+    if chunk_size <= 0:
+        yield read_anatree(path, branches, threads, tree_name)
+        return
+    file = ROOT.TFile.Open(path)
+    n_events = file.Get(tree_name).GetEntries()
+    file.Close()
+    implicit_mt = ROOT.IsImplicitMTEnabled()
+    if implicit_mt:
+        pool_size = ROOT.GetThreadPoolSize()
+        ROOT.DisableImplicitMT()
+    try:
+        for begin in range(0, n_events, chunk_size):
+            frame = ROOT.RDataFrame(tree_name, path).Range(begin, min(begin + chunk_size, n_events))
+            yield _read_columns(frame, branches)
+    finally:
+        if implicit_mt:
+            ROOT.EnableImplicitMT(pool_size)
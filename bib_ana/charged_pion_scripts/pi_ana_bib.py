@@ -1,12 +1,18 @@
 # Comes from ethanmar/MuColl-TauStudy/analysis/pfo_matching.py
 # Run this code after the reco step on a pion gun
-from pyLCIO import IOIMPL
 import ROOT
 from ROOT import TH1F, TFile, TCanvas, gPad
 import math
 from argparse import ArgumentParser
 import os
 from array import array
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # shared helpers live in the repository root
+from early_stop import EarlyStop, add_early_stop_args
+from event_io import add_reader_args, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial, write_sampling
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 ROOT.gStyle.SetOptFit(111)
 ROOT.gStyle.SetOptStat("nemruo") #for uf/of info
@@ -23,8 +29,17 @@ parser.add_argument('-c', '--charge', type=str, required=True,
                     help='Charge matching pions ("plus", "minus", "both", or "none" for no charge matching)') # Input plus, minus, both, or none for this arg
 parser.add_argument('-i', '--inputFile', type=str, default='output_reco.slcio')
 parser.add_argument('-o', '--outputFile', type=str, default='pi_bib_ana.root')
+add_reader_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
+add_early_stop_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['MCParticle', 'PandoraPFOs']
+
 # get charge pion we are interested in
 charge = str(args.charge).lower()
 allowed_pdgs = {
@@ -194,21 +209,30 @@ def delta_phi(phi1, phi2):
 
 
 # Get input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
-# Event loop
-for file in to_process:
+# Everything filled in the event loop, written as a partial output by --shard runs (the resolutions are booked after fitting)
+filled_hists = hists + [fResPt, fResE, fResPtStrict, fResEStrict]
+for r in regions:
+    filled_hists += [fResPtReg[r], fResEReg[r], fResPtRegStrict[r], fResERegStrict[r]]
+state = {'hists': {h.GetName(): h for h in filled_hists}}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
+
+# Efficiencies made below, --targetPrecision stops reading once they are precise enough
+efficiency_pairs = [(fMatchedPt, fMCPt, rebins), (fMatchedEta, fMCEta), (fMatchedTheta, fMCTheta), (fMatchedPhi, fMCPhi), (fMatchedE, fMCE),
+                    (fMatchedPtStrict, fMCPt, rebins), (fMatchedEtaStrict, fMCEta), (fMatchedThetaStrict, fMCTheta),
+                    (fMatchedPhiStrict, fMCPhi), (fMatchedEStrict, fMCE)]
+for r in regions:
+    efficiency_pairs += [(fMatchedPtReg[r], fAllPtReg[r], rebins), (fMatchedPtRegStrict[r], fAllPtReg[r], rebins)]
+early_stop = EarlyStop(efficiency_pairs, args)
 
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+# Event loop
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
 
     for event in reader:
+        if early_stop.stop_reading(): break
 
         try:
             mcs = event.getCollection('MCParticle')
@@ -216,8 +240,6 @@ for file in to_process:
             print("Missing MCParticle in event", event.getEventNumber())
             continue
 
-        pfos = event.getCollection('PandoraPFOs')
-
         # Best MC charged pion
         best_mc = None
         best_mc_pt = -1.0
@@ -235,6 +257,8 @@ for file in to_process:
         if best_mc is None:
             continue
 
+        pfos = event.getCollection('PandoraPFOs')
+
         if best_mc != mcs[0]: print("Highest pt pion is not the first one in the event! (event #, best mc pdg, mc[0] pdg)",
                                     event.getEventNumber(), best_mc.getPDG(), mcs[0].getPDG()) # quick check
 
@@ -350,6 +374,10 @@ for file in to_process:
                     fResERegStrict[reg].Fill((mcE - recoPiEStrict) / mcE)
 
     reader.close()
+    if early_stop.stopped: break
+
+early_stop.report()
+write_partial(state, args)
 
 # Eff plots
 def make_eff(num, den, name, title, xtitle, rebin=False):
@@ -415,6 +443,7 @@ for r in regions:
 output = TFile(args.outputFile, 'RECREATE')
 for h in hists:
     h.Write()
+write_sampling(state)
 output.Close()
 
 # png plots
@@ -1,13 +1,18 @@
 # Extended from ethanmar/MuColl-TauStudy/analysis/pfo_matching.py
 # MC pion matched to best reconstructed charged pion OR electron
 # Run this code after the reco step on a pion gun
-from pyLCIO import IOIMPL
 import ROOT
 from ROOT import TH1F, TFile, TCanvas, gPad
 import math
 from argparse import ArgumentParser
 import os
 from array import array
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial, write_sampling
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 ROOT.gStyle.SetOptFit(111)
 ROOT.gStyle.SetOptStat("nemruo") #for uf/of info
@@ -24,8 +29,16 @@ parser.add_argument('-c', '--charge', type=str, required=True,
                     help='Charge matching pions ("plus", "minus", "both", or "none" for no charge matching)') # Input plus, minus, both, or none for this arg
 parser.add_argument('-i', '--inputFile', type=str, default='output_reco.slcio')
 parser.add_argument('-o', '--outputFile', type=str, default='pi_bib_ana.root')
+add_reader_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['PandoraPFOs', 'MCParticle']
+
 # get charge pion we are interested in
 charge = str(args.charge).lower()
 allowed_pdgs = {
@@ -196,23 +209,22 @@ def delta_phi(phi1, phi2):
     return dphi
 
 # Get input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
-# Event loop
-for file in to_process:
+# Everything filled in the event loop, written as a partial output by --shard runs (the resolutions are booked after fitting)
+filled_hists = hists + [fResPt, fResE, fResPtStrict, fResEStrict]
+for r in regions:
+    filled_hists += [fResPtReg[r], fResEReg[r], fResPtRegStrict[r], fResERegStrict[r]]
+state = {'hists': {h.GetName(): h for h in filled_hists}}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
 
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+# Event loop
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
 
     for event in reader:
 
-        pfos = event.getCollection('PandoraPFOs')
         mcs  = event.getCollection('MCParticle')
 
         # Best MC pion
@@ -232,6 +244,8 @@ for file in to_process:
         if best_mc is None:
             continue
 
+        pfos = event.getCollection('PandoraPFOs')
+
         mcPDG = best_mc.getPDG()
         mcMom = best_mc.getMomentum()
         mcPt = best_mc_pt
@@ -347,6 +361,8 @@ for file in to_process:
 
     reader.close()
 
+write_partial(state, args)
+
 # Eff plots
 def make_eff(num, den, name, title, xtitle, rebin=False):
     if rebin:
@@ -410,6 +426,7 @@ for r in regions:
 output = TFile(args.outputFile, 'RECREATE')
 for h in hists:
     h.Write()
+write_sampling(state)
 output.Close()
 
 # png plots
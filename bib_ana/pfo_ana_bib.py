@@ -1,33 +1,35 @@
 # Comes from ethanmar/MuColl-TauStudy/analysis/pfo_matching.py
 # Run this code after the reco step on a pion gun
-from pyLCIO import IOIMPL
 from ROOT import TH1F, TFile, TCanvas, TLegend, gPad
 import math
 from argparse import ArgumentParser
 import os
 import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, collection_columns, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial, write_sampling
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 # args
 parser = ArgumentParser()
 parser.add_argument('-i', '--inputFile', type=str, default='output_reco.slcio')
 parser.add_argument('-o', '--outputFile', type=str, default='pfo_ana_bib.root')
+add_reader_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
 args = parser.parse_args()
 
-# function to get angle between two particles
-def angle_between(p1, p2):
-    # np.array copies the C++ data immediately
-    v1 = np.array(p1)
-    v2 = np.array(p2)
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['MCParticle', 'PandoraPFOs']
 
-    mag1 = np.linalg.norm(v1)
-    mag2 = np.linalg.norm(v2)
-
-    if mag1 == 0 or mag2 == 0:
-        return float("inf")
-
-    dot = np.dot(v1, v2)
-    cos_theta = np.clip(dot / (mag1 * mag2), -1.0, 1.0)
-    return np.arccos(cos_theta)
+# fill every value of an array with weight 1
+def fill_all(hist, values):
+    if len(values) == 0: return
+    hist.FillN(len(values), np.ascontiguousarray(values, dtype=np.float64), np.ones(len(values)))
 
 
 # histogram bookkeeping
@@ -54,8 +56,7 @@ hEnergyClose = {} # close pdg energy histogram
 ENERGY_BINS = 10000
 ENERGY_MAX = 10000
 
-total_pfos = 0
-total_close_pfos = 0
+totals = {'pfos': 0, 'close_pfos': 0}
 
 # simple charged pion and electron counters
 counters = {
@@ -68,93 +69,62 @@ counters = {
 }
 
 # get input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
-# event loop
-for file in to_process:
+# Everything filled in the event loop, saved in checkpoints and written as a partial output by --shard runs
+state = {'hPfoTheta': hPfoTheta, 'pdg_counts': pdg_counts, 'pdg_close_counts': pdg_close_counts,
+         'hEnergy': hEnergy, 'hEnergyClose': hEnergyClose, 'totals': totals, 'counters': counters}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
 
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+# event loop
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
 
     for event in reader:
 
-        MCParticles = event.getCollection('MCParticle')
-        if not MCParticles:
+        # whole collections as arrays, views into the event cache when reading one
+        mc = collection_columns(event, 'MCParticle', ['pdg', 'momentum'])
+        MCPiMoms = mc['momentum'][mc['pdg'] == 211] # get only mc pions
+        if len(MCPiMoms) == 0:
             continue
-        MCPis = [mc for mc in MCParticles if mc.getPDG() == 211] # get only mc pions
-        if not MCPis:
-            continue
-
-         # get highest pt pion
-        best_mc_pt = -1.0
-        MCPi = None
 
-        for mc in MCPis:
-            # Compute pt
-            MC_mom = mc.getMomentum()
-            px, py, pz = MC_mom[0], MC_mom[1], MC_mom[2]
-            pt = math.hypot(px, py)
-
-            # Check if this is the highest pt so far
-            if pt > best_mc_pt:
-                best_mc_pt = pt
-                MCPi = mc
+        # get highest pt pion
+        mcMom = MCPiMoms[np.argmax(np.hypot(MCPiMoms[:, 0], MCPiMoms[:, 1]))]
 
         # pfos
-        pfos = event.getCollection('PandoraPFOs')
-        if len(pfos) == 0:
+        pfos = collection_columns(event, 'PandoraPFOs', ['momentum', 'type', 'energy'])
+        moms = pfos['momentum']
+        if len(moms) == 0:
             continue
 
-        pfos_close = []
-        if MCPi is not None:
-            mcMom = MCPi.getMomentum()
-            mc_px, mc_py, mc_pz = mcMom[0], mcMom[1], mcMom[2]
-            if mcMom:  # Only proceed if MCPi momentum is valid
-                for pfo in pfos:
-                    pfoMom = pfo.getMomentum()
-                    pfo_px, pfo_py, pfo_pz = pfoMom[0], pfoMom[1], pfoMom[2]
-                    if pfoMom:  # Only proceed if PFO momentum is valid
-                        try:
-                            ang = angle_between((mc_px, mc_py, mc_pz), (pfo_px, pfo_py, pfo_pz))
-                            if ang < 0.1:
-                                pfos_close.append(pfo)
-                        except Exception as e:
-                            print("Skipping PFO due to error:", e)
-
-
-        total_pfos += len(pfos)
-        total_close_pfos += len(pfos_close)
+        # pfos within 0.1 rad of the mc pion (none for zero momenta)
+        mags = np.linalg.norm(moms, axis=1) * np.linalg.norm(mcMom)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_theta = np.clip(moms @ mcMom / mags, -1.0, 1.0)
+        close = (mags > 0) & (np.arccos(cos_theta) < 0.1)
 
-        counters["any_pfo"] += 1
+        totals['pfos'] += len(moms)
+        totals['close_pfos'] += int(np.count_nonzero(close))
 
-        pi_pfos = []
-        e_pfos = []
-
-        highest_pt = 0
-        highest_pt_type = None
-
-        for pfo in pfos:
+        counters["any_pfo"] += 1
 
-            mom = pfo.getMomentum()
-            px, py, pz = mom[0], mom[1], mom[2]
-            pt = math.hypot(px, py)
-            theta = math.atan2(pt, pz)
+        pt = np.hypot(moms[:, 0], moms[:, 1])
+        theta = np.arctan2(pt, moms[:, 2])
+        pdgs = np.abs(pfos['type'])
+        energies = pfos['energy']
 
-            pdg = abs(pfo.getType())
-            energy = pfo.getEnergy()
+        # Theta
+        fill_all(hPfoTheta, theta)
 
-            # Theta
-            hPfoTheta.Fill(theta)
+        for pdg in np.unique(pdgs).tolist():
+            of_pdg = pdgs == pdg
+            close_of_pdg = of_pdg & close
+            n_close = int(np.count_nonzero(close_of_pdg))
 
             # PDG counts
-            pdg_counts[pdg] = pdg_counts.get(pdg, 0) + 1
-            pdg_close_counts[pdg] = pdg_close_counts.get(pdg, 0) + (1 if pfo in pfos_close else 0)
+            pdg_counts[pdg] = pdg_counts.get(pdg, 0) + int(np.count_nonzero(of_pdg))
+            pdg_close_counts[pdg] = pdg_close_counts.get(pdg, 0) + n_close
 
             # energy hists
             if pdg not in hEnergy:
@@ -163,36 +133,33 @@ for file in to_process:
                          f"PFO Energy PDG {pdg};Energy [GeV];Counts",
                          ENERGY_BINS, 0, ENERGY_MAX)
                 )
-            if pdg not in hEnergyClose and pfo in pfos_close:
+            if pdg not in hEnergyClose and n_close:
                 hEnergyClose[pdg] = book(
                     TH1F(f"energy_close_pdg_{pdg}",
                          f"Close PFO Energy PDG {pdg};Energy [GeV];Counts",
                          ENERGY_BINS, 0, ENERGY_MAX)
                 )
 
-            hEnergy[pdg].Fill(energy)
-            if pfo in pfos_close: hEnergyClose[pdg].Fill(energy)
-
-            # pi vs electron events
-            if pdg == 211:
-                pi_pfos.append(pt)
-                if pt > highest_pt:
-                    highest_pt = pt
-                    highest_pt_type = pdg
-            elif pdg == 11:
-                e_pfos.append(pt)
-                if pt > highest_pt:
-                    highest_pt = pt
-                    highest_pt_type = pdg
+            fill_all(hEnergy[pdg], energies[of_pdg])
+            if n_close: fill_all(hEnergyClose[pdg], energies[close_of_pdg])
+
+        # pi vs electron events
+        is_pi = pdgs == 211
+        is_e = pdgs == 11
 
         # event categories
-        if pi_pfos and not e_pfos:
+        if is_pi.any() and not is_e.any():
             counters["pi_no_e"] += 1
-        elif e_pfos and not pi_pfos:
+        elif is_e.any() and not is_pi.any():
             counters["e_no_pi"] += 1
-        elif pi_pfos and e_pfos:
+        elif is_pi.any() and is_e.any():
             counters["pi_and_e"] += 1
 
+        # type of the highest pt charged pion or electron (first one if tied, none if all have zero pt)
+        charged_pt = np.where(is_pi | is_e, pt, 0)
+        highest = np.argmax(charged_pt)
+        highest_pt_type = pdgs[highest] if charged_pt[highest] > 0 else None
+
         if highest_pt_type == 211:
             counters["highest_pt_charged_pi"] += 1
         elif highest_pt_type == 11:
@@ -200,6 +167,12 @@ for file in to_process:
 
     reader.close()
 
+# energy histograms restored from partial outputs or a checkpoint, or filled by workers, still have to be booked
+for hist in list(hEnergy.values()) + list(hEnergyClose.values()):
+    if not any(hist is booked for booked in hists): book(hist)
+
+write_partial(state, args)
+
 # PDG count bar histogram
 pdgs_sorted = sorted(pdg_counts.keys(), reverse=True)
 pdgs_close_sorted = sorted(pdg_close_counts.keys(), reverse=True)
@@ -314,7 +287,7 @@ c_pdg_close.SaveAs("pdg_counts_close.png")
 
 # normalize PDG bar chart
 hPdgCountsNorm = hPdgCounts.Clone("hPdgCountsNorm")
-hPdgCountsNorm.Scale(1.0/total_pfos)
+hPdgCountsNorm.Scale(1.0/totals['pfos'])
 hPdgCountsNorm.GetYaxis().SetRangeUser(0, 1.1)
 c_pdg_norm = TCanvas("pdg_counts_norm", "PDG Counts Normalized", 800, 600)
 hPdgCountsNorm.Draw("BAR")
@@ -322,7 +295,7 @@ c_pdg_norm.SaveAs("pdg_counts_norm.png")
 
 # normalize close PDG bar chart
 hPdgCountsCloseNorm = hPdgCountsClose.Clone("hPdgCountsCloseNorm")
-hPdgCountsCloseNorm.Scale(1.0/total_close_pfos)
+hPdgCountsCloseNorm.Scale(1.0/totals['close_pfos'])
 hPdgCountsCloseNorm.GetYaxis().SetRangeUser(0, 1.1)
 c_pdg_norm = TCanvas("pdg_counts_close_norm", "Close PDG Counts Normalized", 800, 600)
 hPdgCountsCloseNorm.Draw("BAR")
@@ -337,6 +310,7 @@ c_theta.SaveAs("pfo_theta.png")
 output_file = TFile(args.outputFile, 'RECREATE')
 for hist in hists:
     hist.Write()
+write_sampling(state)
 output_file.Close()
 
 # Print counters
@@ -0,0 +1,167 @@
+# Dataset catalog: per-file event counts and collection inventory of a sample directory
+# Scan once (in parallel) with
+#   python catalog.py --inputFile <sample directory> --output <catalog.json> --jobs 8 [--shards N]
+# then pass --catalog <catalog.json> to any event-loop script to skip unusable files and pick the tau collection names
+import json
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from pyLCIO import IOIMPL
+
+from event_cache import CACHE_SUFFIX, CachedEventFile
+
+# Names used by the different TauFinder configurations for the same collection
+COLLECTION_ALIASES = {
+    'RecoTaus': 'TauRec_PFO',
+    'TauRec_PFO': 'RecoTaus',
+    'TauPFOLink': 'TauRecLink_PFO',
+    'TauRecLink_PFO': 'TauPFOLink',
+}
+
+
+def file_format(path):
+    if path.endswith('.slcio'): return 'slcio'
+    if path.endswith(CACHE_SUFFIX): return 'cache'
+    return None
+
+
+# Event count and collection inventory of one input file
+def scan_file(path):
+    stat = os.stat(path)
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'format': file_format(path),
+             'events': 0, 'collections': {}, 'error': None}
+    if entry['format'] is None:
+        entry['error'] = 'not an .slcio or event cache file'
+        return path, entry
+
+    try:
+        if entry['format'] == 'cache':
+            reader = CachedEventFile(path)
+        else:
+            reader = IOIMPL.LCFactory.getInstance().createLCReader()
+            reader.open(path)
+
+        collections = entry['collections']
+        for event in reader:
+            entry['events'] += 1
+            for name in event.getCollectionNames():
+                collection = event.getCollection(name)
+                n = collection.getNumberOfElements()
+                info = collections.setdefault(name, {'type': collection.getTypeName(), 'events': 0, 'total': 0, 'max': 0})
+                info['events'] += 1
+                info['total'] += n
+                info['max'] = max(info['max'], n)
+        reader.close()
+    except Exception as e:
+        entry['error'] = str(e)
+
+    if entry['events'] == 0 and entry['error'] is None:
+        entry['error'] = 'no events'
+    for name in ['RecoTaus', 'TauRec_PFO']:
+        if name in entry['collections']: entry['tau_collection'] = name
+    for name in ['TauPFOLink', 'TauRecLink_PFO']:
+        if name in entry['collections']: entry['tau_link'] = name
+    return path, entry
+
+
+def load_catalog(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_catalog(catalog, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Scan the files that are new or changed since the previous catalog, files are keyed by absolute path
+def build_catalog(files, previous=None, jobs=1):
+    catalog = {'files': {}}
+    to_scan = []
+    for file in map(os.path.abspath, files):
+        old = (previous or {}).get('files', {}).get(file)
+        stat = os.stat(file)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            catalog['files'][file] = old
+        else:
+            to_scan.append(file)
+
+    if jobs > 1 and len(to_scan) > 1:
+        with Pool(jobs) as pool:
+            results = list(pool.imap_unordered(scan_file, to_scan, chunksize=4))
+    else:
+        results = [scan_file(file) for file in to_scan]
+    for file, entry in results:
+        catalog['files'][file] = entry
+    return catalog
+
+
+# Name of each requested collection in this file ({} if the file uses the requested names),
+# None if a collection does not appear in the file under either name
+def collection_aliases(entry, collections):
+    aliases = {}
+    for name in collections:
+        for candidate in [name, COLLECTION_ALIASES.get(name)]:
+            info = entry['collections'].get(candidate)
+            if info is not None and info['events'] > 0:
+                if candidate != name: aliases[name] = candidate
+                break
+        else:
+            return None
+    return aliases
+
+
+def is_usable(entry, collections=()):
+    if entry['error'] is not None or entry['events'] == 0:
+        return False
+    return collection_aliases(entry, collections) is not None
+
+
+def get_entry(catalog, file):
+    return catalog['files'].get(os.path.abspath(file))
+
+
+def main():
+    parser = ArgumentParser(description='Catalog the files of a sample directory')
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help='Sample directory or single file')
+    parser.add_argument('-o', '--output', type=str, default='catalog.json', help='Catalog file, updated in place if it exists')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of files scanned in parallel')
+    parser.add_argument('--collections', type=str, nargs='*', default=[], help='Collections a file needs to be counted as usable')
+    parser.add_argument('--shards', type=int, default=0, help='Also write N file lists balanced by event count')
+    args = parser.parse_args()
+
+    files = []
+    if os.path.isdir(args.inputFile):
+        for r, d, f in os.walk(args.inputFile):
+            for file in f:
+                files.append(os.path.join(r, file))
+    else:
+        files.append(args.inputFile)
+    files = sorted(map(os.path.abspath, files))
+
+    previous = load_catalog(args.output) if os.path.exists(args.output) else None
+    catalog = build_catalog(files, previous, args.jobs)
+    save_catalog(catalog, args.output)
+
+    usable = [f for f in files if is_usable(catalog['files'][f], args.collections)]
+    n_events = sum(catalog['files'][f]['events'] for f in usable)
+    print(f"{len(files)} files, {len(usable)} usable with {n_events} events")
+    for f in files:
+        entry = catalog['files'][f]
+        if f not in usable:
+            print(f"  unusable: {f} ({entry['error'] or 'missing collections'})")
+
+    if args.shards > 0:
+        from event_io import shard_files # event_io imports this module
+        base = os.path.splitext(args.output)[0]
+        for i, shard in enumerate(shard_files(usable, args.shards, catalog, split=False)):
+            shard = sorted(file for file, positions in shard)
+            with open(f'{base}_shard{i}.txt', 'w') as f:
+                f.write('\n'.join(shard) + '\n')
+            print(f"  shard {i}: {len(shard)} files, {sum(catalog['files'][s]['events'] for s in shard)} events")
+
+
+if __name__ == '__main__':
+    main()
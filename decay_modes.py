@@ -0,0 +1,133 @@
+# Decay-mode catalog: the MC tau decay modes (tau_mc_link.getDecayMode) of every event, one bit per mode
+#   python decay_modes.py --inputFile <sample> --output decay_modes.npz
+# Scripts that take --modeFractions (see event_io.add_stratification_args) keep every event with a rare decay mode and
+# only a fraction of the events with common ones; the catalog is the cheap pre-pass that decides this, it only decodes
+# the MC particles
+import os
+from argparse import ArgumentParser
+import numpy as np
+import ROOT
+from pyLCIO import IOIMPL
+
+from event_cache import CACHE_SUFFIX, CachedEventFile
+from tau_mc_link import getDecayMode
+
+# Bit of the taus getDecayMode gives no mode for (tau-, unusual decays), modes 0-7 use bits 0-7
+OTHER_BIT = 8
+MODE_NAMES = {0: '1P0N', 1: '1P1N', 2: '1P2N', 3: '1P3N', 4: '3P0N', 5: '3P1N', 6: 'e', 7: 'mu', OTHER_BIT: 'other'}
+
+
+# Decay mode bits of the MC taus of one event, 0 for events without MC taus
+def event_mode_mask(mc_particles):
+    mask = 0
+    for mcp in mc_particles:
+        if abs(mcp.getPDG()) != 15: continue
+        mode = getDecayMode(mcp)
+        mask |= 1 << (OTHER_BIT if mode is None else mode)
+    return mask
+
+
+# Decay mode bits of all events of a file, in file order
+def scan_decay_modes(path):
+    if path.endswith(CACHE_SUFFIX):
+        reader = CachedEventFile(path, ['MCParticle'])
+    else:
+        reader = IOIMPL.LCFactory.getInstance().createLCReader()
+        read_names = ROOT.std.vector('string')() # only the MC particles are decoded
+        read_names.push_back('MCParticle')
+        reader.setReadCollectionNames(read_names)
+        reader.open(path)
+    masks = []
+    for event in reader:
+        try:
+            mc_particles = event.getCollection('MCParticle')
+        except Exception: # no MC particles in this event
+            masks.append(0)
+            continue
+        masks.append(event_mode_mask(mc_particles))
+    reader.close()
+    return np.array(masks, dtype=np.uint16)
+
+
+# {absolute path: {'size', 'mtime', 'masks'}}, files unchanged since the previous scan are not rescanned
+def build_decay_modes(files, previous=None):
+    modes = {}
+    for file in map(os.path.abspath, files):
+        stat = os.stat(file)
+        old = (previous or {}).get(file)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            modes[file] = old
+            continue
+        modes[file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'masks': scan_decay_modes(file)}
+    return modes
+
+
+def load_decay_modes(path):
+    modes = {}
+    with np.load(path) as data:
+        offsets = data['offsets']
+        for i, file in enumerate(data['files']):
+            modes[str(file)] = {'size': int(data['sizes'][i]), 'mtime': float(data['mtimes'][i]),
+                                'masks': data['masks'][offsets[i]:offsets[i + 1]]}
+    return modes
+
+
+def save_decay_modes(modes, path):
+    files = sorted(modes)
+    offsets = np.cumsum([0] + [len(modes[file]['masks']) for file in files])
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, files=np.array(files), offsets=offsets,
+             sizes=np.array([modes[file]['size'] for file in files], dtype=np.int64),
+             mtimes=np.array([modes[file]['mtime'] for file in files]),
+             masks=np.concatenate([modes[file]['masks'] for file in files] or [np.zeros(0, np.uint16)]))
+    os.replace(tmp_path, path)
+
+
+# Decay modes of the given files: loaded from (and, if files were added or changed, saved back to) path if given
+def get_decay_modes(files, path=None):
+    previous = load_decay_modes(path) if path and os.path.exists(path) else None
+    modes = build_decay_modes(files, previous)
+    if path and any(previous is None or previous.get(file) is not entry for file, entry in modes.items()):
+        previous = dict(previous or {})
+        previous.update(modes)
+        save_decay_modes(previous, path)
+    return modes
+
+
+# Fraction of the events to keep for each event: the largest fraction of its decay modes, so an event is kept whenever
+# one of its taus is in a rare mode; modes without a fraction (and events without MC taus) are kept completely
+def keep_fractions(masks, mode_fractions):
+    masks = np.asarray(masks)
+    fractions = np.where(masks == 0, 1.0, 0.0)
+    for bit in range(OTHER_BIT + 1):
+        has_mode = (masks & (1 << bit)) != 0
+        fractions = np.where(has_mode, np.maximum(fractions, mode_fractions.get(bit, 1.0)), fractions)
+    return fractions
+
+
+def main():
+    parser = ArgumentParser(description='Catalog the MC tau decay modes of every event of a sample')
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help='Sample directory or single file')
+    parser.add_argument('-o', '--output', type=str, default='decay_modes.npz', help='Decay-mode file, updated in place if it exists')
+    args = parser.parse_args()
+
+    files = []
+    if os.path.isdir(args.inputFile):
+        for r, d, f in os.walk(args.inputFile):
+            for file in f:
+                if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX):
+                    files.append(os.path.join(r, file))
+    else:
+        files.append(args.inputFile)
+    files.sort()
+
+    modes = get_decay_modes(files, args.output)
+    masks = np.concatenate([entry['masks'] for entry in modes.values()] or [np.zeros(0, np.uint16)])
+    print(f"Cataloged {len(masks)} events in {len(modes)} files, {np.count_nonzero(masks == 0)} without MC taus")
+    for bit, name in MODE_NAMES.items():
+        n_events = np.count_nonzero(masks & (1 << bit))
+        print(f"Mode {bit} ({name}): {n_events} events ({100 * n_events / max(len(masks), 1):.2f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Precision-targeted early stopping: stop reading events once the efficiencies of a script are measured well enough
+#   early_stop = EarlyStop([(hMatchedPt, hMCPt, rebins), (hMatchedEta, hMCEta)], args)
+#   for file, reader in worker_readers(...):
+#       for event in reader:
+#           if early_stop.stop_reading(): break
+#           ...
+#       reader.close()
+#       if early_stop.stopped: break
+#   early_stop.report()
+# Every --checkEvery events the uncertainty of every populated bin (denominator > 0) of the numerator/denominator pairs is
+# computed from the accumulated histograms; reading stops once their maximum (or median) is below --targetPrecision
+import math
+import numpy as np
+
+
+def add_early_stop_args(parser):
+    parser.add_argument('--targetPrecision', type=float, default=None,
+                        help='Stop reading once the efficiency uncertainty of the populated bins is below this (e.g. 0.01)')
+    parser.add_argument('--precisionStatistic', type=str, choices=['max', 'median'], default='max',
+                        help='Compare the largest or the median bin uncertainty with --targetPrecision')
+    parser.add_argument('--checkEvery', type=int, default=500, help='Number of events between precision checks')
+
+
+# (passed, total) per bin of a numerator/denominator pair, summed into the bins of edges if given (the plotted binning)
+# In effective entries (content^2 / error^2 of the denominator, the numerator scaled alike): the number of events for
+# unweighted fills, fewer than the sum of weights for weighted ones (--modeFractions, histograms with Sumw2)
+def _bin_counts(num, den, edges=None):
+    counts = [(num.GetBinContent(i), den.GetBinContent(i), den.GetBinError(i)**2, den.GetBinCenter(i))
+              for i in range(1, den.GetNbinsX() + 1)]
+    if edges is None:
+        merged = [(passed, total, error2) for passed, total, error2, _ in counts]
+    else:
+        merged = [[0.0, 0.0, 0.0] for _ in range(len(edges) - 1)]
+        for passed, total, error2, center in counts:
+            j = np.searchsorted(edges, center, side='right') - 1
+            if 0 <= j < len(merged):
+                merged[j][0] += passed
+                merged[j][1] += total
+                merged[j][2] += error2
+    effective = []
+    for passed, total, error2 in merged:
+        scale = total / error2 if total > 0 and error2 > 0 else 1.0
+        effective.append((passed * scale, total * scale))
+    return effective
+
+
+# Uncertainty of the efficiency in every populated bin: the standard deviation of the Bayesian efficiency with a flat
+# prior, which unlike the binomial error is not 0 for bins where all or none of the (few) entries pass
+def efficiency_uncertainties(num, den, edges=None):
+    uncertainties = []
+    for passed, total in _bin_counts(num, den, edges):
+        if total <= 0: continue
+        passed = min(max(passed, 0.0), total)
+        uncertainties.append(math.sqrt((passed + 1) * (total - passed + 1) / ((total + 2)**2 * (total + 3))))
+    return uncertainties
+
+
+class EarlyStop:
+    # pairs: (numerator, denominator) or (numerator, denominator, bin edges of the plot) of the efficiencies to watch
+    def __init__(self, pairs, args):
+        self.pairs = [(pair[0], pair[1], np.asarray(pair[2], dtype=float) if len(pair) > 2 else None) for pair in pairs]
+        self.target = args.targetPrecision
+        self.statistic = args.precisionStatistic
+        self.every = max(1, args.checkEvery)
+        self.n_events = 0
+        self.stopped = False
+        if self.target is not None and (getattr(args, 'filesPerWorker', 0) or getattr(args, 'maxWorkerMemory', 0)
+                                        or getattr(args, 'jobs', 1) > 1 or getattr(args, 'resultCache', None)):
+            raise ValueError('--targetPrecision needs all results in this process, it does not work with '
+                             '--jobs, --filesPerWorker, --maxWorkerMemory or --resultCache')
+
+    # Maximum or median uncertainty over all populated bins and their number, (None, 0) without any
+    def precision(self):
+        uncertainties = []
+        for num, den, edges in self.pairs:
+            uncertainties += efficiency_uncertainties(num, den, edges)
+        if not uncertainties:
+            return None, 0
+        value = max(uncertainties) if self.statistic == 'max' else float(np.median(uncertainties))
+        return value, len(uncertainties)
+
+    # Call before every event, True once the target precision is reached (the event is then not read)
+    def stop_reading(self):
+        if self.target is None:
+            return False
+        if self.n_events and self.n_events % self.every == 0:
+            value, _ = self.precision()
+            if value is not None and value < self.target:
+                self.stopped = True
+                return True
+        self.n_events += 1
+        return False
+
+    def report(self):
+        if self.target is None:
+            return
+        value, n_bins = self.precision()
+        achieved = f"{value:.4g}" if value is not None else 'none (no populated bins)'
+        status = 'reached, stopped reading' if self.stopped else 'not reached, read all events'
+        print(f"Efficiency precision ({self.statistic} uncertainty over {n_bins} populated bins): {achieved}, "
+              f"target {self.target:g} {status} after {self.n_events} events")
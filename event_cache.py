@@ -0,0 +1,478 @@
+# Columnar on-disk cache of the LCIO collections used by the analysis scripts
+# Convert once per sample:
+#   python event_cache.py --inputFile <.slcio file or directory> --outputDir <cache directory>
+# then point any event-loop script's --inputFile at the cache directory (or a single .npz file)
+import os
+import struct
+import zipfile
+from argparse import ArgumentParser
+import numpy as np
+import ROOT
+from pyLCIO import IOIMPL
+
+CACHE_SUFFIX = '.npz'
+
+# Collections written to the cache (both TauFinder naming conventions are kept)
+DEFAULT_COLLECTIONS = ['MCParticle', 'PandoraPFOs', 'RecoTaus', 'TauRec_PFO',
+                       'TauPFOLink', 'TauRecLink_PFO', 'RecoMCTruthLink']
+
+# LCIO type name -> cache kind
+KINDS = {'MCParticle': 'mc',
+         'ReconstructedParticle': 'reco',
+         'LCRelation': 'relation'}
+
+# Per-object columns of each kind, '*_counts' columns are stored as '*_offsets'
+FIELDS = {'mc': ['pdg', 'momentum', 'energy', 'charge', 'mass', 'generator_status',
+                 'parent_counts', 'parents', 'daughter_counts', 'daughters'],
+          'reco': ['type', 'momentum', 'energy', 'charge', 'mass', 'n_tracks',
+                   'particle_counts', 'particles_collection', 'particles_index'],
+          'relation': ['from_collection', 'from_index', 'to_collection', 'to_index', 'weight']}
+
+# Columns with one row per object (or relation), the others are indexed through their own offsets
+ROW_FIELDS = {'mc': ['pdg', 'momentum', 'energy', 'charge', 'mass', 'generator_status'],
+              'reco': ['type', 'momentum', 'energy', 'charge', 'mass', 'n_tracks'],
+              'relation': ['from_collection', 'from_index', 'to_collection', 'to_index', 'weight']}
+
+
+# Path of the cache file relative to the cache directory: the path of the input relative to the converted directory, so
+# files with the same name in different subdirectories (e.g. per-run *_0.slcio outputs) get different cache files
+def cache_name(slcio_path, input_dir=None):
+    name = os.path.relpath(slcio_path, input_dir) if input_dir is not None else os.path.basename(slcio_path)
+    return os.path.splitext(name)[0] + CACHE_SUFFIX
+
+
+def _to_offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+##################
+# Conversion
+##################
+
+# Fill the columns of one object collection for one event, returns {address: index}
+def _fill_objects(kind, collection, columns):
+    addresses = {}
+    for i, obj in enumerate(collection):
+        addresses[ROOT.addressof(obj)] = i
+        mom = obj.getMomentum()
+        columns['momentum'].append((mom[0], mom[1], mom[2]))
+        columns['energy'].append(obj.getEnergy())
+        columns['charge'].append(obj.getCharge())
+        columns['mass'].append(obj.getMass())
+        if kind == 'mc':
+            columns['pdg'].append(obj.getPDG())
+            columns['generator_status'].append(obj.getGeneratorStatus())
+        else:
+            columns['type'].append(obj.getType())
+            columns['n_tracks'].append(obj.getTracks().size())
+    return addresses
+
+
+# Resolve the object references (parents/daughters, tau particles, relations) of one event
+def _fill_references(kind, collection, columns, coll_id, address_maps):
+    def lookup(obj):
+        address = ROOT.addressof(obj)
+        for other_id, addresses in address_maps.items():
+            if address in addresses:
+                return other_id, addresses[address]
+        return -1, -1
+
+    n_unresolved = 0
+    for obj in collection:
+        if kind == 'mc':
+            own = address_maps[coll_id]
+            parents = [own[ROOT.addressof(p)] for p in obj.getParents() if ROOT.addressof(p) in own]
+            daughters = [own[ROOT.addressof(d)] for d in obj.getDaughters() if ROOT.addressof(d) in own]
+            columns['parents'].extend(parents)
+            columns['parent_counts'].append(len(parents))
+            columns['daughters'].extend(daughters)
+            columns['daughter_counts'].append(len(daughters))
+        elif kind == 'reco':
+            n = 0
+            for particle in obj.getParticles():
+                other_id, index = lookup(particle)
+                if other_id < 0:
+                    n_unresolved += 1
+                    continue
+                columns['particles_collection'].append(other_id)
+                columns['particles_index'].append(index)
+                n += 1
+            columns['particle_counts'].append(n)
+        else:
+            from_id, from_index = lookup(obj.getFrom())
+            to_id, to_index = lookup(obj.getTo())
+            if from_id < 0 or to_id < 0:
+                n_unresolved += 1
+                continue
+            columns['from_collection'].append(from_id)
+            columns['from_index'].append(from_index)
+            columns['to_collection'].append(to_id)
+            columns['to_index'].append(to_index)
+            columns['weight'].append(obj.getWeight())
+    return n_unresolved
+
+
+# compress=False writes a larger file whose columns are memory-mapped when read (see CachedEventFile)
+def convert_file(input_path, output_path, collections=DEFAULT_COLLECTIONS, compress=True):
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    read_names = ROOT.std.vector('string')() # skip decoding everything that is not cached
+    for name in collections:
+        read_names.push_back(name)
+    reader.setReadCollectionNames(read_names)
+    reader.open(input_path)
+
+    names = []  # cached collections, in order of first appearance
+    kinds = []
+    columns = {}
+    counts = {}
+    present = {}
+    event_numbers = []
+    run_numbers = []
+    n_unresolved = 0
+
+    for ievt, event in enumerate(reader):
+        event_numbers.append(event.getEventNumber())
+        run_numbers.append(event.getRunNumber())
+
+        event_collections = {}
+        for name in event.getCollectionNames():
+            if name not in collections: continue
+            collection = event.getCollection(name)
+            kind = KINDS.get(collection.getTypeName())
+            if kind is None: continue
+            if name not in names: # new collection, back-fill earlier events as absent
+                names.append(name)
+                kinds.append(kind)
+                columns[name] = {field: [] for field in FIELDS[kind]}
+                counts[name] = [0] * ievt
+                present[name] = [False] * ievt
+            event_collections[name] = collection
+
+        # objects first so that references can be resolved to (collection, index)
+        address_maps = {}
+        for coll_id, name in enumerate(names):
+            collection = event_collections.get(name)
+            present[name].append(collection is not None)
+            if kinds[coll_id] == 'relation': continue
+            counts[name].append(len(collection) if collection is not None else 0)
+            if collection is not None:
+                address_maps[coll_id] = _fill_objects(kinds[coll_id], collection, columns[name])
+
+        for coll_id, name in enumerate(names):
+            collection = event_collections.get(name)
+            n_before = len(columns[name]['weight']) if kinds[coll_id] == 'relation' else 0
+            if collection is not None:
+                n_unresolved += _fill_references(kinds[coll_id], collection, columns[name], coll_id, address_maps)
+            if kinds[coll_id] == 'relation': # unresolved relations are dropped, count what was kept
+                counts[name].append(len(columns[name]['weight']) - n_before)
+
+    reader.close()
+
+    arrays = {
+        'collections': np.array(names, dtype=str),
+        'kinds': np.array(kinds, dtype=str),
+        'event_number': np.array(event_numbers, dtype=np.int32),
+        'run_number': np.array(run_numbers, dtype=np.int32),
+    }
+    dtypes = {'momentum': np.float64, 'energy': np.float64, 'charge': np.float32, 'mass': np.float64,
+              'weight': np.float32, 'particles_collection': np.int16, 'from_collection': np.int16,
+              'to_collection': np.int16}
+    for name, kind in zip(names, kinds):
+        arrays[f'{name}.offsets'] = _to_offsets(counts[name])
+        arrays[f'{name}.present'] = np.array(present[name], dtype=bool)
+        for field, values in columns[name].items():
+            if field.endswith('_counts'): # stored as offsets
+                arrays[f'{name}.{field[:-len("_counts")]}_offsets'] = _to_offsets(values)
+                continue
+            array_ = np.array(values, dtype=dtypes.get(field, np.int32))
+            if field == 'momentum': array_ = array_.reshape(-1, 3)
+            arrays[f'{name}.{field}'] = array_
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+    os.replace(tmp_path, output_path)
+
+    return len(event_numbers), n_unresolved
+
+
+##################
+# Reading
+##################
+
+class CachedVector(list):
+    # LCIO vectors are used with len() and .size() interchangeably
+    def size(self):
+        return len(self)
+
+
+class CachedMCParticle:
+    __slots__ = ('_event', '_coll_id', '_index', '_row')
+
+    def __init__(self, event, coll_id, index, row):
+        self._event = event
+        self._coll_id = coll_id
+        self._index = index
+        self._row = row
+
+    def _column(self, field):
+        return self._event._column(self._coll_id, field)
+
+    def _related(self, field, offsets_field):
+        offsets = self._column(offsets_field)
+        indices = self._column(field)[offsets[self._row]:offsets[self._row + 1]]
+        return CachedVector(self._event._object(self._coll_id, int(i)) for i in indices)
+
+    def getPDG(self): return int(self._column('pdg')[self._row])
+    def getMomentum(self): return self._column('momentum')[self._row].tolist()
+    def getEnergy(self): return float(self._column('energy')[self._row])
+    def getCharge(self): return float(self._column('charge')[self._row])
+    def getMass(self): return float(self._column('mass')[self._row])
+    def getGeneratorStatus(self): return int(self._column('generator_status')[self._row])
+    def getParents(self): return self._related('parents', 'parent_offsets')
+    def getDaughters(self): return self._related('daughters', 'daughter_offsets')
+
+
+class CachedReconstructedParticle:
+    __slots__ = ('_event', '_coll_id', '_index', '_row')
+
+    def __init__(self, event, coll_id, index, row):
+        self._event = event
+        self._coll_id = coll_id
+        self._index = index
+        self._row = row
+
+    def _column(self, field):
+        return self._event._column(self._coll_id, field)
+
+    def getType(self): return int(self._column('type')[self._row])
+    def getMomentum(self): return self._column('momentum')[self._row].tolist()
+    def getEnergy(self): return float(self._column('energy')[self._row])
+    def getCharge(self): return float(self._column('charge')[self._row])
+    def getMass(self): return float(self._column('mass')[self._row])
+    def getTracks(self): return CachedVector([None] * int(self._column('n_tracks')[self._row])) # track content is not cached
+
+    def getParticles(self):
+        offsets = self._column('particle_offsets')
+        start, stop = offsets[self._row], offsets[self._row + 1]
+        coll_ids = self._column('particles_collection')[start:stop]
+        indices = self._column('particles_index')[start:stop]
+        return CachedVector(self._event._object(int(c), int(i)) for c, i in zip(coll_ids, indices))
+
+
+class CachedCollection(list):
+    def __init__(self, type_name, objects):
+        super().__init__(objects)
+        self.type_name = type_name
+
+    def getTypeName(self): return self.type_name
+    def getNumberOfElements(self): return len(self)
+    def getElementAt(self, i): return self[i]
+
+
+class CachedRelation:
+    def __init__(self, event, coll_id):
+        self.event = event
+        self.coll_id = coll_id
+
+    def getTypeName(self): return 'LCRelation'
+
+    def getNumberOfElements(self):
+        start, stop = self.event._range(self.coll_id)
+        return stop - start
+
+    # (from object, to object, weight) for every relation of the event
+    def entries(self):
+        start, stop = self.event._range(self.coll_id)
+        column = lambda field: self.event._column(self.coll_id, field)[start:stop]
+        for from_id, from_index, to_id, to_index, weight in zip(column('from_collection'), column('from_index'),
+                                                                column('to_collection'), column('to_index'),
+                                                                column('weight')):
+            yield (self.event._object(int(from_id), int(from_index)),
+                   self.event._object(int(to_id), int(to_index)),
+                   float(weight))
+
+
+# Same interface as UTIL.LCRelationNavigator for the cached relations
+class CachedRelationNavigator:
+    def __init__(self, relation):
+        self.to_map = {}
+        self.from_map = {}
+        for from_obj, to_obj, weight in relation.entries():
+            self.to_map.setdefault(id(from_obj), []).append((to_obj, weight))
+            self.from_map.setdefault(id(to_obj), []).append((from_obj, weight))
+
+    def getRelatedToObjects(self, obj): return CachedVector(o for o, w in self.to_map.get(id(obj), []))
+    def getRelatedToWeights(self, obj): return CachedVector(w for o, w in self.to_map.get(id(obj), []))
+    def getRelatedFromObjects(self, obj): return CachedVector(o for o, w in self.from_map.get(id(obj), []))
+    def getRelatedFromWeights(self, obj): return CachedVector(w for o, w in self.from_map.get(id(obj), []))
+
+
+class CachedEvent:
+    def __init__(self, source, index):
+        self._source = source
+        self._index = index
+        self._objects = {}     # (coll_id, index) -> object, so identity comparisons behave like pyLCIO
+        self._collections = {}
+
+    def _column(self, coll_id, field):
+        return self._source.column(self._source.collections[coll_id], field)
+
+    def _range(self, coll_id):
+        offsets = self._column(coll_id, 'offsets')
+        return int(offsets[self._index]), int(offsets[self._index + 1])
+
+    def _object(self, coll_id, index):
+        key = (coll_id, index)
+        obj = self._objects.get(key)
+        if obj is None:
+            cls = CachedMCParticle if self._source.kinds[coll_id] == 'mc' else CachedReconstructedParticle
+            obj = cls(self, coll_id, index, self._range(coll_id)[0] + index)
+            self._objects[key] = obj
+        return obj
+
+    def getEventNumber(self): return int(self._source.column(None, 'event_number')[self._index])
+    def getRunNumber(self): return int(self._source.column(None, 'run_number')[self._index])
+
+    def getCollectionNames(self):
+        return [name for name in self._source.collections
+                if self._source.is_readable(name) and self._source.column(name, 'present')[self._index]]
+
+    def getCollection(self, name):
+        if name in self._collections:
+            return self._collections[name]
+        if not self._source.is_readable(name) or not self._source.column(name, 'present')[self._index]:
+            raise KeyError(f'Collection {name} not available in cached event {self.getEventNumber()}')
+
+        coll_id = self._source.collections.index(name)
+        kind = self._source.kinds[coll_id]
+        if kind == 'relation':
+            collection = CachedRelation(self, coll_id)
+        else:
+            start, stop = self._range(coll_id)
+            type_name = 'MCParticle' if kind == 'mc' else 'ReconstructedParticle'
+            collection = CachedCollection(type_name, (self._object(coll_id, i) for i in range(stop - start)))
+        self._collections[name] = collection
+        return collection
+
+    # Columns of a collection in this event as views of the file's arrays, no objects are made and nothing is copied:
+    #   momenta = event.getColumns('PandoraPFOs', ['momentum'])['momentum'] # (n, 3)
+    def getColumns(self, name, fields=None):
+        if not self._source.is_readable(name) or not self._source.column(name, 'present')[self._index]:
+            raise KeyError(f'Collection {name} not available in cached event {self.getEventNumber()}')
+        coll_id = self._source.collections.index(name)
+        start, stop = self._range(coll_id)
+        return {field: self._column(coll_id, field)[start:stop] for field in fields or ROW_FIELDS[self._source.kinds[coll_id]]}
+
+
+# Uncompressed members of an .npz file: {column: (file offset of the data, shape, fortran order, dtype)}
+# Their data is stored as is in the file, so it can be mapped instead of read
+def _stored_members(path):
+    members = {}
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'): continue
+            f.seek(info.header_offset + 26) # name and extra field lengths of the local file header
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or 0 in shape: continue
+            members[info.filename[:-len('.npy')]] = (f.tell(), shape, fortran_order, dtype)
+    return members
+
+
+# Iterable like an LCReader, yields CachedEvent objects
+# Columns of uncompressed files (event_cache.py --uncompressed) are memory-mapped: they are read-only views of the file,
+# only the pages that are used are read and all processes reading the same file share them through the page cache
+class CachedEventFile:
+    def __init__(self, path, read_collections=None):
+        self.path = path
+        self.data = np.load(path)
+        self.stored = _stored_members(path)
+        self.collections = [str(name) for name in self.data['collections']]
+        self.kinds = [str(kind) for kind in self.data['kinds']]
+        self.read_collections = read_collections # like LCReader.setReadCollectionNames, None reads everything
+        self._columns = {}
+
+    def is_readable(self, name):
+        return name in self.collections and (self.read_collections is None or name in self.read_collections)
+
+    # Columns are mapped or decompressed on first use only
+    def column(self, collection, field):
+        key = field if collection is None else f'{collection}.{field}'
+        if key not in self._columns:
+            if key in self.stored:
+                offset, shape, fortran_order, dtype = self.stored[key]
+                self._columns[key] = np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                               order='F' if fortran_order else 'C')
+            else:
+                self._columns[key] = self.data[key]
+        return self._columns[key]
+
+    # Decompress (or map) every readable column now, used to decode files ahead of time
+    def preload(self):
+        for key in self.data.files:
+            collection, _, field = key.rpartition('.')
+            if collection and not self.is_readable(collection): continue
+            self.column(collection or None, field)
+
+    def getNumberOfEvents(self):
+        return len(self.column(None, 'event_number'))
+
+    def getEvent(self, position):
+        return CachedEvent(self, position)
+
+    def __iter__(self):
+        for i in range(self.getNumberOfEvents()):
+            yield CachedEvent(self, i)
+
+    def close(self):
+        self._columns = {}
+        self.data.close()
+
+
+def main():
+    parser = ArgumentParser(description='Convert .slcio files to the columnar event cache')
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help='.slcio file or directory of .slcio files')
+    parser.add_argument('-o', '--outputDir', type=str, default='event_cache', help='Directory the .npz cache files are written to')
+    parser.add_argument('--collections', type=str, nargs='+', default=DEFAULT_COLLECTIONS, help='Collections to cache')
+    parser.add_argument('--force', action='store_true', help='Rewrite cache files that are newer than their input')
+    parser.add_argument('--uncompressed', action='store_true',
+                        help='Write uncompressed files, read by memory-mapping them instead of decompressing')
+    args = parser.parse_args()
+
+    to_process = []
+    input_dir = args.inputFile if os.path.isdir(args.inputFile) else None
+    if input_dir is not None:
+        for r, d, f in os.walk(args.inputFile):
+            for file in f:
+                if file.endswith('.slcio'):
+                    to_process.append(os.path.join(r, file))
+    else:
+        to_process.append(args.inputFile)
+
+    os.makedirs(args.outputDir, exist_ok=True)
+
+    for file in sorted(to_process):
+        output_path = os.path.join(args.outputDir, cache_name(file, input_dir))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if not args.force and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(file):
+            continue # already converted
+        try:
+            n_events, n_unresolved = convert_file(file, output_path, args.collections, not args.uncompressed)
+        except Exception as e:
+            print(f"Skipping {file}: {e}")
+            continue
+        print(f"{file} -> {output_path} ({n_events} events)")
+        if n_unresolved:
+            print(f"  {n_unresolved} references to objects outside the cached collections were dropped")
+
+
+if __name__ == '__main__':
+    main()
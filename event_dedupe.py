@@ -0,0 +1,140 @@
+# Event fingerprints: one uint64 per event from its run and event number and the momenta of its MC particles, used to
+# find events that are read twice (samples holding both the original files and merged copies of them)
+#   python event_dedupe.py --inputFile <sample> --output fingerprints.npz
+# Scripts skip the duplicates with --dedupe fingerprints.npz (see event_io.add_reader_args): of all events with the same
+# fingerprint only the first one in reading order is kept
+import hashlib
+import os
+from argparse import ArgumentParser
+import numpy as np
+import ROOT
+from pyLCIO import IOIMPL
+
+from event_cache import CACHE_SUFFIX
+
+
+# Momenta are hashed as float32 so LCIO and cache files give the same fingerprint
+def event_fingerprint(run, event, momenta):
+    digest = hashlib.blake2b(np.array([run, event], dtype=np.int64).tobytes(), digest_size=8)
+    digest.update(np.ascontiguousarray(momenta, dtype=np.float32).tobytes())
+    return int.from_bytes(digest.digest(), 'little')
+
+
+# Fingerprints of all events of a file, in file order
+def scan_fingerprints(path):
+    if path.endswith(CACHE_SUFFIX):
+        with np.load(path) as data:
+            runs, events = data['run_number'].tolist(), data['event_number'].tolist()
+            if 'MCParticle.momentum' in data.files:
+                momenta, offsets = data['MCParticle.momentum'], data['MCParticle.offsets']
+            else:
+                momenta, offsets = np.zeros((0, 3)), np.zeros(len(events) + 1, dtype=np.int64)
+            return np.array([event_fingerprint(run, event, momenta[offsets[i]:offsets[i + 1]])
+                             for i, (run, event) in enumerate(zip(runs, events))], dtype=np.uint64)
+
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    read_names = ROOT.std.vector('string')() # only the MC particles are decoded
+    read_names.push_back('MCParticle')
+    reader.setReadCollectionNames(read_names)
+    reader.open(path)
+    fingerprints = []
+    for event in reader:
+        try:
+            momenta = [tuple(mcp.getMomentum()[i] for i in range(3)) for mcp in event.getCollection('MCParticle')]
+        except Exception: # no MC particles in this event
+            momenta = []
+        fingerprints.append(event_fingerprint(event.getRunNumber(), event.getEventNumber(), np.array(momenta).reshape(-1, 3)))
+    reader.close()
+    return np.array(fingerprints, dtype=np.uint64)
+
+
+# {absolute path: {'size', 'mtime', 'fingerprints'}}, files unchanged since the previous scan are not rescanned
+def build_fingerprints(files, previous=None):
+    fingerprints = {}
+    for file in map(os.path.abspath, files):
+        stat = os.stat(file)
+        old = (previous or {}).get(file)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            fingerprints[file] = old
+            continue
+        fingerprints[file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'fingerprints': scan_fingerprints(file)}
+    return fingerprints
+
+
+def load_fingerprints(path):
+    fingerprints = {}
+    with np.load(path) as data:
+        offsets = data['offsets']
+        for i, file in enumerate(data['files']):
+            fingerprints[str(file)] = {'size': int(data['sizes'][i]), 'mtime': float(data['mtimes'][i]),
+                                       'fingerprints': data['fingerprints'][offsets[i]:offsets[i + 1]]}
+    return fingerprints
+
+
+def save_fingerprints(fingerprints, path):
+    files = sorted(fingerprints)
+    offsets = np.cumsum([0] + [len(fingerprints[file]['fingerprints']) for file in files])
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, files=np.array(files), offsets=offsets,
+             sizes=np.array([fingerprints[file]['size'] for file in files], dtype=np.int64),
+             mtimes=np.array([fingerprints[file]['mtime'] for file in files]),
+             fingerprints=np.concatenate([fingerprints[file]['fingerprints'] for file in files] or [np.zeros(0, np.uint64)]))
+    os.replace(tmp_path, path)
+
+
+# Fingerprints of the given files: loaded from (and, if files were added or changed, saved back to) path if given
+def get_fingerprints(files, path=None):
+    previous = load_fingerprints(path) if path and os.path.exists(path) else None
+    fingerprints = build_fingerprints(files, previous)
+    if path and any(previous is None or previous.get(file) is not entry for file, entry in fingerprints.items()):
+        previous = dict(previous or {})
+        previous.update(fingerprints)
+        save_fingerprints(previous, path)
+    return fingerprints
+
+
+# Read positions of the duplicate events of each file {file: (number of events, sorted positions)}, files read in the
+# given order; an event is a duplicate if an event with the same fingerprint comes earlier (in this or an earlier file)
+def find_duplicates(fingerprints, files):
+    files = [os.path.abspath(file) for file in files]
+    values = np.concatenate([fingerprints[file]['fingerprints'] for file in files] or [np.zeros(0, np.uint64)])
+    duplicate = np.ones(len(values), dtype=bool)
+    duplicate[np.unique(values, return_index=True)[1]] = False # first occurrence of every fingerprint
+    duplicates = {}
+    begin = 0
+    for file in files:
+        n_events = len(fingerprints[file]['fingerprints'])
+        positions = np.flatnonzero(duplicate[begin:begin + n_events])
+        if len(positions):
+            duplicates[file] = (n_events, positions)
+        begin += n_events
+    return duplicates
+
+
+def main():
+    parser = ArgumentParser(description='Fingerprint the events of a sample and report the duplicates')
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help='Sample directory or single file')
+    parser.add_argument('-o', '--output', type=str, default='fingerprints.npz', help='Fingerprint file, updated in place if it exists')
+    args = parser.parse_args()
+
+    files = []
+    if os.path.isdir(args.inputFile):
+        for r, d, f in os.walk(args.inputFile):
+            for file in f:
+                if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX):
+                    files.append(os.path.join(r, file))
+    else:
+        files.append(args.inputFile)
+    files.sort()
+
+    fingerprints = get_fingerprints(files, args.output)
+    duplicates = find_duplicates(fingerprints, files)
+    n_events = sum(len(entry['fingerprints']) for entry in fingerprints.values())
+    print(f"Fingerprinted {n_events} events in {len(fingerprints)} files")
+    for file, (n_file_events, positions) in sorted(duplicates.items()):
+        print(f"{file}: {len(positions)} of {n_file_events} events already seen")
+    print(f"{sum(len(positions) for _, positions in duplicates.values())} duplicate events")
+
+
+if __name__ == '__main__':
+    main()
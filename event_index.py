@@ -0,0 +1,163 @@
+# Event index: (file, run, event number) -> read position of the event in its file
+#   python event_index.py --inputFile <sample> --output event_index.npz
+#   python event_index.py --output event_index.npz --events 1:42 outliers.txt   (print where events are)
+# Scripts use it through --events (and --eventIndex) to read only the listed events, see event_io.add_reader_args
+import os
+from argparse import ArgumentParser
+import numpy as np
+import ROOT
+from pyLCIO import IOIMPL
+
+from event_cache import CACHE_SUFFIX
+
+# Bumped when the positions of an existing index can be wrong, older index files are then rebuilt
+# 2: positions from reading the file; the LCIO run/event map (getEvents) is sorted by (run, event) and drops duplicates
+INDEX_VERSION = 2
+
+
+# Run and event numbers of all events of a file, in file order (positions are the skipNEvents offsets)
+# Only the event headers are decoded, no collection matches the read names
+def scan_events(path):
+    if path.endswith(CACHE_SUFFIX):
+        with np.load(path) as data:
+            return data['run_number'].astype(np.int64), data['event_number'].astype(np.int64)
+
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    read_names = ROOT.std.vector('string')()
+    read_names.push_back('__event_header_only__')
+    reader.setReadCollectionNames(read_names)
+    reader.open(path)
+    numbers = [(event.getRunNumber(), event.getEventNumber()) for event in reader]
+    reader.close()
+    runs = np.array([run for run, _ in numbers], dtype=np.int64)
+    events = np.array([event for _, event in numbers], dtype=np.int64)
+    return runs, events
+
+
+# {absolute path: {'size', 'mtime', 'runs', 'events'}}, files unchanged since the previous index are not rescanned
+def build_index(files, previous=None):
+    index = {}
+    for file in map(os.path.abspath, files):
+        stat = os.stat(file)
+        old = (previous or {}).get(file)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            index[file] = old
+            continue
+        runs, events = scan_events(file)
+        index[file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'runs': runs, 'events': events}
+    return index
+
+
+def load_index(path):
+    index = {}
+    with np.load(path) as data:
+        if 'version' not in data or int(data['version']) != INDEX_VERSION:
+            print(f"Rebuilding {path}, it was written by an older version")
+            return index
+        offsets = data['offsets']
+        for i, file in enumerate(data['files']):
+            index[str(file)] = {'size': int(data['sizes'][i]), 'mtime': float(data['mtimes'][i]),
+                                'runs': data['runs'][offsets[i]:offsets[i + 1]],
+                                'events': data['events'][offsets[i]:offsets[i + 1]]}
+    return index
+
+
+def save_index(index, path):
+    files = sorted(index)
+    offsets = np.cumsum([0] + [len(index[file]['events']) for file in files])
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, version=INDEX_VERSION, files=np.array(files), offsets=offsets,
+             sizes=np.array([index[file]['size'] for file in files], dtype=np.int64),
+             mtimes=np.array([index[file]['mtime'] for file in files]),
+             runs=np.concatenate([index[file]['runs'] for file in files] or [np.zeros(0, np.int64)]),
+             events=np.concatenate([index[file]['events'] for file in files] or [np.zeros(0, np.int64)]))
+    os.replace(tmp_path, path)
+
+
+# Index of the given files: loaded from (and, if files were added or changed, saved back to) path if given, built otherwise
+def get_index(files, path=None):
+    previous = load_index(path) if path and os.path.exists(path) else None
+    index = build_index(files, previous)
+    if path and any(previous is None or previous.get(file) is not entry for file, entry in index.items()):
+        previous = dict(previous or {})
+        previous.update(index)
+        save_index(previous, path)
+    return index
+
+
+# Events to read, from "run:event" or "event" tokens and/or text files with "file run event", "run event" or "event" lines
+# (the event lists written by skim.py) -> list of (absolute file or None for any file, run or None for any run, event)
+def parse_event_list(specs):
+    selection = []
+    for spec in specs:
+        if os.path.isfile(spec):
+            with open(spec) as f:
+                for line in f:
+                    fields = line.split()
+                    if not fields or fields[0].startswith('#'): continue
+                    if len(fields) == 1:
+                        selection.append((None, None, int(fields[0])))
+                    elif len(fields) == 2:
+                        selection.append((None, int(fields[0]), int(fields[1])))
+                    else:
+                        selection.append((os.path.abspath(fields[0]), int(fields[1]), int(fields[2])))
+        elif ':' in spec:
+            run, _, event = spec.partition(':')
+            selection.append((None, int(run), int(event)))
+        else:
+            selection.append((None, None, int(spec)))
+    return selection
+
+
+# Read positions of the selected events in each file {file: sorted positions}, and the selected events that were not found
+def find_events(index, selection):
+    lookup = {}
+    for file, entry in index.items():
+        for position, (run, event) in enumerate(zip(entry['runs'].tolist(), entry['events'].tolist())):
+            lookup.setdefault((run, event), []).append((file, position))
+            lookup.setdefault((None, event), []).append((file, position))
+
+    positions = {}
+    missing = []
+    for file, run, event in selection:
+        found = [(f, p) for f, p in lookup.get((run, event), []) if file is None or f == file]
+        if not found:
+            missing.append((file, run, event))
+        for f, p in found:
+            positions.setdefault(f, set()).add(p)
+    return {file: sorted(p) for file, p in positions.items()}, missing
+
+
+def main():
+    parser = ArgumentParser(description='Build the event index of a sample or look events up in it')
+    parser.add_argument('-i', '--inputFile', type=str, default=None, help='Sample directory or single file to index')
+    parser.add_argument('-o', '--output', type=str, default='event_index.npz', help='Index file, updated in place if it exists')
+    parser.add_argument('--events', type=str, nargs='*', default=[], help='Print the file and position of these events')
+    args = parser.parse_args()
+
+    if args.inputFile is not None:
+        files = []
+        if os.path.isdir(args.inputFile):
+            for r, d, f in os.walk(args.inputFile):
+                for file in f:
+                    if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX):
+                        files.append(os.path.join(r, file))
+        else:
+            files.append(args.inputFile)
+        index = get_index(files, args.output)
+        print(f"Indexed {sum(len(entry['events']) for entry in index.values())} events in {len(index)} files")
+    else:
+        index = load_index(args.output)
+
+    if args.events:
+        positions, missing = find_events(index, parse_event_list(args.events))
+        for file, file_positions in sorted(positions.items()):
+            for position in file_positions:
+                entry = index[file]
+                print(f"{file} run {entry['runs'][position]} event {entry['events'][position]} at position {position}")
+        for file, run, event in missing:
+            print(f"not found: run {run} event {event}" + (f" in {file}" if file else ''))
+
+
+if __name__ == '__main__':
+    main()
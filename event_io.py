@@ -0,0 +1,519 @@
+# Shared input helpers for the event-loop scripts
+# Scripts outside the repository root add it to sys.path before importing this module
+import math
+import os
+import queue
+import threading
+from argparse import ArgumentTypeError
+import numpy as np
+import ROOT
+from pyLCIO import IOIMPL, UTIL
+
+from event_cache import CACHE_SUFFIX, CachedEvent, CachedEventFile, CachedRelation, CachedRelationNavigator
+from catalog import collection_aliases, get_entry, load_catalog
+from event_index import find_events, get_index, parse_event_list
+from event_dedupe import find_duplicates, get_fingerprints
+from decay_modes import get_decay_modes, keep_fractions
+
+
+# Check if input file is a directory, a file list (.txt, one path per line, e.g. a shard written by catalog.py) or a single file
+def get_input_files(input_path):
+    to_process = []
+    if os.path.isdir(input_path):
+        for r, d, f in os.walk(input_path):
+            for file in f:
+                to_process.append(os.path.join(r, file))
+    elif input_path.endswith('.txt'):
+        with open(input_path) as f:
+            to_process = [line.strip() for line in f if line.strip()]
+    else:
+        to_process.append(input_path)
+    return to_process
+
+
+# Collections holding the objects another collection points to, LCIO leaves those pointers unresolved if they are not read
+COLLECTION_DEPENDENCIES = {
+    'RecoTaus': ['PandoraPFOs'],
+    'TauRec_PFO': ['PandoraPFOs'],
+    'TauPFOLink': ['RecoTaus', 'PandoraPFOs'],
+    'TauRecLink_PFO': ['TauRec_PFO', 'PandoraPFOs'],
+    'RecoMCTruthLink': ['PandoraPFOs', 'MCParticle'],
+}
+
+
+# Declared collections plus everything they point to
+def read_collection_names(collections):
+    names = []
+    to_add = list(collections)
+    while to_add:
+        name = to_add.pop(0)
+        if name in names: continue
+        names.append(name)
+        to_add.extend(COLLECTION_DEPENDENCIES.get(name, []))
+    return names
+
+
+# Event handed to the scripts: collections are looked up under the names this file uses (see catalog.collection_aliases),
+# fetched on first use and kept for the rest of the event, and so are the relation navigators built from them:
+#   mcTau = getLinkedMCTau(reco_tau, event.navigator('TauPFOLink'), event.navigator('RecoMCTruthLink'))
+# Events rejected before a collection or navigator is used never pay for it
+# weight is the number of events this one stands for in a --modeFractions run (1 otherwise), to be used in every Fill
+class LazyEvent:
+    def __init__(self, event, aliases=None, weight=1):
+        self._event = event
+        self._aliases = aliases or {}
+        self.weight = weight
+        self._collections = {}
+        self._navigators = {}
+
+    def getCollection(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self._event.getCollection(self._aliases.get(name, name))
+        return collection
+
+    def navigator(self, name):
+        navigator = self._navigators.get(name)
+        if navigator is None:
+            navigator = self._navigators[name] = make_navigator(self.getCollection(name))
+        return navigator
+
+    # The wrapped LCIO (or cache) event, for calls that need the event itself such as LCWriter.writeEvent
+    @property
+    def event(self):
+        return self._event
+
+    def __getattr__(self, name):
+        return getattr(self._event, name)
+
+
+# Input file opened by open_reader, iterates over events like the underlying LCIO or cache reader
+# If positions is given only the events at those read positions (see event_index.py) are read
+# sampled_from is the number of events the positions were sampled from (--sampleFraction/--maxEvents/--modeFractions),
+# weights the weight of the event at each position
+# If sampling is set (a state['sampling'] dict, see workers._count_sampling) every event is counted in it once the next
+# event is asked for, so an event loop that stops partway through the file (break) only counts the events it used
+class EventReader:
+    def __init__(self, reader, aliases=None, positions=None, sampled_from=None, weights=None):
+        self.reader = reader
+        self.aliases = aliases or {}
+        self.positions = positions
+        self.sampled_from = sampled_from
+        self.weights = weights
+        self.sampling = None
+
+    def _events(self):
+        if self.positions is None:
+            yield from self.reader
+        elif isinstance(self.reader, CachedEventFile):
+            for position in self.positions:
+                yield self.reader.getEvent(position)
+        else: # LCIO skips the records in between without decoding them
+            next_position = 0
+            for position in self.positions:
+                if position > next_position:
+                    self.reader.skipNEvents(position - next_position)
+                event = self.reader.readNextEvent()
+                if event is None: return
+                next_position = position + 1
+                yield event
+
+    def __iter__(self):
+        weights = iter(self.weights) if self.weights is not None else None
+        for k, event in enumerate(self._events()):
+            weight = next(weights) if weights is not None else 1
+            yield LazyEvent(event, self.aliases, weight)
+            if self.sampling is not None: # the events sampled from are shared out over the positions, in whole events
+                n_positions = len(self.positions)
+                self.sampling['events'] += self.sampled_from * (k + 1) // n_positions - self.sampled_from * k // n_positions
+                self.sampling['sampled'] += 1
+                self.sampling['weighted'] += weight
+
+    def getNumberOfEvents(self):
+        return self.reader.getNumberOfEvents()
+
+    def close(self):
+        self.reader.close()
+
+
+# Open a .slcio file with LCIO or a cache file written by event_cache.py, both iterate over events
+# If collections is given only those (and the collections they point to) are decoded, the rest of the event is skipped
+# aliases maps the collection names used by the script to the names used in this file, positions selects events
+def open_reader(file, collections=None, aliases=None, positions=None, sampled_from=None, weights=None):
+    aliases = aliases or {}
+    names = read_collection_names([aliases.get(name, name) for name in collections]) if collections else None
+    if file.endswith(CACHE_SUFFIX):
+        return EventReader(CachedEventFile(file, names), aliases, positions, sampled_from, weights)
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    if names:
+        read_names = ROOT.std.vector('string')()
+        for name in names:
+            read_names.push_back(name)
+        reader.setReadCollectionNames(read_names)
+    reader.open(file)
+    return EventReader(reader, aliases, positions, sampled_from, weights)
+
+
+# Relation navigator for an LCRelation collection from either input type
+def make_navigator(relation):
+    if isinstance(relation, CachedRelation):
+        return CachedRelationNavigator(relation)
+    return UTIL.LCRelationNavigator(relation)
+
+
+# LCIO getter of each per-object column (see event_cache.ROW_FIELDS)
+COLUMN_GETTERS = {'pdg': 'getPDG', 'type': 'getType', 'energy': 'getEnergy', 'charge': 'getCharge',
+                  'mass': 'getMass', 'generator_status': 'getGeneratorStatus'}
+
+
+# {field: array with one row per object} of a collection from either input type, e.g.
+#   columns = collection_columns(event, 'PandoraPFOs', ['momentum', 'type', 'energy'])
+# Cached events return views of the (memory-mapped) cache arrays, LCIO events are copied through the getters
+def collection_columns(event, name, fields):
+    if isinstance(event, LazyEvent):
+        event, name = event._event, event._aliases.get(name, name)
+    if isinstance(event, CachedEvent):
+        return event.getColumns(name, fields)
+    collection = event.getCollection(name)
+    columns = {}
+    for field in fields:
+        if field == 'momentum':
+            moms = [obj.getMomentum() for obj in collection]
+            columns[field] = np.array([(mom[0], mom[1], mom[2]) for mom in moms], dtype=np.float64).reshape(-1, 3)
+        else:
+            columns[field] = np.array([getattr(obj, COLUMN_GETTERS[field])() for obj in collection])
+    return columns
+
+
+# Reader options shared by all event-loop scripts
+def add_reader_args(parser):
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of upcoming input files read ahead on a background thread (default 0: off). '
+                             'Plain .slcio files are then read twice, once to warm the page cache and once by LCIO')
+    parser.add_argument('--catalog', type=str, default=None,
+                        help='Catalog written by catalog.py, used to skip unusable files and pick the collection names of each file')
+    parser.add_argument('--events', type=str, nargs='+', default=None,
+                        help='Only read these events: run:event pairs, event numbers and/or files of "file run event", "run event" or "event" lines')
+    parser.add_argument('--eventIndex', type=str, default=None,
+                        help='Event index written by event_index.py (created or updated if needed), used to find the --events')
+    parser.add_argument('--shard', type=shard_spec, default=None,
+                        help='i/N: only read part i (0 <= i < N) of N parts with about the same number of events each')
+    parser.add_argument('--dedupe', type=str, default=None,
+                        help='Fingerprint file written by event_dedupe.py (created or updated if needed): skip events already read '
+                             'from an earlier input file (same run/event number and MC particle momenta)')
+    parser.add_argument('--sampleFraction', type=sample_fraction, default=None,
+                        help='Only read this fraction of the events, picked by a hash of their run and event number '
+                             '(the same events in every run)')
+    parser.add_argument('--maxEvents', type=int, default=None,
+                        help='Read at most this many events, the ones with the smallest run/event hash (the same events in every run)')
+
+
+# Decay-mode-stratified sampling, for the scripts that fill their histograms with event.weight
+def add_stratification_args(parser):
+    parser.add_argument('--modeFractions', type=mode_fraction, nargs='+', default=None,
+                        help='mode:fraction pairs, e.g. 6:0.1 7:0.1: only read this fraction of the events whose MC taus are all in '
+                             'the given (common) decay modes, events with a rarer mode are all read; events are weighted to make up for it')
+    parser.add_argument('--decayModeIndex', type=str, default=None,
+                        help='Decay-mode catalog written by decay_modes.py (created or updated if needed), used by --modeFractions')
+
+
+# "mode:fraction" -> (mode, fraction)
+def mode_fraction(text):
+    mode, _, fraction = text.partition(':')
+    try:
+        mode, fraction = int(mode), sample_fraction(fraction)
+    except ValueError:
+        raise ArgumentTypeError(f"expected mode:fraction, got '{text}'")
+    return mode, fraction
+
+
+def sample_fraction(text):
+    fraction = float(text)
+    if not 0 < fraction <= 1:
+        raise ArgumentTypeError(f"sample fraction {text} is not in (0, 1]")
+    return fraction
+
+
+# "i/N" -> (i, N)
+def shard_spec(text):
+    i, _, n_shards = text.partition('/')
+    try:
+        i, n_shards = int(i), int(n_shards)
+    except ValueError:
+        raise ArgumentTypeError(f"expected i/N, got '{text}'")
+    if n_shards < 1 or not 0 <= i < n_shards:
+        raise ArgumentTypeError(f"shard {text} is not one of 0/{n_shards} ... {n_shards - 1}/{n_shards}")
+    return i, n_shards
+
+
+# Read a whole file once so that LCIO later reads it from the page cache instead of the (network) filesystem
+# Returns early once stop (a threading.Event) is set
+def warm_page_cache(path, chunk_size=16 * 1024 * 1024, stop=None):
+    buffer = bytearray(chunk_size)
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while f.readinto(buffer):
+            if stop is not None and stop.is_set(): return
+
+
+# Background part of iter_readers: prepares the next files and hands them over through a bounded queue
+def _prefetch_files(files, collections, options, ready, stop):
+    for file in files:
+        if stop.is_set(): return
+        try:
+            if file.endswith(CACHE_SUFFIX): # cache files are decoded completely up front
+                prepared = open_reader(file, collections, **options.get(file, {}))
+                prepared.reader.preload()
+            else: # LCIO events are only valid until the next read, so only the file content is fetched ahead
+                warm_page_cache(file, stop=stop)
+                prepared = None
+        except Exception as e:
+            prepared = e
+        while not stop.is_set():
+            try:
+                ready.put((file, prepared), timeout=1)
+                break
+            except queue.Full:
+                continue
+        else: # the loop stopped reading, nobody takes this one
+            if isinstance(prepared, EventReader): prepared.close()
+
+
+# Drop files the catalog marks as unusable and look up the collection names of the others
+# Files missing from the catalog are read as before
+def _apply_catalog(files, collections, catalog, catalog_path, options):
+    usable = []
+    for file in files:
+        entry = get_entry(catalog, file)
+        if entry is None:
+            usable.append(file)
+            continue
+        aliases = collection_aliases(entry, collections or []) if entry['error'] is None else None
+        if aliases is None:
+            continue
+        usable.append(file)
+        options.setdefault(file, {})['aliases'] = aliases
+    if len(usable) < len(files):
+        print(f"Skipping {len(files) - len(usable)} of {len(files)} files marked unusable in {catalog_path}")
+    return usable
+
+
+# Split files into n_shards lists of (file, event positions or None for the whole file) with about the same work each
+# Files are weighted by their event count if the catalog has every one of them, otherwise by their size (the two cannot be
+# mixed in one balance); with split a file heavier than a shard is split into event ranges of equal weight per event
+# The split only depends on the file list and catalog, so every job of a sharded run computes the same one
+def shard_files(files, n_shards, catalog=None, split=True):
+    units = []
+    entries = {file: get_entry(catalog, file) for file in files} if catalog is not None else {}
+    if files and all(entries.get(file) is not None for file in files):
+        weights = {file: entries[file]['events'] for file in files}
+    else:
+        weights = {file: os.path.getsize(file) for file in files}
+    target = sum(weights.values()) / n_shards
+    for file in sorted(files):
+        if n_shards == 1 or not split or weights[file] <= target:
+            units.append((weights[file], file, None))
+            continue
+        entry = entries.get(file)
+        if entry is not None:
+            n_events = entry['events']
+        else:
+            reader = open_reader(file)
+            n_events = reader.getNumberOfEvents()
+            reader.close()
+        n_parts = max(1, min(math.ceil(weights[file] / target), n_events))
+        bounds = [n_events * k // n_parts for k in range(n_parts + 1)]
+        for k in range(n_parts):
+            units.append((weights[file] * (bounds[k + 1] - bounds[k]) / max(n_events, 1), file, range(bounds[k], bounds[k + 1])))
+
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for weight, file, positions in sorted(units, key=lambda unit: (-unit[0], unit[1], unit[2].start if unit[2] else 0)):
+        i = min(range(n_shards), key=lambda k: (loads[k], len(shards[k])))
+        shards[i].append((file, positions))
+        loads[i] += weight
+    return shards
+
+
+# Keep only the files (and event ranges) of one shard
+def _apply_shard(files, shard, catalog, options):
+    i, n_shards = shard
+    selected = {}
+    for file, positions in shard_files(files, n_shards, catalog)[i]:
+        if positions is None:
+            selected[file] = None
+        else: # a split file can have more than one range in the same shard
+            selected[file] = sorted(selected.get(file, []) + list(positions))
+    for file, positions in selected.items():
+        if positions is not None:
+            options.setdefault(file, {})['positions'] = positions
+    print(f"Shard {i}/{n_shards}: {len(selected)} of {len(files)} files")
+    return [file for file in files if file in selected]
+
+
+# Keep only the files holding some of the --events and the read positions of those events
+def _apply_event_list(files, args, options):
+    index = get_index([file for file in files if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX)], args.eventIndex)
+    positions, missing = find_events(index, parse_event_list(args.events))
+    if missing:
+        print(f"{len(missing)} of the requested events are not in the input files")
+    selected = []
+    for file in files:
+        file_positions = positions.get(os.path.abspath(file))
+        if file_positions and 'positions' in options.get(file, {}): # within this shard's event range only
+            in_range = set(options[file]['positions'])
+            file_positions = [position for position in file_positions if position in in_range]
+        if file_positions:
+            selected.append(file)
+            options.setdefault(file, {})['positions'] = file_positions
+    return selected
+
+
+# Drop the duplicate events (see event_dedupe.find_duplicates) from the read positions, files holding only duplicates are skipped
+def _apply_dedupe(files, duplicates, options):
+    kept = []
+    n_skipped = 0
+    for file in files:
+        n_events, positions = duplicates.get(os.path.abspath(file), (0, None))
+        if positions is None:
+            kept.append(file)
+            continue
+        read_positions = options.get(file, {}).get('positions', range(n_events))
+        file_positions = np.setdiff1d(read_positions, positions).tolist()
+        n_skipped += len(read_positions) - len(file_positions)
+        if file_positions:
+            kept.append(file)
+            options.setdefault(file, {})['positions'] = file_positions
+    if n_skipped:
+        print(f"Skipping {n_skipped} duplicate events")
+    return kept
+
+
+# Sampling key of each event in [0, 1), a fixed mix (splitmix64) of its run and event number: the same events are
+# picked whatever the file order, sharding or machine
+def sample_keys(runs, events):
+    x = (np.asarray(runs, dtype=np.int64).astype(np.uint64) << np.uint64(32)) ^ np.asarray(events, dtype=np.int64).astype(np.uint64)
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+
+# Keep the events whose key is below their keep fraction (--sampleFraction times the --modeFractions of their decay modes)
+# and, of those, the --maxEvents with the smallest keys
+# Each kept file records the number of events it stands for (sampled_from), files left without events are counted
+# with the file kept before them (or the first kept file), so the weight of the sampled run is still all events / read events
+# With --modeFractions every event also gets the inverse of the probability it was kept with as its weight (event.weight)
+def _apply_sampling(files, args, options):
+    readable = [file for file in files if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX)]
+    index = get_index(readable, args.eventIndex)
+    mode_fractions = dict(getattr(args, 'modeFractions', None) or [])
+    modes = get_decay_modes(readable, args.decayModeIndex) if mode_fractions else None
+    candidates = {}
+    fractions = {}
+    keys = {}
+    for file in files:
+        entry = index.get(os.path.abspath(file))
+        if entry is None: continue
+        candidates[file] = np.asarray(options.get(file, {}).get('positions', range(len(entry['events']))), dtype=np.int64)
+        fractions[file] = np.full(len(candidates[file]), args.sampleFraction or 1.0)
+        if modes is not None:
+            fractions[file] *= keep_fractions(modes[os.path.abspath(file)]['masks'][candidates[file]], mode_fractions)
+        file_keys = sample_keys(entry['runs'][candidates[file]], entry['events'][candidates[file]])
+        keys[file] = np.where(file_keys < fractions[file], file_keys, np.inf)
+    all_keys = np.concatenate(list(keys.values()) or [np.zeros(0)])
+    n_keep = np.count_nonzero(np.isfinite(all_keys))
+    if args.maxEvents is not None and args.maxEvents < n_keep:
+        threshold = np.sort(all_keys)[args.maxEvents - 1] if args.maxEvents > 0 else -np.inf
+        keys = {file: np.where(file_keys <= threshold, file_keys, np.inf) for file, file_keys in keys.items()}
+        fractions = {file: np.minimum(file_fractions, threshold) for file, file_fractions in fractions.items()}
+
+    kept = []
+    last_sampled = None
+    unread = 0 # events of files without sampled events, not counted yet
+    for file in files:
+        if file not in candidates: # not in the index (unreadable), left to fail as it would without sampling
+            kept.append(file)
+            continue
+        selected = np.isfinite(keys[file])
+        if not selected.any():
+            if last_sampled is not None: options[last_sampled]['sampled_from'] += len(candidates[file])
+            else: unread += len(candidates[file])
+            continue
+        kept.append(file)
+        last_sampled = file
+        options.setdefault(file, {}).update(positions=candidates[file][selected].tolist(), sampled_from=len(candidates[file]) + unread)
+        if modes is not None:
+            options[file]['weights'] = (1 / fractions[file][selected]).tolist()
+        unread = 0
+    n_events = sum(len(positions) for positions in candidates.values())
+    n_sampled = sum(len(options[file]['positions']) for file in kept if file in candidates)
+    print(f"Sampling {n_sampled} of {n_events} events" + (f", every event read stands for {n_events / n_sampled:.4g}" if n_sampled and modes is None else ''))
+    if modes is not None:
+        print("Events weighted by their decay mode fractions " + ', '.join(f"{mode}: {fraction:g}" for mode, fraction in sorted(mode_fractions.items())))
+    return kept
+
+
+# Input files to read and the open_reader options of each file ({file: {'aliases': ..., 'positions': ...}}) for the reader args
+def reader_options(files, collections=None, args=None):
+    options = {}
+    catalog = load_catalog(args.catalog) if args is not None and args.catalog else None
+    if catalog is not None:
+        files = _apply_catalog(files, collections, catalog, args.catalog, options)
+    duplicates = None
+    if args is not None and args.dedupe: # over all files, before a shard picks its part of them
+        readable = [file for file in files if file.endswith('.slcio') or file.endswith(CACHE_SUFFIX)]
+        duplicates = find_duplicates(get_fingerprints(readable, args.dedupe), readable)
+    if args is not None and args.shard:
+        files = _apply_shard(files, args.shard, catalog, options)
+    if args is not None and args.events:
+        files = _apply_event_list(files, args, options)
+    if duplicates is not None:
+        files = _apply_dedupe(files, duplicates, options)
+    if args is not None and (args.sampleFraction is not None or args.maxEvents is not None or getattr(args, 'modeFractions', None)):
+        files = _apply_sampling(files, args, options)
+    return files, options
+
+
+# Open a single input file honouring the reader args (for scripts that take one file)
+def open_input(file, collections=None, args=None):
+    files, options = reader_options([file], collections, args)
+    if not files:
+        options[file] = dict(options.get(file, {}), positions=[])
+    return open_reader(file, collections, **options.get(file, {}))
+
+
+# Drop-in replacement for opening the input files one after the other:
+#   for file, reader in iter_readers(to_process, COLLECTIONS, args):
+# with --prefetch the next files are read while the current one is analysed, the caller still closes each reader
+def iter_readers(files, collections=None, args=None):
+    files, options = reader_options(files, collections, args)
+    yield from read_files(files, collections, options, args.prefetch if args is not None else 0)
+
+
+# Open files whose reader options are already known (see reader_options), prefetching the next ones if prefetch > 0
+# Readers prepared ahead that the loop never reaches (it stopped early or raised) are closed here
+def read_files(files, collections, options, prefetch=0):
+    if prefetch <= 0:
+        for file in files:
+            yield file, open_reader(file, collections, **options.get(file, {}))
+        return
+
+    ready = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    worker = threading.Thread(target=_prefetch_files, args=(list(files), collections, options, ready, stop), daemon=True)
+    worker.start()
+    try:
+        for _ in range(len(files)):
+            file, prepared = ready.get()
+            if isinstance(prepared, Exception):
+                raise prepared
+            yield file, prepared if prepared is not None else open_reader(file, collections, **options.get(file, {}))
+    finally:
+        stop.set()
+        worker.join()
+        while not ready.empty():
+            _, prepared = ready.get()
+            if isinstance(prepared, EventReader): prepared.close()
@@ -1,5 +1,7 @@
-from ROOT import TFile
 from argparse import ArgumentParser
+import numpy as np
+
+from anatree import add_anatree_args, read_anatree
 
 
 # Command line arguments
@@ -7,40 +9,27 @@ parser = ArgumentParser()
 
 # Input file
 parser.add_argument('--inputFile', type=str, default='Taus_loose.root')
+add_anatree_args(parser)
 
 args = parser.parse_args()
 
-file = TFile.Open(args.inputFile)
-
-tree = file.Get('anatree')
+taus = read_anatree(args.inputFile, ['t_pt', 't_isoE'], args.threads)
 
-if not tree:
+if taus is None:
     print('TTree not found in file!')
     exit()
 
 
-tau_pt = []
-tau_isoE = []
-tau_ratios = []
-num_reco_taus = 0
-
-for i in range(tree.GetEntries()):
-    tree.GetEntry(i)
-
-    for j in range(tree.ntau):
-        pt = tree.t_pt[j]
-        tau_pt.append(pt)
-        isoE = tree.t_isoE[j]
-        tau_isoE.append(isoE)
-        tau_ratios.append(float(isoE) / float(pt))
-        num_reco_taus += 1
+tau_pt = taus['t_pt'].astype(np.float64)
+tau_isoE = taus['t_isoE'].astype(np.float64)
+with np.errstate(divide='ignore', invalid='ignore'): # taus with zero pt are not accepted
+    tau_ratios = tau_isoE / tau_pt
+num_reco_taus = len(tau_pt)
 
 ratio_dict = {0.05: 0, 0.1: 0, 0.15: 0, 0.2: 0}
 
-for ratio in tau_ratios:
-    for key in ratio_dict:
-        if ratio < key:
-            ratio_dict[key] += 1
+for key in ratio_dict:
+    ratio_dict[key] = int(np.count_nonzero(tau_ratios < key))
 
 for key in ratio_dict:
     print(f'Number of reco Taus accepted by IsoE/Pt < {key}: {ratio_dict[key]}')
@@ -0,0 +1,145 @@
+# Merge many .slcio files into fixed-size output files with constant memory
+#   python merge_events.py --inputFile <sample directory> --outputDir <merged directory> --eventsPerFile 10000 --jobs 4
+# Every output file is written by one worker that streams its events from the inputs one file at a time,
+# so the memory use does not grow with the number of inputs (unlike a single lcio_merge_events over 10k files)
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from pyLCIO import IOIMPL, EVENT
+
+from catalog import get_entry, load_catalog
+from event_io import get_input_files, open_reader, read_collection_names
+
+
+def count_events(file):
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    reader.open(file)
+    n_events = reader.getNumberOfEvents()
+    reader.close()
+    return n_events
+
+
+# Split the concatenated event stream of all inputs into outputs of events_per_file events
+# Each output is a list of (file, first event, number of events) segments
+def plan_outputs(files, counts, events_per_file):
+    outputs = [[]]
+    n_in_output = 0
+    for file, n_events in zip(files, counts):
+        first = 0
+        while first < n_events:
+            if n_in_output == events_per_file:
+                outputs.append([])
+                n_in_output = 0
+            n = min(n_events - first, events_per_file - n_in_output)
+            outputs[-1].append((file, first, n))
+            first += n
+            n_in_output += n
+    return [segments for segments in outputs if segments]
+
+
+# Worker: write one output file from its segments, reading one event at a time
+def write_output(task):
+    path, segments, collections = task
+    tmp_path = path[:-len('.slcio')] + '.tmp.slcio' # LCIO appends .slcio to names without it
+    writer = IOIMPL.LCFactory.getInstance().createLCWriter()
+    writer.open(tmp_path, EVENT.LCIO.WRITE_NEW)
+    n_written = 0
+    for file, first, n_events in segments:
+        reader = open_reader(file, collections)
+        if first > 0:
+            reader.reader.skipNEvents(first)
+        for event in reader:
+            writer.writeEvent(event.event)
+            n_written += 1
+            n_events -= 1
+            if n_events == 0: break
+        reader.close()
+    writer.close()
+    os.replace(tmp_path, path)
+    return path, n_written
+
+
+# Collection names of the first event of a file
+def first_event_collections(file):
+    reader = IOIMPL.LCFactory.getInstance().createLCReader()
+    reader.open(file)
+    event = reader.readNextEvent()
+    names = list(event.getCollectionNames()) if event else []
+    reader.close()
+    return names
+
+
+# Collection names of the sample: the union of the catalog inventory of the cataloged files and the first event of
+# every other file (scanned in the pool if given); returns the names and the number of files scanned by first event
+def sample_collections(files, catalog=None, pool=None):
+    names = []
+    uncataloged = []
+    for file in files:
+        entry = get_entry(catalog, file) if catalog is not None else None
+        if entry is not None:
+            names.extend(name for name in entry['collections'] if name not in names)
+        else:
+            uncataloged.append(file)
+    scanned = pool.map(first_event_collections, uncataloged) if pool is not None else map(first_event_collections, uncataloged)
+    for file_names in scanned:
+        names.extend(name for name in file_names if name not in names)
+    return names, len(uncataloged)
+
+
+def main():
+    parser = ArgumentParser(description='Merge .slcio files into fixed-size outputs')
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help='Sample directory, file list (.txt) or single file')
+    parser.add_argument('-o', '--outputDir', type=str, required=True, help='Directory for the merged files')
+    parser.add_argument('-n', '--eventsPerFile', type=int, default=10000, help='Number of events per merged file')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of merged files written in parallel')
+    parser.add_argument('--prefix', type=str, default='merged', help='Merged files are named <prefix>_<i>.slcio')
+    parser.add_argument('--dropCollections', type=str, nargs='*', default=[], help='Collections left out of the merged files')
+    parser.add_argument('--catalog', type=str, default=None, help='Catalog written by catalog.py, used for the event counts and the collections of each file')
+    parser.add_argument('--force', action='store_true', help='Rewrite merged files that already exist')
+    args = parser.parse_args()
+
+    files = sorted(f for f in get_input_files(args.inputFile) if f.endswith('.slcio'))
+    if not files:
+        print(f"No .slcio files in {args.inputFile}")
+        return
+    catalog = load_catalog(args.catalog) if args.catalog else None
+
+    with Pool(args.jobs) as pool:
+        collections = None
+        if args.dropCollections:
+            names, n_first_event = sample_collections(files, catalog, pool)
+            collections = [name for name in names if name not in args.dropCollections]
+            never_seen = [name for name in args.dropCollections if name not in names]
+            if never_seen:
+                print(f"Warning: {never_seen} not found in any input file, nothing to drop")
+            if n_first_event:
+                print(f"Warning: the collections of {n_first_event} files not in the catalog are taken from their first event, "
+                      f"collections that only appear in later events are dropped too (pass --catalog to include them)")
+            kept_anyway = set(read_collection_names(collections)) & set(args.dropCollections)
+            if kept_anyway:
+                print(f"Keeping {sorted(kept_anyway)}, other kept collections point to them")
+
+        # Event counts from the catalog where possible, the other files are counted in parallel
+        entries = [get_entry(catalog, file) if catalog is not None else None for file in files]
+        to_count = [file for file, entry in zip(files, entries) if entry is None]
+        counted = dict(zip(to_count, pool.map(count_events, to_count)))
+        counts = [entry['events'] if entry is not None else counted[file] for file, entry in zip(files, entries)]
+        outputs = plan_outputs(files, counts, args.eventsPerFile)
+        print(f"Merging {sum(counts)} events from {len(files)} files into {len(outputs)} files")
+
+        os.makedirs(args.outputDir, exist_ok=True)
+        tasks = []
+        for i, segments in enumerate(outputs):
+            path = os.path.join(args.outputDir, f'{args.prefix}_{i}.slcio')
+            if os.path.exists(path) and not args.force:
+                print(f"  {path} exists, skipping")
+                continue
+            tasks.append((path, segments, collections))
+
+        # Outputs are reported in order, each one is complete once it is listed
+        for path, n_written in pool.imap(write_output, tasks):
+            print(f"  {path}: {n_written} events")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+# Pre-shuffled, class-stratified train/validation/test splits of a taufinder_for_ML.py output (.root, .parquet, .h5)
+#   python ml_splits.py --input tau_bdt_training.parquet --outputDir tau_splits --seed 1
+# Every split is written as shards of --shardSize rows, one uncompressed .npy file per column
+# (<outputDir>/<split>/shard-00000/pt.npy), so training jobs memory-map them and stream mini-batches from disk:
+#   for batch in iter_batches('tau_splits', 'train', 1024):
+#       x, y = batch['pt'], batch['isSignal']
+# Variable-length columns (constituent arrays) are stored as their flat values plus <column>_offsets.npy and come as
+# (values, offsets) pairs. meta.json holds the seed, the fractions and the rows and signal taus of every shard;
+# the same input, seed and fractions always give the same splits
+import json
+import os
+import shutil
+from argparse import ArgumentParser
+import numpy as np
+import ROOT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from ml_writer import OFFSETS_NAME, SOURCES_NAME, row_offsets
+
+SPLITS = ['train', 'validation', 'test']
+META_NAME = 'meta.json'
+
+
+##################
+# Reading the training dataset one column at a time
+##################
+
+def _format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet' and pq is None:
+        raise ImportError('reading .parquet files needs pyarrow (pip install pyarrow)')
+    if extension in ('.h5', '.hdf5') and h5py is None:
+        raise ImportError('reading .h5 files needs h5py (pip install h5py)')
+    if extension not in ('.root', '.parquet', '.h5', '.hdf5'):
+        raise ValueError(f"unknown input format '{extension}'")
+    return extension
+
+
+def column_names(path):
+    extension = _format(path)
+    if extension == '.parquet':
+        return pq.ParquetDataset(path).schema.names
+    if extension == '.root':
+        file = ROOT.TFile.Open(path)
+        names = [branch.GetName() for branch in file.Get('tau_tree').GetListOfBranches()]
+        file.Close()
+        return names
+    with h5py.File(path, 'r') as f:
+        return [name for name in f if name not in (SOURCES_NAME, OFFSETS_NAME)]
+
+
+# Parquet files of a dataset in row order: the file itself, or the part files of an --append dataset directory
+def _parquet_files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, part) for part in sorted(os.listdir(path)) if part.endswith('.parquet') and not part.startswith('.')]
+
+
+def _arrow_chunk(column):
+    if pa.types.is_fixed_size_list(column.type):
+        return column.flatten().to_numpy(zero_copy_only=False).reshape(len(column), column.type.list_size), None
+    if pa.types.is_list(column.type):
+        offsets = np.asarray(column.offsets, dtype=np.int64)
+        return column.flatten().to_numpy(zero_copy_only=False), offsets - offsets[0]
+    return column.to_numpy(zero_copy_only=False), None
+
+
+def _root_chunk(values, jagged, width):
+    if jagged:
+        counts = np.fromiter((len(v) for v in values), dtype=np.int64, count=len(values))
+        return np.concatenate([np.asarray(v) for v in values]) if len(values) else np.zeros(0), row_offsets(counts)
+    if width > 1:
+        return np.stack([np.asarray(v) for v in values]) if len(values) else np.zeros((0, width)), None
+    return values, None
+
+
+# One column in chunks of up to chunk_size consecutive rows, in row order: (values, None) for fixed-width columns,
+# (flat values, row offsets starting at 0) for variable-length ones
+# n_rows (the number of rows of the dataset) lets HDF5 files be checked for variable-length columns without offsets
+def iter_column(path, name, chunk_size=100000, n_rows=None):
+    extension = _format(path)
+    if extension == '.parquet':
+        for part in _parquet_files(path):
+            for batch in pq.ParquetFile(part).iter_batches(batch_size=chunk_size, columns=[name]):
+                yield _arrow_chunk(batch.column(0))
+        return
+    if extension == '.root':
+        file = ROOT.TFile.Open(path)
+        tree = file.Get('tau_tree')
+        leaf = tree.GetBranch(name).GetLeaf(name)
+        jagged, width, n_entries = bool(leaf.GetLeafCount()), leaf.GetLenStatic(), tree.GetEntries()
+        file.Close()
+        implicit_mt = ROOT.IsImplicitMTEnabled()
+        if implicit_mt: # Range needs one thread, and the rows have to come in entry order
+            ROOT.DisableImplicitMT()
+        try:
+            for begin in range(0, n_entries, chunk_size):
+                values = ROOT.RDataFrame('tau_tree', path).Range(begin, begin + chunk_size).AsNumpy([name])[name]
+                yield _root_chunk(values, jagged, width)
+        finally:
+            if implicit_mt: ROOT.EnableImplicitMT()
+        return
+    with h5py.File(path, 'r') as f:
+        dataset = f[name]
+        if 'count' not in dataset.attrs:
+            if n_rows is not None and dataset.shape[0] != n_rows:
+                raise ValueError(f"{path}: column '{name}' has {dataset.shape[0]} values for {n_rows} rows but no 'count' "
+                                 f"attribute naming its offsets in '{OFFSETS_NAME}', rewrite the file with taufinder_for_ML.py")
+            for begin in range(0, dataset.shape[0], chunk_size):
+                yield dataset[begin:begin + chunk_size], None
+            return
+        offsets = f[OFFSETS_NAME][dataset.attrs['count']]
+        for begin in range(0, offsets.shape[0] - 1, chunk_size):
+            chunk_offsets = offsets[begin:begin + chunk_size + 1]
+            yield dataset[chunk_offsets[0]:chunk_offsets[-1]], chunk_offsets - chunk_offsets[0]
+
+
+# A whole fixed-width column, for the (small) label column
+def read_column(path, name, chunk_size=100000):
+    chunks = [values for values, _ in iter_column(path, name, chunk_size)]
+    return np.concatenate(chunks) if chunks else np.zeros(0)
+
+
+##################
+# Splitting
+##################
+
+# Row numbers of each split, every class (label value) is shuffled and split with the same fractions on its own,
+# then the rows of each split are shuffled together
+def split_rows(labels, fractions, seed):
+    rng = np.random.default_rng(seed)
+    parts = [[] for _ in fractions]
+    for label in np.unique(labels):
+        rows = rng.permutation(np.flatnonzero(labels == label))
+        ends = np.round(np.cumsum(fractions)[:-1] * len(rows)).astype(np.int64)
+        for split, part in zip(parts, np.split(rows, ends)):
+            split.append(part)
+    return [rng.permutation(np.concatenate(split)) for split in parts]
+
+
+# Output array of a shard column, written in place through a memory map (an empty one is saved right away)
+def _open_output(path, dtype, shape):
+    if shape[0] == 0:
+        np.save(path, np.zeros(shape, dtype=dtype))
+        return None
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+# Element indices of the rows starting at starts with counts values each, concatenated
+def _ranges(starts, counts):
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+# Copy one column into the shards, reading the input in row order one chunk at a time; every row goes to its place
+# in its shard (row_shard, row_position), so only a chunk and the pages of the shard files being written are in memory
+def _write_column(input_path, name, shard_dirs, row_shard, row_position, chunk_size):
+    n_shards = len(shard_dirs)
+    outputs = [None] * n_shards
+    shard_offsets = None
+    jagged = None
+    begin = 0
+    for values, offsets in iter_column(input_path, name, chunk_size, len(row_shard)):
+        if jagged is None:
+            jagged = offsets is not None
+            if jagged: # a first pass over the row lengths places the values of every row in its shard
+                counts = np.concatenate([np.diff(chunk_offsets) for _, chunk_offsets in iter_column(input_path, name, chunk_size)])
+                shard_offsets = []
+                for shard in range(n_shards):
+                    shard_counts = np.zeros(np.count_nonzero(row_shard == shard), dtype=np.int64)
+                    shard_counts[row_position[row_shard == shard]] = counts[row_shard == shard]
+                    shard_offsets.append(row_offsets(shard_counts))
+                    np.save(os.path.join(shard_dirs[shard], f'{name}_offsets.npy'), shard_offsets[shard])
+                del counts
+            for shard in range(n_shards):
+                n_values = int(shard_offsets[shard][-1] if jagged else np.count_nonzero(row_shard == shard))
+                outputs[shard] = _open_output(os.path.join(shard_dirs[shard], f'{name}.npy'), values.dtype,
+                                              (n_values,) + values.shape[1:])
+
+        n_chunk = len(offsets) - 1 if jagged else len(values)
+        chunk_shard = row_shard[begin:begin + n_chunk]
+        chunk_position = row_position[begin:begin + n_chunk]
+        for shard in np.unique(chunk_shard).tolist():
+            rows = np.flatnonzero(chunk_shard == shard)
+            if not jagged:
+                outputs[shard][chunk_position[rows]] = values[rows]
+                continue
+            counts = offsets[rows + 1] - offsets[rows]
+            if counts.sum() == 0: continue
+            source = _ranges(offsets[rows], counts)
+            target = _ranges(shard_offsets[shard][chunk_position[rows]], counts)
+            outputs[shard][target] = values[source]
+        begin += n_chunk
+
+    for output in outputs:
+        if output is not None: output.flush()
+
+
+# Empty output_dir for new splits: the shards of earlier splits are removed (a rerun with fewer shards would leave
+# some behind), a directory holding anything else is not touched
+def _prepare_output(output_dir):
+    if not os.path.isdir(output_dir):
+        return
+    other = set(os.listdir(output_dir)) - set(SPLITS) - {META_NAME}
+    if other:
+        raise ValueError(f'{output_dir} holds other files than splits ({sorted(other)[0]}, ...), choose another --outputDir')
+    if os.path.exists(os.path.join(output_dir, META_NAME)):
+        os.remove(os.path.join(output_dir, META_NAME))
+    for split in SPLITS:
+        if os.path.isdir(os.path.join(output_dir, split)):
+            shutil.rmtree(os.path.join(output_dir, split))
+
+
+def write_splits(input_path, output_dir, seed, fractions, shard_size=1000000, label_column='isSignal', chunk_size=100000):
+    names = column_names(input_path)
+    labels = read_column(input_path, label_column, chunk_size)
+    splits = split_rows(labels, fractions, seed)
+    shards = {split: [rows[begin:begin + shard_size] for begin in range(0, len(rows), shard_size)]
+              for split, rows in zip(SPLITS, splits)}
+
+    # Shard and place in the shard of every input row, the only per-row arrays kept in memory
+    _prepare_output(output_dir)
+    shard_dirs = []
+    row_shard = np.full(len(labels), -1, dtype=np.int32)
+    row_position = np.zeros(len(labels), dtype=np.int64)
+    for split, split_shards in shards.items():
+        for i, rows in enumerate(split_shards):
+            row_shard[rows] = len(shard_dirs)
+            row_position[rows] = np.arange(len(rows))
+            shard_dirs.append(os.path.join(output_dir, split, f'shard-{i:05d}'))
+            os.makedirs(shard_dirs[-1])
+
+    # One column at a time
+    for name in names:
+        _write_column(input_path, name, shard_dirs, row_shard, row_position, chunk_size)
+
+    # Written last, a directory without it is incomplete
+    meta = {'input': os.path.abspath(input_path), 'seed': seed, 'fractions': dict(zip(SPLITS, fractions)),
+            'label': label_column, 'columns': names, 'splits': {}}
+    for split, split_shards in shards.items():
+        meta['splits'][split] = [{'name': f'shard-{i:05d}', 'rows': len(rows), 'positive': int(np.count_nonzero(labels[rows]))}
+                                 for i, rows in enumerate(split_shards)]
+    with open(os.path.join(output_dir, META_NAME), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+##################
+# Loading
+##################
+
+def load_meta(directory):
+    with open(os.path.join(directory, META_NAME)) as f:
+        return json.load(f)
+
+
+# {column: memory-mapped array, or (values, offsets) for variable-length columns} of one shard directory
+def load_shard(shard_dir, columns):
+    arrays = {}
+    for name in columns:
+        values = np.load(os.path.join(shard_dir, f'{name}.npy'), mmap_mode='r')
+        offsets_path = os.path.join(shard_dir, f'{name}_offsets.npy')
+        arrays[name] = (values, np.load(offsets_path, mmap_mode='r')) if os.path.exists(offsets_path) else values
+    return arrays
+
+
+# Mini-batches of batch_size rows of one split, read from the memory-mapped shards in their (shuffled) order
+# The last batch of every shard can be smaller, variable-length columns come as (values, offsets starting at 0)
+def iter_batches(directory, split, batch_size, columns=None):
+    meta = load_meta(directory)
+    for shard in meta['splits'][split]:
+        arrays = load_shard(os.path.join(directory, split, shard['name']), columns or meta['columns'])
+        for begin in range(0, shard['rows'], batch_size):
+            end = min(begin + batch_size, shard['rows'])
+            batch = {}
+            for name, array in arrays.items():
+                if isinstance(array, tuple):
+                    values, offsets = array
+                    batch[name] = (np.asarray(values[offsets[begin]:offsets[end]]), np.asarray(offsets[begin:end + 1] - offsets[begin]))
+                else:
+                    batch[name] = np.asarray(array[begin:end])
+            yield batch
+
+
+def main():
+    parser = ArgumentParser(description='Write shuffled, class-stratified train/validation/test shards of a taufinder_for_ML.py output')
+    parser.add_argument('-i', '--input', type=str, required=True, help='taufinder_for_ML.py output (.root, .parquet or .h5)')
+    parser.add_argument('-o', '--outputDir', type=str, default='tau_splits', help='Directory the shards are written to')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the shuffle, the same seed gives the same splits')
+    parser.add_argument('--trainFraction', type=float, default=0.8, help='Fraction of each class in the train split')
+    parser.add_argument('--validationFraction', type=float, default=0.1, help='Fraction of each class in the validation split, the rest is test')
+    parser.add_argument('--shardSize', type=int, default=1000000, help='Rows per shard')
+    parser.add_argument('--labelColumn', type=str, default='isSignal', help='Column the splits are stratified on')
+    parser.add_argument('--chunkSize', type=int, default=100000, help='Rows of the input read at a time')
+    args = parser.parse_args()
+
+    fractions = [args.trainFraction, args.validationFraction, 1 - args.trainFraction - args.validationFraction]
+    if min(fractions) < 0:
+        parser.error('--trainFraction plus --validationFraction is more than 1')
+
+    try:
+        meta = write_splits(args.input, args.outputDir, args.seed, fractions, args.shardSize, args.labelColumn, args.chunkSize)
+    except ValueError as e:
+        parser.error(str(e))
+    for split, shards in meta['splits'].items():
+        print(f"{split}: {sum(shard['rows'] for shard in shards)} rows "
+              f"({sum(shard['positive'] for shard in shards)} with {args.labelColumn}) in {len(shards)} shards")
+    print(f"Splits written to {args.outputDir} (seed {args.seed})")
+
+
+if __name__ == '__main__':
+    main()
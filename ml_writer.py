@@ -0,0 +1,260 @@
+# Writers of the tau training dataset (taufinder_for_ML.py), picked by the extension of the output file:
+#   .root          TTree 'tau_tree' with one entry per tau, TTree 'source_files' with the input files
+#   .parquet       zstd-compressed row groups of row_group_size rows (needs pyarrow), input files in the file metadata
+#   .h5 / .hdf5    one chunked, compressed dataset per column (needs h5py), input files in the 'source_files' group
+# The Parquet and HDF5 files load straight into numpy/pandas (pandas.read_parquet, h5py.File(path)['pt'][:])
+# columns: {name: (numpy dtype, values per row)}, rows are written in batches of {name: array of rows}
+# Variable-length columns name their count column instead of a width (like ROOT's x[n] leaves), e.g.
+#   {'nConstituents': ('i4', 1), 'constituentE': ('f4', 'nConstituents')}
+# and are passed as one flat array of all values of the batch. They are stored without padding: ROOT x[n] leaves,
+# Parquet list columns, flat HDF5 datasets (count column in their 'count' attribute) with the row offsets in
+# offsets/<count column> (values of row i: f['constituentE'][offsets[i]:offsets[i + 1]])
+# Every writer keeps the list of input files (path, signal, nTaus) the dataset holds, add_source records a file after its rows
+# With append=True an existing dataset is extended instead of replaced; a Parquet dataset is then a directory of part
+# files (one per run, read back as one table by pyarrow.parquet.read_table / pandas.read_parquet), a single file written
+# without append is moved into it as the first part
+import json
+import os
+import numpy as np
+import ROOT
+from ROOT import TFile, TTree
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# numpy dtype -> ROOT leaf type
+LEAF_TYPES = {'f4': 'F', 'i4': 'I'}
+SOURCES_NAME = 'source_files'
+OFFSETS_NAME = 'offsets'
+# Values per row a variable-length column is read with by the ROOT writer at first, grown when a row has more
+ROOT_JAGGED_SIZE = 32
+
+
+def is_jagged(width):
+    return isinstance(width, str)
+
+
+# Start of the values of each row in the flat array of a variable-length column, plus the end of the last row
+def row_offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+
+
+def _check_columns(path, found, columns):
+    if sorted(found) != sorted(columns):
+        raise ValueError(f'{path} has the columns {sorted(found)}, expected {sorted(columns)}')
+
+
+class RootWriter:
+    def __init__(self, path, columns, row_group_size, append=False):
+        self.columns = columns
+        self.buffers = {name: np.zeros(ROOT_JAGGED_SIZE if is_jagged(width) else width, dtype=dtype)
+                        for name, (dtype, width) in columns.items()}
+        self.source_path = ROOT.std.string()
+        self.source_buffers = {'signal': np.zeros(1, dtype='i4'), 'nTaus': np.zeros(1, dtype='i4')}
+        self.sources = []
+        self.new_sources = []
+        if append and os.path.exists(path):
+            self.file = TFile(path, 'UPDATE')
+            self.tree = self.file.Get('tau_tree')
+            self.source_tree = self.file.Get(SOURCES_NAME)
+            _check_columns(path, [branch.GetName() for branch in self.tree.GetListOfBranches()], columns)
+            for entry in self.source_tree:
+                self.sources.append((str(entry.path), int(entry.signal), int(entry.nTaus)))
+            for name, buffer in self.buffers.items():
+                self.tree.SetBranchAddress(name, buffer)
+            self.source_tree.SetBranchAddress('path', self.source_path)
+            for name, buffer in self.source_buffers.items():
+                self.source_tree.SetBranchAddress(name, buffer)
+        else:
+            self.file = TFile(path, 'RECREATE')
+            self.tree = TTree('tau_tree', 'Tau BDT Training Data')
+            for name, (dtype, width) in columns.items():
+                leaf = f'{name}[{width}]' if is_jagged(width) or width > 1 else name
+                self.tree.Branch(name, self.buffers[name], f'{leaf}/{LEAF_TYPES[dtype]}')
+            self.source_tree = TTree(SOURCES_NAME, 'Input files of tau_tree')
+            self.source_tree.Branch('path', self.source_path)
+            for name, buffer in self.source_buffers.items():
+                self.source_tree.Branch(name, buffer, f'{name}/I')
+
+    def write(self, batch):
+        offsets = {name: row_offsets(batch[width]) for name, (dtype, width) in self.columns.items() if is_jagged(width)}
+        for i in range(len(batch['pt'])):
+            for name, buffer in self.buffers.items():
+                if name not in offsets:
+                    buffer[:] = batch[name][i]
+                    continue
+                values = batch[name][offsets[name][i]:offsets[name][i + 1]]
+                if len(values) > len(buffer):
+                    buffer = self.buffers[name] = np.zeros(2 * len(values), dtype=buffer.dtype)
+                    self.tree.SetBranchAddress(name, buffer)
+                buffer[:len(values)] = values
+            self.tree.Fill()
+
+    def add_source(self, path, signal, n_taus):
+        self.new_sources.append((path, signal, n_taus))
+        self.sources.append((path, signal, n_taus))
+
+    # Files are recorded only after tau_tree is written, a run that dies before leaves both trees as they were
+    def close(self):
+        self.file.cd()
+        self.tree.Write('', ROOT.TObject.kOverwrite)
+        for path, signal, n_taus in self.new_sources:
+            self.source_path.assign(path)
+            self.source_buffers['signal'][0] = signal
+            self.source_buffers['nTaus'][0] = n_taus
+            self.source_tree.Fill()
+        self.source_tree.Write('', ROOT.TObject.kOverwrite)
+        self.file.Close()
+
+
+class ParquetWriter:
+    def __init__(self, path, columns, row_group_size, append=False):
+        if pq is None:
+            raise ImportError('writing .parquet files needs pyarrow (pip install pyarrow)')
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.append = append
+        fields = []
+        for name, (dtype, width) in columns.items():
+            value_type = pa.from_numpy_dtype(np.dtype(dtype))
+            if is_jagged(width):
+                fields.append(pa.field(name, pa.list_(value_type)))
+            else:
+                fields.append(pa.field(name, value_type if width == 1 else pa.list_(value_type, width)))
+        self.schema = pa.schema(fields)
+        self.sources = []
+        self.new_sources = []
+        if append:
+            if os.path.isfile(path): # a single file written without append becomes the first part of the dataset
+                _check_columns(path, pq.read_schema(path).names, columns)
+                moved_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.moving')
+                os.replace(path, moved_path)
+                os.makedirs(path)
+                os.replace(moved_path, os.path.join(path, 'part-00000.parquet'))
+            os.makedirs(path, exist_ok=True)
+            parts = sorted(part for part in os.listdir(path) if part.startswith('part-') and part.endswith('.parquet'))
+            for part in parts:
+                metadata = pq.read_metadata(os.path.join(path, part))
+                _check_columns(path, metadata.schema.to_arrow_schema().names, columns)
+                self.sources.extend(tuple(source) for source in json.loads(metadata.metadata[SOURCES_NAME.encode()]))
+            self.path = os.path.join(path, f'part-{len(parts):05d}.parquet')
+        else:
+            self.path = path
+        # Written under a hidden temporary name (skipped when the directory is read), a run that dies leaves no part behind
+        self.tmp_path = os.path.join(os.path.dirname(self.path), '.' + os.path.basename(self.path) + '.tmp')
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+
+    def write(self, batch):
+        arrays = []
+        for name, (dtype, width) in self.columns.items():
+            values = np.asarray(batch[name], dtype=dtype)
+            if is_jagged(width): # list column, flat values plus row offsets
+                offsets = row_offsets(batch[width]).astype(np.int32)
+                arrays.append(pa.ListArray.from_arrays(pa.array(offsets), pa.array(values)))
+            elif width == 1:
+                arrays.append(pa.array(values))
+            else: # fixed-size list column, stored as one flat array
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), width))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_size)
+
+    def add_source(self, path, signal, n_taus):
+        self.new_sources.append((path, signal, n_taus))
+        self.sources.append((path, signal, n_taus))
+
+    def close(self):
+        self.writer.add_key_value_metadata({SOURCES_NAME: json.dumps(self.new_sources)})
+        self.writer.close()
+        if self.append and not self.new_sources: # nothing new, no empty part file
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, self.path)
+
+
+class HDF5Writer:
+    def __init__(self, path, columns, row_group_size, append=False):
+        if h5py is None:
+            raise ImportError('writing .h5 files needs h5py (pip install h5py)')
+        self.columns = columns
+        self.counts = sorted({width for dtype, width in columns.values() if is_jagged(width)})
+        self.new_sources = []
+        if append and os.path.exists(path):
+            self.file = h5py.File(path, 'a')
+            group = self.file[SOURCES_NAME]
+            _check_columns(path, [name for name in self.file if name not in (SOURCES_NAME, OFFSETS_NAME)], columns)
+            self.sources = [(source.decode(), int(signal), int(n_taus))
+                            for source, signal, n_taus in zip(group['path'][:], group['signal'][:], group['nTaus'][:])]
+            # Rows written after the last recorded file belong to a run that did not finish
+            n_rows = sum(n_taus for _, _, n_taus in self.sources)
+            for count in self.counts:
+                self.file[OFFSETS_NAME][count].resize(n_rows + 1, axis=0)
+            for name, (dtype, width) in columns.items():
+                self.file[name].resize(self.file[OFFSETS_NAME][width][n_rows] if is_jagged(width) else n_rows, axis=0)
+            return
+        self.file = h5py.File(path, 'w')
+        for name, (dtype, width) in columns.items():
+            row_shape = (width,) if not is_jagged(width) and width > 1 else ()
+            self.file.create_dataset(name, shape=(0,) + row_shape, maxshape=(None,) + row_shape, dtype=dtype,
+                                     chunks=(min(row_group_size, 65536),) + row_shape, compression='gzip', shuffle=True)
+            if is_jagged(width):
+                self.file[name].attrs['count'] = width
+        offsets = self.file.create_group(OFFSETS_NAME)
+        for count in self.counts:
+            offsets.create_dataset(count, data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+                                   chunks=(min(row_group_size, 65536),), compression='gzip')
+        group = self.file.create_group(SOURCES_NAME)
+        group.create_dataset('path', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype())
+        group.create_dataset('signal', shape=(0,), maxshape=(None,), dtype='i4')
+        group.create_dataset('nTaus', shape=(0,), maxshape=(None,), dtype='i8')
+        self.sources = []
+
+    def write(self, batch):
+        for name, (dtype, width) in self.columns.items():
+            dataset = self.file[name]
+            n_rows = dataset.shape[0]
+            values = np.asarray(batch[name], dtype=dtype)
+            dataset.resize(n_rows + len(values), axis=0)
+            dataset[n_rows:] = values
+        for count in self.counts:
+            dataset = self.file[OFFSETS_NAME][count]
+            n_offsets = dataset.shape[0]
+            dataset.resize(n_offsets + len(batch[count]), axis=0)
+            dataset[n_offsets:] = dataset[n_offsets - 1] + row_offsets(batch[count])[1:]
+        self._save_sources()
+
+    def add_source(self, path, signal, n_taus):
+        self.new_sources.append((path, signal, n_taus))
+        self.sources.append((path, signal, n_taus))
+
+    # Files are recorded once their rows are written, all buffered rows of the files added so far are in the last batch
+    def _save_sources(self):
+        if not self.new_sources:
+            return
+        group = self.file[SOURCES_NAME]
+        n_sources = group['path'].shape[0]
+        for name, values in zip(('path', 'signal', 'nTaus'), zip(*self.new_sources)):
+            group[name].resize(n_sources + len(values), axis=0)
+            group[name][n_sources:] = values
+        self.new_sources = []
+        self.file.flush()
+
+    def close(self):
+        self._save_sources()
+        self.file.close()
+
+
+WRITERS = {'.root': RootWriter, '.parquet': ParquetWriter, '.h5': HDF5Writer, '.hdf5': HDF5Writer}
+
+
+def open_writer(path, columns, row_group_size=100000, append=False):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"unknown output format '{extension}', use one of {sorted(WRITERS)}")
+    return WRITERS[extension](path, columns, row_group_size, append)
@@ -1,8 +1,10 @@
 from argparse import ArgumentParser
 from tau_mc_link import getDecayMode, getLinkedMCTau, getNRecoNeutralPis, getNRecoQPis
 import os
-from pyLCIO import IOIMPL, EVENT, UTIL
 import matplotlib.pyplot as plt
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files, iter_readers, make_navigator
 
 # Command line arguments
 parser = ArgumentParser()
@@ -10,21 +12,16 @@ parser = ArgumentParser()
 # Input file
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 
+add_reader_args(parser)
 args = parser.parse_args()
 
-# Check if input file is a directory or a single file
-to_process = []
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['TauRec_PFO', 'MCParticle', 'TauRecLink_PFO', 'RecoMCTruthLink']
 
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+# Check if input file is a directory or a single file
+to_process = get_input_files(args.inputFile)
 
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
 
     num_true_taus_linked = 0 #mc decay
     num_reco_taus = 0
@@ -44,8 +41,8 @@ for file in to_process:
         reco_tau_in_event_links_to_3_prong = False # check if we link more than one tau per 3-prong event
 
         # Instantiate relation navigators to parse tauReco and RecoMC links
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
+        relationNavigatorTau = make_navigator(tauRecoLink)
+        relationNavigatorRecoMC = make_navigator(recoMCLink)
 
         num_reco_taus += len(reco_taus)
 
@@ -1,4 +1,3 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas
 import os
 from argparse import ArgumentParser
@@ -6,16 +5,22 @@ import matplotlib.pyplot as plt
 import math
 
 from tau_mc_link import getLinkedMCTau, getDecayMode, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, make_navigator, open_input
 
 # Command line arguments
 parser = ArgumentParser()
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 parser.add_argument('--outputFile', type=str, default='info_1p-2p_reco_tau_combo.root')
+add_reader_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['RecoTaus', 'TauPFOLink', 'RecoMCTruthLink']
+
 # read in file
-reader = IOIMPL.LCFactory.getInstance().createLCReader()
-reader.open(args.inputFile)
+reader = open_input(args.inputFile, COLLECTIONS, args)
 
 # ROOT histograms
 hist_pt_1p = TH1F("pt_1prong", "1-prong tau pT; p_{T}_{reco} [GeV]; Events", 50, 0, 100)
@@ -37,8 +42,8 @@ for event in reader:
         tauRecoLink = event.getCollection('TauPFOLink')
         recoMCLink = event.getCollection('RecoMCTruthLink')
 
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
+        relationNavigatorTau = make_navigator(tauRecoLink)
+        relationNavigatorRecoMC = make_navigator(recoMCLink)
 
         # Skip events with fewer than 2 reco taus
         #if reco_taus.getNumberOfElements() < 2:
@@ -1,34 +1,32 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas, TLegend
 import os
 from argparse import ArgumentParser
 import matplotlib.pyplot as plt
 
 from tau_mc_link import getLinkedMCTau, getDecayMode, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files, iter_readers, make_navigator
 
 # Command line arguments
 parser = ArgumentParser()
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 parser.add_argument('--outputFile', type=str, default='reco_tau_prong_combinations.root')
+add_reader_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['RecoTaus', 'PandoraPFOs', 'MCParticle', 'TauPFOLink', 'RecoMCTruthLink']
+
 # Discover input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
 hist_list = []
 counter_table = {}
 all_prongs = set()
 file_prong_dicts = {}
 
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
 
     n_reco_3p_events = 0
     n_reco_matched_3p = 0
@@ -42,8 +40,8 @@ for file in to_process:
         tauRecoLink = event.getCollection('TauPFOLink')
         recoMCLink = event.getCollection('RecoMCTruthLink')
 
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
+        relationNavigatorTau = make_navigator(tauRecoLink)
+        relationNavigatorRecoMC = make_navigator(recoMCLink)
 
         prong_list = []
         counted = False
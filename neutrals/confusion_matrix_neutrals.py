@@ -2,10 +2,12 @@ from argparse import ArgumentParser
 from tau_mc_link import getDecayMode, getLinkedMCTau, getNRecoNeutralPis, getNRecoQPis
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 import os
-from pyLCIO import IOIMPL, EVENT, UTIL
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files, iter_readers
 
 uw_red = '#c5050c'
 light_base = '#fff0f0'
@@ -18,21 +20,16 @@ parser = ArgumentParser()
 # Input file
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 
+add_reader_args(parser)
 args = parser.parse_args()
 
-# Check if input file is a directory or a single file
-to_process = []
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['TauRec_PFO', 'MCParticle', 'TauRecLink_PFO', 'RecoMCTruthLink']
 
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+# Check if input file is a directory or a single file
+to_process = get_input_files(args.inputFile)
 
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
 
     y_true = [] #mc decay
     y_pred = [] #reco classified decay
@@ -41,11 +38,6 @@ for file in to_process:
 
         taus = event.getCollection('TauRec_PFO')
         mcParticles = event.getCollection('MCParticle')
-        tauRecoLink = event.getCollection('TauRecLink_PFO')
-        recoMCLink = event.getCollection('RecoMCTruthLink')
-
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
 
         decay_dict = {0: '1P0N', 1:'1P + Ns', 2:'1P + Ns', 3:'1P + Ns', 4: '3P0N'} #, 5:'Other', 6:'Other', 7:'Other'}
 
@@ -60,7 +52,7 @@ for file in to_process:
             # Try to find a reco tau matched to this MC tau
             matched_tau = None
             for tau in taus:
-                mcTauLinked = getLinkedMCTau(tau, relationNavigatorTau, relationNavigatorRecoMC)
+                mcTauLinked = getLinkedMCTau(tau, event.navigator('TauRecLink_PFO'), event.navigator('RecoMCTruthLink'))
                 if mcTauLinked == mc_tau:
                     matched_tau = tau
                     break
@@ -1,4 +1,3 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas
 import ROOT
 import math
@@ -9,6 +8,9 @@ import fnmatch
 import numpy as np
 
 from tau_mc_link import getLinkedMCTau, getVisibleProperties, getDecayMode, getNRecoNeutralPis, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, add_stratification_args, get_input_files, iter_readers
 
 # Command line arguments
 parser = ArgumentParser()
@@ -16,10 +18,15 @@ parser = ArgumentParser()
 # Input file
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 
+add_reader_args(parser)
+add_stratification_args(parser)
 args = parser.parse_args()
 
-# Check if input file is a directory or a single file
-to_process = []
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['TauRec_PFO', 'PandoraPFOs', 'MCParticle', 'TauRecLink_PFO', 'RecoMCTruthLink']
+
+# Weighted events need the sum of squared weights for the errors
+if args.modeFractions: TH1F.SetDefaultSumw2()
 
 decay_modes = {
     0: '1P0N',
@@ -82,27 +89,17 @@ style_general_hists(hNPi0True, bins)
 hNPhotonReco = TH1F(f"n_reco_photons", f"N Reconstructed Photons", n_bins, 0, n_bins)
 style_general_hists(hNPhotonReco, bins)
 
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+# Check if input file is a directory or a single file
+to_process = get_input_files(args.inputFile)
 
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
 
     for ievt, event in enumerate(reader):
+        weight = event.weight # events sampled with --modeFractions stand for more than one
 
         reco_taus = event.getCollection('TauRec_PFO')
         pfos = event.getCollection('PandoraPFOs')
         mcParticles = event.getCollection('MCParticle')
-        tauRecoLink = event.getCollection('TauRecLink_PFO')
-        recoMCLink = event.getCollection('RecoMCTruthLink')
-
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
 
         mc_taus = [t for t in mcParticles if abs(t.getPDG()) == 15]
         reco_gamma_list = [pfo for pfo in pfos if pfo.getType() == 22]
@@ -120,7 +117,7 @@ for file in to_process:
                 #truth pi0
                 tau_daughters = mc_tau.getDaughters()
                 true_pi0s = [d for d in tau_daughters if abs(d.getPDG()) == 111]
-                hNPi0True.Fill(mode_to_bin_dict[decayMode], len(true_pi0s))
+                hNPi0True.Fill(mode_to_bin_dict[decayMode], len(true_pi0s) * weight)
 
                 #truth photons from pi0
                 true_pi0_gammas = [] # get mc photons from mc pi0
@@ -131,28 +128,28 @@ for file in to_process:
                             p = d.getMomentum() # get pt info
                             px, py, pz = p[0], p[1], p[2]
                             pt = math.sqrt(px**2 + py**2)
-                            hists_dict[decayMode]['true_pi0_photon_pt'].Fill(pt)
-                hNTruePhotonFromPi0.Fill(mode_to_bin_dict[decayMode], len(true_pi0_gammas))
+                            hists_dict[decayMode]['true_pi0_photon_pt'].Fill(pt, weight)
+                hNTruePhotonFromPi0.Fill(mode_to_bin_dict[decayMode], len(true_pi0_gammas) * weight)
 
                 true_photons = [d for d in tau_daughters if abs(d.getPDG()) == 22]
                 true_gammas_not_from_pi0 = [g for g in true_photons if g not in true_pi0_gammas] # all photons in tau not from pi0, only direct daughters
-                hNTruePhotonNotFromPi0.Fill(mode_to_bin_dict[decayMode], len(true_gammas_not_from_pi0))
+                hNTruePhotonNotFromPi0.Fill(mode_to_bin_dict[decayMode], len(true_gammas_not_from_pi0) * weight)
 
                 for g in true_gammas_not_from_pi0:
                     p = g.getMomentum() # get pt info
                     px, py, pz = p[0], p[1], p[2]
                     pt = math.sqrt(px**2 + py**2)
-                    hists_dict[decayMode]['true_not_pi0_photon_pt'].Fill(pt)
+                    hists_dict[decayMode]['true_not_pi0_photon_pt'].Fill(pt, weight)
 
             # Find reco taus linked to this MC tau
-            linked_reco_taus = relationNavigatorTau.getRelatedToObjects(mc_tau)
+            linked_reco_taus = event.navigator('TauRecLink_PFO').getRelatedToObjects(mc_tau)
 
             # For each linked reco tau, find linked PFOs and count photons
             n_reco_photons = 0
 
             for reco_tau in linked_reco_taus:
                 # Find PFOs linked to this reco tau
-                linked_pfos = relationNavigatorTau.getRelatedToObjects(reco_tau)
+                linked_pfos = event.navigator('TauRecLink_PFO').getRelatedToObjects(reco_tau)
                 for pfo in linked_pfos:
                     if pfo.getType() == 22:  # photon
                         n_reco_photons += 1
@@ -161,11 +158,11 @@ for file in to_process:
                         p = pfo.getMomentum()
                         px, py, pz = p[0], p[1], p[2]
                         pt = math.sqrt(px**2 + py**2)
-                        hists_dict[decayMode]['reco_gamma_pt'].Fill(pt)
+                        hists_dict[decayMode]['reco_gamma_pt'].Fill(pt, weight)
 
             # Fill general reco photon count histogram
             if decayMode in mode_to_bin_dict:
-                hNPhotonReco.Fill(mode_to_bin_dict[decayMode], n_reco_photons)
+                hNPhotonReco.Fill(mode_to_bin_dict[decayMode], n_reco_photons * weight)
 
 
     reader.close()
@@ -1,4 +1,3 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 import ROOT
 from ROOT import TH1F, TFile, TCanvas
 import math
@@ -10,6 +9,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from tau_mc_link import getDecayMode
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files, iter_readers
 
 # Command line arguments
 parser = ArgumentParser()
@@ -20,17 +22,14 @@ parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 # Output file
 parser.add_argument('--outputFile', type=str, default='pi_0_decay_ana.root')
 
+add_reader_args(parser)
 args = parser.parse_args()
 
-# Check if input file is a directory or a single file
-to_process = []
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['PandoraPFOs', 'MCParticle']
 
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+# Check if input file is a directory or a single file
+to_process = get_input_files(args.inputFile)
 
 
 #calculate the angle between two photons
@@ -78,15 +77,12 @@ for decay_num, decay_mode in decay_modes.items():
     }
 
 # Open input file(s)
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
 
     # Loop through events
     for ievt, event in enumerate(reader):
 
-        # Get collections
-        pfos = event.getCollection('PandoraPFOs')
+        # Get collections (the PFOs only for events with a tau in one of the decay modes)
         mcParticles = event.getCollection('MCParticle')
 
         taus = [t for t in mcParticles if abs(t.getPDG()) == 15] # get MC taus
@@ -101,7 +97,7 @@ for file in to_process:
                 if decayMode == 2 or decayMode == 3: decayMode = 1
 
                 #get reco photons, check all possible pairings
-                photons = [pfo for pfo in pfos if abs(pfo.getType()) == 22]
+                photons = [pfo for pfo in event.getCollection('PandoraPFOs') if abs(pfo.getType()) == 22]
                 if len(photons) >= 2:
                     angle = 3
                     for i in range(len(photons)):
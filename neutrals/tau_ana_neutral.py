@@ -1,4 +1,3 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas
 import math
 from argparse import ArgumentParser
@@ -8,6 +7,13 @@ import fnmatch
 import numpy as np
 
 from tau_mc_link import getLinkedMCTau, getVisibleProperties, getDecayMode, getNRecoNeutralPis, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from early_stop import EarlyStop, add_early_stop_args
+from event_io import add_reader_args, add_stratification_args, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial, write_sampling
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 # Command line arguments
 parser = ArgumentParser()
@@ -18,9 +24,20 @@ parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 # Output file
 parser.add_argument('--outputFile', type=str, default='tau_neutral_ana.root')
 
+add_reader_args(parser)
+add_stratification_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
+add_early_stop_args(parser)
 args = parser.parse_args()
 
-# Initialize histograms
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['RecoTaus', 'PandoraPFOs', 'MCParticle', 'TauPFOLink', 'RecoMCTruthLink']
+
+# Initialize histograms, weighted events need the sum of squared weights for the errors
+if args.modeFractions: TH1F.SetDefaultSumw2()
 general_hists = []
 hists_dict = {1: {}, 5:{}}
 
@@ -185,41 +202,45 @@ general_hists.append(hTauVisDaughterTypeTrue)
 
 
 # Check if input file is a directory or a single file
-to_process = []
-
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
 
 # Keep track of one-pion + neutrals reco daughter types
 pion_types = {1: {}, 5: {}}
 
+# Everything filled in the event loop, written as a partial output by --shard runs
+state = {'hists_dict': hists_dict, 'general_hists': {hist.GetName(): hist for hist in general_hists}, 'pion_types': pion_types}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
+
+# Efficiencies made below, --targetPrecision stops reading once they are precise enough
+efficiency_pairs = []
+for decay_num in decay_modes:
+    h = hists_dict[decay_num]
+    efficiency_pairs += [(h['mc_tau_pt'], h['true_vis_pT']), (h['mc_tau_theta'], h['true_vis_theta']), (h['mc_tau_phi'], h['true_vis_phi']),
+                         (h['linked_correct_reco_mc_tau_pt'], h['true_vis_pT']), (h['linked_correct_reco_mc_tau_theta'], h['true_vis_theta']),
+                         (h['linked_correct_reco_mc_tau_phi'], h['true_vis_phi']),
+                         (h['pi_0_matched_pT'], h['pi_0_true_pT']), (h['pi_0_matched_theta'], h['pi_0_true_theta']), (h['pi_0_matched_phi'], h['pi_0_true_phi']),
+                         (h['pi_matched_pT'], h['pi_true_pT']), (h['pi_matched_theta'], h['pi_true_theta']), (h['pi_matched_phi'], h['pi_true_phi'])]
+early_stop = EarlyStop(efficiency_pairs, args)
+
 # Open input file(s)
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
 
     # Loop through events
     for ievt, event in enumerate(reader):
+        if early_stop.stop_reading(): break
+        weight = event.weight # events sampled with --modeFractions stand for more than one
 
         # Get collections
         reco_taus = event.getCollection('RecoTaus')
         pfos = event.getCollection('PandoraPFOs')
         mcParticles = event.getCollection('MCParticle')
-        tauRecoLink = event.getCollection('TauPFOLink')
-        recoMCLink = event.getCollection('RecoMCTruthLink')
 
         reco_photons = [pfo for pfo in pfos if abs(pfo.getType()) == 22]
         reco_pis = [pfo for pfo in pfos if abs(pfo.getType()) == 211]
 
-        # Instantiate relation navigators to parse tauReco and RecoMC links
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
-
         # Loop through tau PFOs
         for reco_tau in reco_taus:
 
@@ -233,19 +254,19 @@ for file in to_process:
             reco_tau_daughters = reco_tau.getParticles()
 
             # Fill general reco tau hists
-            hTauE.Fill(E)
-            hTauPt.Fill(pt)
-            hTauTheta.Fill(theta)
-            hTauPhi.Fill(phi)
-            hTauNDaughters.Fill(len(reco_tau_daughters))
+            hTauE.Fill(E, weight)
+            hTauPt.Fill(pt, weight)
+            hTauTheta.Fill(theta, weight)
+            hTauPhi.Fill(phi, weight)
+            hTauNDaughters.Fill(len(reco_tau_daughters), weight)
 
             # Loop over reco daughters and fill reco daughter hists
             for daughter in reco_tau_daughters:
                 type_ = abs(daughter.getType())
-                hTauDaughterType.Fill(type_)
+                hTauDaughterType.Fill(type_, weight)
 
             # Get linked MC tau
-            mcTau = getLinkedMCTau(reco_tau, relationNavigatorTau, relationNavigatorRecoMC)
+            mcTau = getLinkedMCTau(reco_tau, event.navigator('TauPFOLink'), event.navigator('RecoMCTruthLink'))
 
             # Get visible properties of linked MC tau
             E_vis, px_vis, py_vis, pz_vis, n_daughters_vis, vis_daughter_types = getVisibleProperties(mcTau)
@@ -254,9 +275,9 @@ for file in to_process:
             phi_vis = math.acos(px_vis/pt_vis)
 
             # Fill linked MC tau hists
-            hLinkedMCTauPt.Fill(pt_vis)
-            hLinkedMCTauTheta.Fill(theta_vis)
-            hLinkedMCTauPhi.Fill(phi_vis)
+            hLinkedMCTauPt.Fill(pt_vis, weight)
+            hLinkedMCTauTheta.Fill(theta_vis, weight)
+            hLinkedMCTauPhi.Fill(phi_vis, weight)
 
             # Get linked MC tau decay mode
             decayMode = getDecayMode(mcTau)
@@ -265,12 +286,12 @@ for file in to_process:
             if decayMode in modes:
                 #fill mc info for all reco taus based on decay mode, general reco info
                 if decayMode == 2 or decayMode == 3: decayMode = 1 # combine these modes
-                hists_dict[decayMode]['mc_tau_pt'].Fill(pt_vis)
-                hists_dict[decayMode]['mc_tau_theta'].Fill(theta_vis)
-                hists_dict[decayMode]['mc_tau_phi'].Fill(phi_vis)
-                hists_dict[decayMode]['n_mc_tau_daughters'].Fill(n_daughters_vis)
+                hists_dict[decayMode]['mc_tau_pt'].Fill(pt_vis, weight)
+                hists_dict[decayMode]['mc_tau_theta'].Fill(theta_vis, weight)
+                hists_dict[decayMode]['mc_tau_phi'].Fill(phi_vis, weight)
+                hists_dict[decayMode]['n_mc_tau_daughters'].Fill(n_daughters_vis, weight)
                 for vis_daughter_type in vis_daughter_types:
-                    hTauNVisDaughtersTrue.Fill(vis_daughter_type)
+                    hTauNVisDaughtersTrue.Fill(vis_daughter_type, weight)
 
                 # Get number of reco neutral pions in reco tau daughters
                 nRecoNeutralPis = getNRecoNeutralPis(reco_tau)
@@ -279,22 +300,22 @@ for file in to_process:
                 # correctly reconstructed tau, ie. links to proper type and satisfies the criteria for that type
                 if nRecoNeutralPis > 0 and ((decayMode == 1 and nQRecopis == 1) or (decayMode == 5 and nQRecopis == 3)):
                     # Fill truth info hists for linked reco-neutral that pass criteria
-                    hists_dict[decayMode]['linked_correct_reco_mc_tau_pt'].Fill(pt_vis)
-                    hists_dict[decayMode]['linked_correct_reco_mc_tau_theta'].Fill(theta_vis)
-                    hists_dict[decayMode]['linked_correct_reco_mc_tau_phi'].Fill(phi_vis)
-                    hists_dict[decayMode]['n_linked_correct_reco_tau_daughters'].Fill(nRecoNeutralPis)
+                    hists_dict[decayMode]['linked_correct_reco_mc_tau_pt'].Fill(pt_vis, weight)
+                    hists_dict[decayMode]['linked_correct_reco_mc_tau_theta'].Fill(theta_vis, weight)
+                    hists_dict[decayMode]['linked_correct_reco_mc_tau_phi'].Fill(phi_vis, weight)
+                    hists_dict[decayMode]['n_linked_correct_reco_tau_daughters'].Fill(nRecoNeutralPis, weight)
 
                     # Fill reco info hists with reco neutral info
-                    hists_dict[decayMode]['reco_tau_energy'].Fill(E)
-                    hists_dict[decayMode]['reco_tau_pt'].Fill(pt)
-                    hists_dict[decayMode]['reco_tau_theta'].Fill(theta)
-                    hists_dict[decayMode]['reco_tau_phi'].Fill(phi)
-                    hTauNDaughters.Fill(len(reco_tau_daughters))
+                    hists_dict[decayMode]['reco_tau_energy'].Fill(E, weight)
+                    hists_dict[decayMode]['reco_tau_pt'].Fill(pt, weight)
+                    hists_dict[decayMode]['reco_tau_theta'].Fill(theta, weight)
+                    hists_dict[decayMode]['reco_tau_phi'].Fill(phi, weight)
+                    hTauNDaughters.Fill(len(reco_tau_daughters), weight)
                     for daughter in reco_tau_daughters: # get daughters
                         type_ = abs(daughter.getType())
-                        hists_dict[decayMode]['reco_tau_daughter_types'].Fill(type_)
-                        if str(type_) in pion_types[decayMode]: pion_types[decayMode][str(type_)] += 1
-                        else: pion_types[decayMode][str(type_)] = 1
+                        hists_dict[decayMode]['reco_tau_daughter_types'].Fill(type_, weight)
+                        if str(type_) in pion_types[decayMode]: pion_types[decayMode][str(type_)] += weight
+                        else: pion_types[decayMode][str(type_)] = weight
 
         # Loop through MC particles
         for mcParticle in mcParticles:
@@ -310,13 +331,13 @@ for file in to_process:
                 phi_vis = math.acos(px_vis/pt_vis)
 
                 # Fill visible mc tau hists
-                hTauVisETrue.Fill(E_vis)
-                hTauVisPtTrue.Fill(pt_vis)
-                hTauVisThetaTrue.Fill(theta_vis)
-                hTauVisPhiTrue.Fill(phi_vis)
-                hTauNVisDaughtersTrue.Fill(n_daughters_vis)
+                hTauVisETrue.Fill(E_vis, weight)
+                hTauVisPtTrue.Fill(pt_vis, weight)
+                hTauVisThetaTrue.Fill(theta_vis, weight)
+                hTauVisPhiTrue.Fill(phi_vis, weight)
+                hTauNVisDaughtersTrue.Fill(n_daughters_vis, weight)
                 for vis_daughter_type in vis_daughter_types:
-                    hTauVisDaughterTypeTrue.Fill(vis_daughter_type)
+                    hTauVisDaughterTypeTrue.Fill(vis_daughter_type, weight)
 
                 # Get total properties
                 tot_mom = mcParticle.getMomentum()
@@ -331,51 +352,55 @@ for file in to_process:
                 if decayMode in modes:
                     if decayMode == 2 or decayMode == 3: decayMode = 1
                     # Fill mc visible tau hists
-                    hists_dict[decayMode]['true_vis_pT'].Fill(pt_vis)
-                    hists_dict[decayMode]['true_vis_theta'].Fill(theta_vis)
-                    hists_dict[decayMode]['true_vis_phi'].Fill(phi_vis)
-                    hists_dict[decayMode]['true_tot_pT'].Fill(tot_pt)
-                    hists_dict[decayMode]['true_tot_theta'].Fill(tot_theta)
-                    hists_dict[decayMode]['true_tot_phi'].Fill(tot_phi)
+                    hists_dict[decayMode]['true_vis_pT'].Fill(pt_vis, weight)
+                    hists_dict[decayMode]['true_vis_theta'].Fill(theta_vis, weight)
+                    hists_dict[decayMode]['true_vis_phi'].Fill(phi_vis, weight)
+                    hists_dict[decayMode]['true_tot_pT'].Fill(tot_pt, weight)
+                    hists_dict[decayMode]['true_tot_theta'].Fill(tot_theta, weight)
+                    hists_dict[decayMode]['true_tot_phi'].Fill(tot_phi, weight)
 
                     mc_pis_0 = [daughter for daughter in mcParticle.getDaughters() if abs(daughter.getPDG()) == 111]
                     mc_pis = [daughter for daughter in mcParticle.getDaughters() if abs(daughter.getPDG()) == 211]
 
                     for mc_pi_0 in mc_pis_0: # neutral pi info
                         # Fill true histogram using mc tau info
-                        hists_dict[decayMode]['pi_0_true_pT'].Fill(pt_vis)
-                        hists_dict[decayMode]['pi_0_true_phi'].Fill(phi_vis)
-                        hists_dict[decayMode]['pi_0_true_theta'].Fill(theta_vis)
+                        hists_dict[decayMode]['pi_0_true_pT'].Fill(pt_vis, weight)
+                        hists_dict[decayMode]['pi_0_true_phi'].Fill(phi_vis, weight)
+                        hists_dict[decayMode]['pi_0_true_theta'].Fill(theta_vis, weight)
                     for mc_pi in mc_pis: #charged pi
-                        hists_dict[decayMode]['pi_true_pT'].Fill(pt_vis)
-                        hists_dict[decayMode]['pi_true_phi'].Fill(phi_vis)
-                        hists_dict[decayMode]['pi_true_theta'].Fill(theta_vis)
+                        hists_dict[decayMode]['pi_true_pT'].Fill(pt_vis, weight)
+                        hists_dict[decayMode]['pi_true_phi'].Fill(phi_vis, weight)
+                        hists_dict[decayMode]['pi_true_theta'].Fill(theta_vis, weight)
 
                     linked_mc_pi_0 = []
                     linked_mc_pis = []
                     for reco_photon in reco_photons:
-                        linkedMCParticles = relationNavigatorRecoMC.getRelatedToObjects(reco_photon)
+                        linkedMCParticles = event.navigator('RecoMCTruthLink').getRelatedToObjects(reco_photon)
                         for linkedMCParticle in linkedMCParticles:
                             if abs(linkedMCParticle.getPDG()) == 111 and linkedMCParticle not in linked_mc_pi_0:
                                 # if reco photon matches a mc pion and mc pion has not been matched before
                                 linked_mc_pi_0.append(linkedMCParticle)
-                                hists_dict[decayMode]['pi_0_matched_pT'].Fill(pt_vis)
-                                hists_dict[decayMode]['pi_0_matched_phi'].Fill(phi_vis)
-                                hists_dict[decayMode]['pi_0_matched_theta'].Fill(theta_vis)
+                                hists_dict[decayMode]['pi_0_matched_pT'].Fill(pt_vis, weight)
+                                hists_dict[decayMode]['pi_0_matched_phi'].Fill(phi_vis, weight)
+                                hists_dict[decayMode]['pi_0_matched_theta'].Fill(theta_vis, weight)
 
                     for reco_pi in reco_pis: # get reco charged pi info
-                        linkedMCParticles = relationNavigatorRecoMC.getRelatedToObjects(reco_pi)
+                        linkedMCParticles = event.navigator('RecoMCTruthLink').getRelatedToObjects(reco_pi)
                         for linkedMCParticle in linkedMCParticles:
                             if abs(linkedMCParticle.getPDG()) == 211 and linkedMCParticle not in linked_mc_pis:
                                 linked_mc_pis.append(linkedMCParticle)
 
                     if (len(linked_mc_pis) == 1 and decayMode == 1) or (len(linked_mc_pis) == 3 and decayMode == 5):
-                        hists_dict[decayMode]['pi_matched_pT'].Fill(pt_vis)
-                        hists_dict[decayMode]['pi_matched_phi'].Fill(phi_vis)
-                        hists_dict[decayMode]['pi_matched_theta'].Fill(theta_vis)
+                        hists_dict[decayMode]['pi_matched_pT'].Fill(pt_vis, weight)
+                        hists_dict[decayMode]['pi_matched_phi'].Fill(phi_vis, weight)
+                        hists_dict[decayMode]['pi_matched_theta'].Fill(theta_vis, weight)
 
     # Close file
     reader.close()
+    if early_stop.stopped: break
+
+early_stop.report()
+write_partial(state, args)
 
 # function to style a hist based on specifications and add to hist list
 def style_hist(hist, color, width, title, x_label, y_label):
@@ -463,6 +488,7 @@ for decay_num in hists_dict.keys():
 for hist in general_hists:
     hist.Write()
 
+write_sampling(state)
 output_file.Close()
 
 # Draw hists and save as PNG
@@ -0,0 +1,202 @@
+# Partial outputs: the accumulated (not yet derived) results of a run over part of the input
+# A script collects everything it fills in a state dict of histograms, dicts (counters) and lists, e.g.
+#   state = {'hists': {h.GetName(): h for h in hists}, 'counts': counts}
+# A --shard run writes its state with write_partial, a final run with --mergePartials adds the partial outputs
+# back into the (empty) state and then makes the efficiencies, fits and plots as if it had read all events itself
+import os
+import pickle
+import sys
+
+import ROOT
+
+
+def add_partial_args(parser):
+    parser.add_argument('--partialOutput', type=str, default=None,
+                        help='Write the accumulated results to this file and stop before the final outputs '
+                             '(default for --shard i/N runs: <outputFile>_shard<i>of<N>.partial)')
+    parser.add_argument('--mergePartials', type=str, nargs='+', default=None,
+                        help='Make the final outputs from these partial outputs instead of reading events')
+
+
+# Add other into state: histograms are added, numbers summed, lists extended and dicts merged key by key
+def merge_state(state, other):
+    for key, value in other.items():
+        if key not in state:
+            if isinstance(value, ROOT.TH1): value.SetDirectory(0)
+            state[key] = value
+        elif isinstance(value, ROOT.TH1):
+            state[key].Add(value)
+        elif isinstance(value, dict):
+            merge_state(state[key], value)
+        elif isinstance(value, list):
+            state[key].extend(value)
+        elif isinstance(value, set):
+            state[key].update(value)
+        else:
+            state[key] += value
+    return state
+
+
+# Empty the state in place, keeping the objects the script fills
+def reset_state(state):
+    for key, value in state.items():
+        if isinstance(value, ROOT.TH1):
+            value.Reset()
+        elif isinstance(value, dict):
+            reset_state(value)
+        elif isinstance(value, (list, set)):
+            value.clear()
+        else:
+            state[key] = type(value)()
+
+
+# Keys of a state (nested for dicts), taken when it is emptied to tell the entries filled since then from the others
+def state_keys(state):
+    return {key: state_keys(value) if isinstance(value, dict) else None for key, value in state.items()}
+
+
+def _is_empty(value):
+    if isinstance(value, ROOT.TH1):
+        return value.GetEntries() == 0
+    if isinstance(value, (list, set)):
+        return not value
+    return value == 0
+
+
+# The part of the state filled since it was emptied (keys from state_keys then): entries that were already there and
+# are still empty are left out, so the results of one file do not carry the emptied entries of every file before it
+# (e.g. the per-file counters of the strange_prong_case scripts); new entries are kept whole
+def state_delta(state, keys):
+    delta = {}
+    for key, value in state.items():
+        if key in keys:
+            if isinstance(value, dict):
+                value = state_delta(value, keys[key])
+                if not value: continue
+            elif _is_empty(value):
+                continue
+        delta[key] = value
+    return delta
+
+
+def save_partial(state, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_partial(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def partial_path(args):
+    if args.partialOutput:
+        return args.partialOutput
+    if getattr(args, 'shard', None):
+        i, n_shards = args.shard
+        output = getattr(args, 'outputFile', None) or os.path.basename(sys.argv[0]) # scripts that only print use their own name
+        return f'{os.path.splitext(output)[0]}_shard{i}of{n_shards}.partial'
+    return None
+
+
+# With --mergePartials: add the partial outputs to the state, no events are read (returns the files still to read)
+def read_partials(state, to_process, args):
+    if not args.mergePartials:
+        return to_process
+    for path in args.mergePartials:
+        merge_state(state, load_partial(path))
+    print(f"Merged {len(args.mergePartials)} partial outputs")
+    return []
+
+
+# Number of events each event read stands for in a --sampleFraction/--maxEvents run, 1 if all events were read
+# state['sampling'] counts the events sampled from, the events read and their summed event weights (filled by
+# workers.worker_readers); in a --modeFractions run the event weights are in the histograms already and this is
+# only the (small) correction of their sum to the number of events
+def sampling_weight(state):
+    sampling = state.get('sampling')
+    if not sampling or not sampling['weighted']:
+        return 1.0
+    return sampling['events'] / sampling['weighted']
+
+
+# Keep the sampling of the run with the histograms: TParameter<double> objects in the current (output) ROOT directory
+def write_sampling(state):
+    sampling = state.get('sampling')
+    if not sampling:
+        return
+    for name, value in (('sampleWeight', sampling_weight(state)), ('sampledFromEvents', sampling['events']),
+                        ('sampledEvents', sampling['sampled'])):
+        ROOT.TParameter('double')(name, value).Write()
+
+
+# For --shard/--partialOutput runs: write the state and stop, the final outputs are made by the --mergePartials run
+# Otherwise the final outputs follow, the counts and histogram entries of a sampled run are reported as such
+def write_partial(state, args):
+    path = partial_path(args)
+    if path is None:
+        if state.get('sampling'):
+            sampling = state['sampling']
+            weighted = ' with event weights' if sampling['weighted'] != sampling['sampled'] else ''
+            print(f"Sampled run: read {sampling['sampled']} of {sampling['events']} events{weighted}, "
+                  f"multiply counts and histogram entries by {sampling_weight(state):.4g} for the full sample "
+                  f"(efficiencies and shapes need no correction)")
+        return
+    save_partial(state, path)
+    print(f"Partial output written to {path}")
+    sys.exit(0)
+
+
+def add_checkpoint_args(parser):
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Save the accumulated results and the finished input files here while running, '
+                             'a rerun with the same checkpoint skips the finished files')
+    parser.add_argument('--checkpointEvery', type=int, default=10, help='Number of input files between checkpoints')
+
+
+# Periodic checkpoints of a state (see above) during a multi-file event loop:
+#   checkpoint = Checkpoint(state, args)
+#   to_process = checkpoint.resume(to_process)
+#   for file, reader in checkpoint.track(iter_readers(to_process, COLLECTIONS, args)):
+# Without --checkpoint both calls pass everything through
+class Checkpoint:
+    def __init__(self, state, args):
+        self.state = state
+        self.path = args.checkpoint
+        self.every = max(1, args.checkpointEvery)
+        self.done = []
+        self.unsaved = 0
+
+    # Restore the state of an earlier run and drop the files it finished
+    def resume(self, to_process):
+        if self.path is None or not os.path.exists(self.path):
+            return to_process
+        saved = load_partial(self.path)
+        merge_state(self.state, saved['state'])
+        self.done = saved['done']
+        done = set(self.done)
+        remaining = [file for file in to_process if file not in done]
+        print(f"Resuming from {self.path}: {len(to_process) - len(remaining)} files already done, {len(remaining)} to go")
+        return remaining
+
+    def save(self):
+        save_partial({'state': self.state, 'done': self.done}, self.path)
+        self.unsaved = 0
+
+    # Call once the results of file are in the state
+    def file_done(self, file):
+        if self.path is None: return
+        self.done.append(file)
+        self.unsaved += 1
+        if self.unsaved >= self.every:
+            self.save()
+
+    # A file counts as finished once the loop asks for the next one
+    def track(self, readers):
+        for file, reader in readers:
+            yield file, reader
+            self.file_done(file)
+        if self.path is not None:
+            self.save()
@@ -1,5 +1,9 @@
-from ROOT import TFile
 from argparse import ArgumentParser
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from anatree import add_anatree_args, has_tree, iter_anatree
 
 
 # Command line arguments
@@ -7,44 +11,31 @@ parser = ArgumentParser()
 
 # Input file
 parser.add_argument('--inputFile', type=str, default='Taus_loose.root')
+add_anatree_args(parser)
 
 args = parser.parse_args()
 
-file = TFile.Open(args.inputFile)
-
-tree = file.Get('anatree')
-
-if not tree:
+if not has_tree(args.inputFile):
     print('TTree not found in file!')
     exit()
 
-tau_pt = []
-tau_isoE = []
-tau_invM = []
-event_num = []
-pt_by_5 = [0] * 60
-nrej_isoE_tot = 0
+n_candidates = 0
 n_isoE_more_5 = 0
 n_invM_more_2 = 0
 n_Pt_less_5 = 0
-n_Pt_more_5_less_10 = 0
-
-
-for i in range(tree.GetEntries()): # get info for the tau candidate parameters
-    tree.GetEntry(i)
-    nrej_isoE_tot += tree.nrej_isoE
+pt_by_5 = np.zeros(60, dtype=np.int64)
 
-    for j in range(tree.ntau):
-        tau_pt.append(tree.t_pt[j])
-        tau_isoE.append(tree.t_isoE[j])
-        tau_invM.append(tree.t_minv[j])
-        event_num.append(tree.event_num[j])
+for taus in iter_anatree(args.inputFile, ['t_pt', 't_isoE', 't_minv'], args.chunkSize, args.threads): # get info for the tau candidate parameters
+    tau_pt = taus['t_pt']
+    n_candidates += len(tau_pt)
+    n_isoE_more_5 += int(np.count_nonzero(taus['t_isoE'] > 5))
+    n_invM_more_2 += int(np.count_nonzero(taus['t_minv'] > 2))
+    n_Pt_less_5 += int(np.count_nonzero(tau_pt <= 5))
+    # for each bin of 5 pt (5 * i < pt <= 5 + 5 * i) find num of tau candidates
+    pt_bin = np.searchsorted(5 * np.arange(61), tau_pt, side='left') - 1
+    pt_by_5 += np.bincount(pt_bin[(pt_bin >= 0) & (pt_bin < 60)], minlength=60)
 
-for isoE in tau_isoE:
-    if isoE > 5:
-        n_isoE_more_5 += 1
-
-n_candidates = len(event_num)
+pt_by_5 = pt_by_5.tolist()
 
 print("")
 print("--------------------------Isolation Energy------------------------------")
@@ -53,23 +44,12 @@ print("Percent of Tau candidates rejected with isolation energy greater than 5:
 print("")
 
 
-for invM in tau_invM:
-    if invM > 2:
-        n_invM_more_2 += 1
-
 print("")
 print("--------------------------Invariant Mass--------------------------------")
 print("Number of Tau candidates rejected with invariant mass greater than 2: " + str(n_invM_more_2))
 print("Percent of Tau candidates rejected with invariant mass greater than 2: " + str(round(n_invM_more_2/n_candidates * 100 , 2)) + "%")
 print("")
 
-for pt in tau_pt:
-    if pt <= 5:
-        n_Pt_less_5 += 1
-    for i in range(60):
-        if 5 * i < pt <= 5 + 5 * i: # for each bin of 5 pt find num of tau candidates
-            pt_by_5[i] += 1
-
 print("---------------------------Transverse Momentum--------------------------")
 print("Number of Tau candidates with transverse momentum less than 5: " + str(n_Pt_less_5))
 print("Percent of Tau candidates with transverse momentum less than 5: " + str(round(n_Pt_less_5/n_candidates * 100, 2)) + "%")
@@ -1,8 +1,11 @@
-from ROOT import TFile
 import matplotlib.pyplot as plt
 from argparse import ArgumentParser
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from anatree import add_anatree_args, has_tree, iter_anatree
 
 uw_red = '#c5050c'
 light_base = '#ffe6e6'
@@ -13,69 +16,77 @@ parser = ArgumentParser()
 
 # Input file
 parser.add_argument('--inputFile', type=str, default='Taus_default.root')
+# Event list of the isoE > 100 GeV events, can be passed as --events to the slcio scripts
+parser.add_argument('--eventList', type=str, default=None)
 
-args = parser.parse_args()
-
-file = TFile.Open(args.inputFile)
+add_anatree_args(parser)
 
-tree = file.Get('anatree')
+args = parser.parse_args()
 
-if not tree:
+if not has_tree(args.inputFile):
     print('TTree not found in file!')
     exit()
 
-tau_pt = []
-tau_isoE = []
-tau_invM = []
-isoE_100 = []
-event_num = []
-event_num_isoE_100 = []
+# The pt vs isoE and pt vs invM planes are counted in fine bins chunk by chunk and drawn as hexbins from those counts,
+# so memory does not depend on the number of tau candidates
+FINE_BINS = 1000
+pt_edges = np.linspace(0, 300, FINE_BINS + 1)
+isoE_edges = np.linspace(0, 10, FINE_BINS + 1)
+invM_edges = np.linspace(0, 3, FINE_BINS + 1)
+pt_isoE_counts = np.zeros((FINE_BINS, FINE_BINS))
+pt_invM_counts = np.zeros((FINE_BINS, FINE_BINS))
+
+n_taus = 0
 nrej_isoE_tot = 0
 n_isoE_more_5 = 0
 n_invM_more_2 = 0
+isoE_100 = []
+event_num_isoE_100 = []
 
-
-for i in range(tree.GetEntries()):
-    tree.GetEntry(i)
-    nrej_isoE_tot += tree.nrej_isoE
-
-    for j in range(tree.ntau):
-        tau_pt.append(tree.t_pt[j])
-        tau_isoE.append(tree.t_isoE[j])
-        tau_invM.append(tree.t_minv[j])
-        event_num.append(tree.event_num[j])
-
-for isoE in tau_isoE:
-    if isoE > 5:
-        n_isoE_more_5 += 1
-
-for invM in tau_invM:
-    if invM > 2:
-        n_invM_more_2 += 1
+for taus in iter_anatree(args.inputFile, ['nrej_isoE', 't_pt', 't_isoE', 't_minv', 'event_num'], args.chunkSize, args.threads):
+    tau_pt = taus['t_pt']
+    tau_isoE = taus['t_isoE']
+    tau_invM = taus['t_minv']
+    n_taus += len(tau_pt)
+    nrej_isoE_tot += int(taus['nrej_isoE'].sum())
+    n_isoE_more_5 += int(np.count_nonzero(tau_isoE > 5))
+    n_invM_more_2 += int(np.count_nonzero(tau_invM > 2))
+    event_num_isoE_100.extend(taus['event_num'][tau_isoE > 100].tolist())
+    isoE_100.extend(tau_isoE[tau_isoE > 100].tolist())
+    pt_isoE_counts += np.histogram2d(tau_pt, tau_isoE, bins=[pt_edges, isoE_edges])[0]
+    pt_invM_counts += np.histogram2d(tau_pt, tau_invM, bins=[pt_edges, invM_edges])[0]
+
+
+# hexbin of the fine bin counts: every non-empty fine bin is a point at its center weighted by its count
+def hexbin_counts(counts, x_edges, y_edges, extent):
+    ix, iy = np.nonzero(counts)
+    plt.hexbin(
+        ((x_edges[:-1] + x_edges[1:]) / 2)[ix],
+        ((y_edges[:-1] + y_edges[1:]) / 2)[iy],
+        C=counts[ix, iy],
+        reduce_C_function=np.sum,
+        gridsize=50,
+        extent=extent,  # Match your axis limits
+        mincnt=1,  # Ignore empty bins
+        cmap=uw_cmap
+    )
 
 print(f'Number of taus that fail isoE: {nrej_isoE_tot}')
-print(f'Fraction of taus with isoE > 5 GeV: {n_isoE_more_5/len(tau_isoE)}')
-print(f'Fraction of taus with invM > 2 GeV/c^2: {n_invM_more_2/len(tau_invM)}')
-
-for i in range(len(event_num)):
-    if tau_isoE[i] > 100:
-        event_num_isoE_100.append(event_num[i])
-        isoE_100.append(tau_isoE[i])
+print(f'Fraction of taus with isoE > 5 GeV: {n_isoE_more_5/n_taus}')
+print(f'Fraction of taus with invM > 2 GeV/c^2: {n_invM_more_2/n_taus}')
 
 print(f'Events with isoE > 100 GeV:')
 for i in range(len(event_num_isoE_100)):
     print(f'Event number: {event_num_isoE_100[i]}     Isolation Energy: {isoE_100[i]}')
 
+if args.eventList:
+    with open(args.eventList, 'w') as f:
+        for evt in sorted(set(event_num_isoE_100)):
+            f.write(f'{evt}\n')
+
 
 #isoE
-plt.hexbin(
-    tau_pt,
-    tau_isoE,
-    gridsize=50,
-    extent=[0, 300, 0, 10],  # Match your axis limits
-    mincnt=1,  # Ignore empty bins
-    cmap=uw_cmap
-)
+hexbin_counts(pt_isoE_counts, pt_edges, isoE_edges, [0, 300, 0, 10])
 plt.colorbar(label=r'# of reco $\tau^-$')
 
 #plt.scatter(tau_pt, tau_isoE, color='magenta', s=10, alpha=0.2)
@@ -109,14 +120,7 @@ plt.savefig('hex_pt_iso_E.png')
 plt.clf()
 
 #invM
-plt.hexbin(
-    tau_pt,
-    tau_invM,
-    gridsize=50,
-    extent=[0, 300, 0, 3],  # Match your axis limits
-    mincnt=1,  # Ignore empty bins
-    cmap=uw_cmap
-)
+hexbin_counts(pt_invM_counts, pt_edges, invM_edges, [0, 300, 0, 3])
 plt.colorbar(label=r'# of reco $\tau^-$')
 
 #plt.scatter(tau_pt, tau_invM, color='magenta', s=10, alpha=0.2)
@@ -154,6 +158,3 @@ for label in plt.gca().get_xticklabels() + plt.gca().get_yticklabels():
 plt.savefig('hex_pt_inv_M.png')
 
 #plt.show()
-
-
-file.Close()
@@ -0,0 +1,88 @@
+# Per-file result cache: the results (partial state, see partials.py) of every input file are kept on disk
+#   python neutrals/tau_ana_neutral.py --inputFile <sample> --resultCache <cache directory>
+# A rerun only reads the files that are new or changed and adds the cached results of the others,
+# so changing a plot or adding files to a sample does not mean reading the whole sample again
+# Cached results are used if the file (path, size, modification time), its reader options, the script arguments
+# and the script code up to write_partial (booking and event loop, not the plots after it) are unchanged
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+from partials import load_partial, merge_state, reset_state, save_partial, state_delta, state_keys
+
+# Arguments that decide how, not what, a script reads; they do not change the per-file results
+EXECUTION_ARGS = {'inputFile', 'outputFile', 'prefetch', 'catalog', 'events', 'eventIndex', 'shard',
+                  'partialOutput', 'mergePartials', 'checkpoint', 'checkpointEvery',
+                  'filesPerWorker', 'maxWorkerMemory', 'resultCache', 'dedupe', 'decayModeIndex', 'jobs'}
+
+
+def add_result_cache_args(parser):
+    parser.add_argument('--resultCache', type=str, default=None,
+                        help='Directory keeping the results of each input file, a rerun only reads new or changed files')
+
+
+# Event loop part of the running script: its code up to the write_partial call
+def script_code():
+    path = os.path.abspath(sys.argv[0])
+    with open(path) as f:
+        code = f.read()
+    end = code.find('write_partial(state')
+    return os.path.basename(path) + '\n' + (code[:end] if end >= 0 else code)
+
+
+class ResultCache:
+    def __init__(self, args):
+        self.directory = args.resultCache
+        config = {key: value for key, value in sorted(vars(args).items()) if key not in EXECUTION_ARGS}
+        self.config = script_code() + json.dumps(config, sort_keys=True, default=str)
+        self.total = None
+        self.keys = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, file, options):
+        stat = os.stat(file)
+        key = hashlib.sha1()
+        key.update(self.config.encode())
+        key.update(json.dumps([os.path.abspath(file), stat.st_size, stat.st_mtime_ns, options or {}],
+                              sort_keys=True, default=list).encode())
+        return os.path.join(self.directory, key.hexdigest() + '.partial')
+
+    # Add the cached results to the state, returns the files still to read
+    def restore(self, state, files, options):
+        remaining = []
+        for file in files:
+            path = self.path(file, options.get(file))
+            if os.path.exists(path):
+                merge_state(state, load_partial(path))
+            else:
+                remaining.append(file)
+        print(f"Result cache {self.directory}: {len(files) - len(remaining)} of {len(files)} files cached, {len(remaining)} to read")
+        return remaining
+
+    # While reading, the state only holds the results of the current file, the results so far are kept aside
+    def start(self, state):
+        self.total = pickle.loads(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        reset_state(state)
+        self.keys = state_keys(state)
+
+    # Only what the file filled is cached, not the emptied entries of the files before it
+    def file_done(self, file, options, state):
+        delta = state_delta(state, self.keys)
+        save_partial(delta, self.path(file, options))
+        merge_state(self.total, pickle.loads(pickle.dumps(delta, protocol=pickle.HIGHEST_PROTOCOL)))
+        reset_state(state)
+        self.keys = state_keys(state)
+
+    # Put the results of all files back into the state
+    def finish(self, state):
+        merge_state(state, self.total)
+        self.total = None
+
+    def track(self, readers, state, options):
+        self.start(state)
+        for file, reader in readers:
+            yield file, reader
+            self.file_done(file, options.get(file), state)
+        self.finish(state)
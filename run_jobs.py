@@ -0,0 +1,181 @@
+# Job runner: splits a script's input into --shard i/N tasks, runs them, retries the failed ones and merges the results
+#   python run_jobs.py --shards 50 --jobs 8 --workDir jobs/tau neutrals/tau_ana_neutral.py --inputFile <sample>
+# Every task runs the script with --shard i/N --partialOutput <workDir>/task<i>.partial (see partials.py); once all
+# tasks are done the script runs once more with --mergePartials to make the final outputs
+# The tasks and their state are kept in <workDir>/manifest.json, rerunning the same command only runs the tasks that
+# are not done yet (after an interrupted run or a task that failed all its attempts)
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import REMAINDER, ArgumentParser
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+# One task per shard, all pending
+def make_manifest(script, script_args, n_shards, work_dir):
+    tasks = []
+    for i in range(n_shards):
+        tasks.append({'id': i, 'shard': f'{i}/{n_shards}',
+                      'partial': os.path.join(work_dir, f'task{i}.partial'), 'log': os.path.join(work_dir, f'task{i}.log'),
+                      'status': 'pending', 'attempts': 0, 'error': None})
+    return {'script': script, 'args': script_args, 'shards': n_shards, 'tasks': tasks}
+
+
+# The manifest of work_dir, created for this command if there is none yet
+# Tasks left running by an interrupted runner are pending again, as are done tasks whose partial output is gone
+def get_manifest(path, script, script_args, n_shards, work_dir):
+    if not os.path.exists(path):
+        return make_manifest(script, script_args, n_shards, work_dir)
+    manifest = load_manifest(path)
+    if (manifest['script'], manifest['args'], manifest['shards']) != (script, script_args, n_shards):
+        raise ValueError(f"{path} was made for '{manifest['script']} {' '.join(manifest['args'])}' in "
+                         f"{manifest['shards']} shards, use another --workDir for a different command")
+    for task in manifest['tasks']:
+        if task['status'] == 'running' or (task['status'] == 'done' and not os.path.exists(task['partial'])):
+            task['status'] = 'pending'
+    return manifest
+
+
+def task_command(manifest, task):
+    return [sys.executable, manifest['script']] + manifest['args'] + ['--shard', task['shard'], '--partialOutput', task['partial']]
+
+
+# Runs tasks as local processes, at most jobs at a time; the output of every attempt is appended to the task's log
+# An executor (e.g. for a batch system) needs submit(task, command), a number of free_slots() and wait(), which
+# blocks until at least one submitted task has finished and returns (task, error) for each, error None on success
+class LocalExecutor:
+    def __init__(self, jobs):
+        self.jobs = max(1, jobs)
+        self.running = []
+
+    def free_slots(self):
+        return self.jobs - len(self.running)
+
+    def submit(self, task, command):
+        log = open(task['log'], 'a')
+        log.write(f"# attempt {task['attempts']}: {' '.join(command)}\n")
+        log.flush()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        self.running.append((task, process, log))
+
+    def wait(self):
+        while True:
+            finished = [entry for entry in self.running if entry[1].poll() is not None]
+            if finished: break
+            time.sleep(0.5)
+        results = []
+        for entry in finished:
+            task, process, log = entry
+            self.running.remove(entry)
+            log.close()
+            if process.returncode < 0:
+                results.append((task, f'killed by signal {-process.returncode}'))
+            elif process.returncode > 0:
+                results.append((task, f'exit status {process.returncode}'))
+            else:
+                results.append((task, None))
+        return results
+
+    # Stop everything still running (the runner was interrupted)
+    def kill(self):
+        for task, process, log in self.running:
+            process.kill()
+            process.wait()
+            log.close()
+        self.running = []
+
+
+EXECUTORS = {'local': LocalExecutor}
+
+
+# Run the tasks that are not done, each up to retries + 1 times; the manifest is saved after every change
+def run_tasks(manifest, path, executor, retries):
+    pending = [task for task in manifest['tasks'] if task['status'] != 'done']
+    for task in pending:
+        task['status'] = 'pending'
+        task['attempts'] = 0
+    try:
+        while pending or executor.running:
+            while pending and executor.free_slots() > 0:
+                task = pending.pop(0)
+                task['attempts'] += 1
+                task['status'] = 'running'
+                if os.path.exists(task['partial']): os.remove(task['partial']) # left by an earlier attempt
+                executor.submit(task, task_command(manifest, task))
+            save_manifest(manifest, path)
+
+            for task, error in executor.wait():
+                if error is None and not os.path.exists(task['partial']):
+                    error = 'no partial output written'
+                task['error'] = error
+                if error is None:
+                    task['status'] = 'done'
+                elif task['attempts'] <= retries:
+                    print(f"Task {task['id']} failed ({error}), retrying (see {task['log']})")
+                    task['status'] = 'pending'
+                    pending.append(task)
+                else:
+                    print(f"Task {task['id']} failed ({error}) after {task['attempts']} attempts, see {task['log']}")
+                    task['status'] = 'failed'
+            save_manifest(manifest, path)
+    except KeyboardInterrupt:
+        executor.kill()
+        for task in manifest['tasks']:
+            if task['status'] == 'running': task['status'] = 'pending'
+        save_manifest(manifest, path)
+        raise
+
+
+def merge_command(manifest):
+    return [sys.executable, manifest['script']] + manifest['args'] + \
+        ['--mergePartials'] + [task['partial'] for task in manifest['tasks']]
+
+
+def main():
+    parser = ArgumentParser(description='Run an event-loop script as sharded tasks and merge their partial outputs')
+    parser.add_argument('--shards', type=int, required=True, help='Number of tasks the input is split into')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of tasks run at the same time')
+    parser.add_argument('--workDir', type=str, required=True, help='Directory of the manifest, task logs and partial outputs')
+    parser.add_argument('--retries', type=int, default=2, help='Number of times a failed or killed task is run again')
+    parser.add_argument('--executor', type=str, choices=sorted(EXECUTORS), default='local', help='Where the tasks run')
+    parser.add_argument('--noMerge', action='store_true', help='Only run the tasks, do not make the final outputs')
+    parser.add_argument('script', type=str, help='Script to run, e.g. neutrals/tau_ana_neutral.py')
+    parser.add_argument('scriptArgs', nargs=REMAINDER, help='Arguments of the script (without --shard and --partialOutput)')
+    args = parser.parse_args()
+
+    if any(arg.split('=')[0] in ('--shard', '--partialOutput', '--mergePartials', '--checkpoint') for arg in args.scriptArgs):
+        parser.error('--shard, --partialOutput, --mergePartials and --checkpoint are set per task by the runner')
+
+    os.makedirs(args.workDir, exist_ok=True)
+    path = os.path.join(args.workDir, 'manifest.json')
+    manifest = get_manifest(path, args.script, args.scriptArgs, args.shards, os.path.abspath(args.workDir))
+    n_done = sum(task['status'] == 'done' for task in manifest['tasks'])
+    print(f"{len(manifest['tasks'])} tasks, {n_done} already done")
+
+    run_tasks(manifest, path, EXECUTORS[args.executor](args.jobs), args.retries)
+
+    failed = [task for task in manifest['tasks'] if task['status'] != 'done']
+    if failed:
+        print(f"{len(failed)} tasks failed, not merging: {[task['id'] for task in failed]}; rerun the same command to retry them")
+        sys.exit(1)
+    print(f"All {len(manifest['tasks'])} tasks done")
+    if args.noMerge:
+        return
+    subprocess.run(merge_command(manifest), check=True)
+
+
+if __name__ == '__main__':
+    main()
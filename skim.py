@@ -0,0 +1,113 @@
+# Skim: keep only the events passing a selection so that follow-up studies run on a small subset
+#   python skim.py --inputFile <sample> --outputFile 3p_skim.slcio --decayModes 4 5
+#   python skim.py --inputFile <sample> --outputFile 0p_skim.txt --nProngs 0
+# An .slcio output holds the selected events (only the collections read here), a .txt output one "file run event" line per event
+# An event passes if its number of reco taus is within --minRecoTaus/--maxRecoTaus and at least one reco tau passes all tau cuts
+# Events without a collection the selection needs are skipped and counted, any other error in the selection stops the skim
+import os
+from argparse import ArgumentParser
+from pyLCIO import IOIMPL, EVENT
+
+from tau_mc_link import getLinkedMCTau, getDecayMode, getNRecoQPis
+from event_io import add_reader_args, get_input_files, iter_readers
+
+# Collections needed to evaluate the selection
+SKIM_COLLECTIONS = ['RecoTaus', 'PandoraPFOs', 'MCParticle', 'TauPFOLink', 'RecoMCTruthLink']
+
+
+# Selection options, unset options do not cut
+def add_selection_args(parser):
+    parser.add_argument('--decayModes', type=int, nargs='*', default=None,
+                        help='Decay modes (see tau_mc_link.getDecayMode) of the MC tau linked to the reco tau')
+    parser.add_argument('--nProngs', type=int, nargs='*', default=None, help='Numbers of reco charged pions in the reco tau')
+    parser.add_argument('--daughterTypes', type=int, nargs='*', default=None,
+                        help='The reco tau has at least one daughter with one of these |PDG| types')
+    parser.add_argument('--minRecoTaus', type=int, default=None, help='Minimum number of reco taus in the event')
+    parser.add_argument('--maxRecoTaus', type=int, default=None, help='Maximum number of reco taus in the event')
+
+
+def passes_tau(reco_tau, event, args):
+    if args.nProngs is not None and getNRecoQPis(reco_tau) not in args.nProngs:
+        return False
+    if args.daughterTypes is not None:
+        if not any(abs(daughter.getType()) in args.daughterTypes for daughter in reco_tau.getParticles()):
+            return False
+    if args.decayModes is not None:
+        mcTau = getLinkedMCTau(reco_tau, event.navigator('TauPFOLink'), event.navigator('RecoMCTruthLink'))
+        if mcTau is None or getDecayMode(mcTau) not in args.decayModes:
+            return False
+    return True
+
+
+# Collections passes_event looks up for this selection
+def selection_collections(args):
+    return ['RecoTaus'] + (['TauPFOLink', 'RecoMCTruthLink'] if args.decayModes is not None else [])
+
+
+def passes_event(event, args):
+    reco_taus = event.getCollection('RecoTaus')
+    n_reco_taus = len(reco_taus)
+    if args.minRecoTaus is not None and n_reco_taus < args.minRecoTaus: return False
+    if args.maxRecoTaus is not None and n_reco_taus > args.maxRecoTaus: return False
+
+    if args.decayModes is None and args.nProngs is None and args.daughterTypes is None:
+        return True
+    return any(passes_tau(reco_tau, event, args) for reco_tau in reco_taus)
+
+
+def main():
+    parser = ArgumentParser(description='Write the events passing a selection')
+    parser.add_argument('-i', '--inputFile', type=str, default='output_taufinder.slcio')
+    parser.add_argument('-o', '--outputFile', type=str, required=True, help='Skimmed events (.slcio) or event list (.txt)')
+    parser.add_argument('--keepCollections', type=str, nargs='*', default=[],
+                        help='Additional collections written to an .slcio skim')
+    add_selection_args(parser)
+    add_reader_args(parser)
+    args = parser.parse_args()
+
+    write_events = args.outputFile.endswith('.slcio')
+    if not write_events and not args.outputFile.endswith('.txt'):
+        parser.error('--outputFile must end in .slcio or .txt')
+
+    collections = SKIM_COLLECTIONS + [name for name in args.keepCollections if name not in SKIM_COLLECTIONS]
+    to_process = get_input_files(args.inputFile)
+    if write_events and any(not file.endswith('.slcio') for file in to_process):
+        parser.error('an .slcio skim needs .slcio inputs, write a .txt event list for event cache inputs')
+
+    tmp_path = args.outputFile[:-len('.slcio')] + '.tmp.slcio' if write_events else args.outputFile + '.tmp'
+    if write_events:
+        writer = IOIMPL.LCFactory.getInstance().createLCWriter()
+        writer.open(tmp_path, EVENT.LCIO.WRITE_NEW)
+    else:
+        writer = open(tmp_path, 'w')
+
+    n_events = 0
+    n_selected = 0
+    n_missing = 0
+    for file, reader in iter_readers(to_process, collections, args):
+        for event in reader:
+            n_events += 1
+            try:
+                for name in selection_collections(args):
+                    event.getCollection(name)
+            except Exception: # events without one of the collections cannot be selected
+                print(f"Missing {name} in event {event.getEventNumber()} of {file}, skipping it")
+                n_missing += 1
+                continue
+            if not passes_event(event, args): continue
+            n_selected += 1
+            if write_events:
+                writer.writeEvent(event.event)
+            else:
+                writer.write(f"{os.path.abspath(file)} {event.getRunNumber()} {event.getEventNumber()}\n")
+        reader.close()
+
+    writer.close()
+    os.replace(tmp_path, args.outputFile)
+    print(f"Selected {n_selected} of {n_events} events, written to {args.outputFile}")
+    if n_missing:
+        print(f"{n_missing} events skipped for a missing collection")
+
+
+if __name__ == '__main__':
+    main()
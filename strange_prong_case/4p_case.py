@@ -1,66 +1,79 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas, TLegend
 import os
 from argparse import ArgumentParser
 import matplotlib.pyplot as plt
 
 from tau_mc_link import getLinkedMCTau, getDecayMode, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 # Command line arguments
 parser = ArgumentParser()
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 #parser.add_argument('--outputFile', type=str, default='reco_tau_prong_combinations.root')
+add_reader_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['RecoTaus', 'PandoraPFOs', 'MCParticle', 'TauPFOLink', 'RecoMCTruthLink']
+
 # Discover input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
-
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
-
-    n_reco_4p_events = 0
-    n_reco_4p_matched_3p = 0
-    total_muons_or_electrons = 0
-    n_reco_4p_with_electron_or_muon = 0
-    non_3p_reco_4p_events = []
+to_process = get_input_files(args.inputFile)
+
+# Counters of each input file, saved in checkpoints and written as a partial output by --shard runs
+state = {'files': {}}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
+
+def print_counts(counts):
+    print("# of 4p reco taus: " + str(counts['n_reco_4p_events']))
+    print("# of 4p reco taus matched to 3p MC tau: " + str(counts['n_reco_4p_matched_3p']))
+    print("Non-3p decay modes: " + str(counts['non_3p_reco_4p_events']))
+
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
+
+    counts = state['files'].setdefault(file, {
+        'n_reco_4p_events': 0,
+        'n_reco_4p_matched_3p': 0,
+        'total_muons_or_electrons': 0,
+        'n_reco_4p_with_electron_or_muon': 0,
+        'non_3p_reco_4p_events': [],
+    })
 
     for event in reader:
-        # Get collections
+        # Get collections, the relation navigators are only built for taus that need the MC link
         reco_taus = event.getCollection('RecoTaus')
-        pfos = event.getCollection('PandoraPFOs')
-        mcParticles = event.getCollection('MCParticle')
-        tauRecoLink = event.getCollection('TauPFOLink')
-        recoMCLink = event.getCollection('RecoMCTruthLink')
-
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
 
         for reco_tau in reco_taus:
 
-            # Get linked MC tau
-            mcTau = getLinkedMCTau(reco_tau, relationNavigatorTau, relationNavigatorRecoMC)
+            if getNRecoQPis(reco_tau) == 4:
+                # Get linked MC tau
+                mcTau = getLinkedMCTau(reco_tau, event.navigator('TauPFOLink'), event.navigator('RecoMCTruthLink'))
 
-            # Get linked MC tau decay mode
-            decayMode = getDecayMode(mcTau)
+                # Get linked MC tau decay mode
+                decayMode = getDecayMode(mcTau)
 
-            if getNRecoQPis(reco_tau) == 4:
-                n_reco_4p_events += 1
-                if decayMode == 4 or decayMode == 5: n_reco_4p_matched_3p += 1
-                else: non_3p_reco_4p_events.append(decayMode)
+                counts['n_reco_4p_events'] += 1
+                if decayMode == 4 or decayMode == 5: counts['n_reco_4p_matched_3p'] += 1
+                else: counts['non_3p_reco_4p_events'].append(decayMode)
 
     reader.close()
 
+# Every file, also those done by an earlier (checkpointed, sharded or cached) run, which are only merged in by
+# worker_readers once the loop starts
+for counts in state['files'].values():
+    print_counts(counts)
 
-    print("# of 4p reco taus: " + str(n_reco_4p_events))
-    print("# of 4p reco taus matched to 3p MC tau: " + str(n_reco_4p_matched_3p))
-    print("Non-3p decay modes: " + str(non_3p_reco_4p_events))
+write_partial(state, args)
 
 
 
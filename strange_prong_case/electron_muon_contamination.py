@@ -1,25 +1,32 @@
-from pyLCIO import IOIMPL, EVENT, UTIL
 from ROOT import TH1F, TFile, TCanvas, TLegend
 import os
 from argparse import ArgumentParser
 import matplotlib.pyplot as plt
 
 from tau_mc_link import getLinkedMCTau, getDecayMode, getNRecoQPis
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # shared helpers live in the repository root
+from event_io import add_reader_args, get_input_files
+from partials import Checkpoint, add_checkpoint_args, add_partial_args, read_partials, write_partial
+from result_cache import add_result_cache_args
+from workers import add_worker_args, worker_readers
 
 # Command line arguments
 parser = ArgumentParser()
 parser.add_argument('--inputFile', type=str, default='output_taufinder.slcio')
 #parser.add_argument('--outputFile', type=str, default='reco_tau_prong_combinations.root')
+add_reader_args(parser)
+add_partial_args(parser)
+add_checkpoint_args(parser)
+add_worker_args(parser)
+add_result_cache_args(parser)
 args = parser.parse_args()
 
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ['RecoTaus', 'PandoraPFOs', 'MCParticle', 'TauPFOLink', 'RecoMCTruthLink']
+
 # Discover input files
-to_process = []
-if os.path.isdir(args.inputFile):
-    for r, d, f in os.walk(args.inputFile):
-        for file in f:
-            to_process.append(os.path.join(r, file))
-else:
-    to_process.append(args.inputFile)
+to_process = get_input_files(args.inputFile)
 
 prong_decay_modes = [0, 1, 2, 3, 4, 5]
 
@@ -31,34 +38,40 @@ def getNChargedParticles(recoTau): # counter for electrons, muons, pions
             nChargedParticles += 1
     return nChargedParticles
 
-for file in to_process:
-    reader = IOIMPL.LCFactory.getInstance().createLCReader()
-    reader.open(file)
+# Counters of each input file, saved in checkpoints and written as a partial output by --shard runs
+state = {'files': {}}
+to_process = read_partials(state, to_process, args)
+checkpoint = Checkpoint(state, args)
+to_process = checkpoint.resume(to_process)
+
+def print_counts(counts):
+    print("# of hadronic reco taus (with > 0 pions): " + str(counts['n_reco_hadronic_events']))
+    print("# of muons or electrons in hadronic reco tau: " + str(counts['total_muons_or_electrons_in_hadronic_events']))
+    print("# of hadronic reco taus with at least one muon or electron: " + str(counts['n_reco_hadronic_events_with_muon_or_electron']))
+    print("# of 3 charged particle reco taus linked to 3-prong MC tau: " + str(counts['n_3_charged_particle_events_linked_3p']))
+    print("# of 4 charged particle reco taus with one electron or muon: " + str(counts['n_4_charged_particle_events_including_electron_or_muon']))
+
+for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
 
-    n_reco_hadronic_events = 0
-    total_muons_or_electrons_in_hadronic_events = 0
-    n_reco_hadronic_events_with_muon_or_electron = 0
-    n_3_charged_particle_events_linked_3p = 0
-    n_4_charged_particle_events_including_electron_or_muon = 0
+    counts = state['files'].setdefault(file, {
+        'n_reco_hadronic_events': 0,
+        'total_muons_or_electrons_in_hadronic_events': 0,
+        'n_reco_hadronic_events_with_muon_or_electron': 0,
+        'n_3_charged_particle_events_linked_3p': 0,
+        'n_4_charged_particle_events_including_electron_or_muon': 0,
+    })
 
     for event in reader:
         # Get collections
         reco_taus = event.getCollection('RecoTaus')
-        pfos = event.getCollection('PandoraPFOs')
-        mcParticles = event.getCollection('MCParticle')
-        tauRecoLink = event.getCollection('TauPFOLink')
-        recoMCLink = event.getCollection('RecoMCTruthLink')
-
-        relationNavigatorTau = UTIL.LCRelationNavigator(tauRecoLink)
-        relationNavigatorRecoMC = UTIL.LCRelationNavigator(recoMCLink)
 
         for reco_tau in reco_taus:
-            mcTau = getLinkedMCTau(reco_tau, relationNavigatorTau, relationNavigatorRecoMC)
+            mcTau = getLinkedMCTau(reco_tau, event.navigator('TauPFOLink'), event.navigator('RecoMCTruthLink'))
             decayMode = getDecayMode(mcTau)
 
             if decayMode in prong_decay_modes:
                 per_event_total_electrons_or_muons = 0
-                n_reco_hadronic_events += 1
+                counts['n_reco_hadronic_events'] += 1
                 nQPis = getNRecoQPis(reco_tau)
                 charged_particles = getNChargedParticles(reco_tau)
                 if 0 < nQPis < 4: # only look at events that will have both a reco pion and electron
@@ -66,18 +79,19 @@ for file in to_process:
                     counted = False # only count one muons or electron per tau
                     if charged_particles != nQPis:
                         per_event_total_electrons_or_muons = abs(nQPis - charged_particles)
-                        total_muons_or_electrons_in_hadronic_events += abs(nQPis - charged_particles)
+                        counts['total_muons_or_electrons_in_hadronic_events'] += abs(nQPis - charged_particles)
                         if not counted:
                             counted = True
-                            n_reco_hadronic_events_with_muon_or_electron += 1
-                        if charged_particles == 3 and decayMode == 4: n_3_charged_particle_events_linked_3p += 1
-                        if charged_particles == 4: n_4_charged_particle_events_including_electron_or_muon += 1
+                            counts['n_reco_hadronic_events_with_muon_or_electron'] += 1
+                        if charged_particles == 3 and decayMode == 4: counts['n_3_charged_particle_events_linked_3p'] += 1
+                        if charged_particles == 4: counts['n_4_charged_particle_events_including_electron_or_muon'] += 1
+
+    reader.close()
 
-        reader.close()
+# Every file, also those done by an earlier (checkpointed, sharded or cached) run, which are only merged in by
+# worker_readers once the loop starts
+for counts in state['files'].values():
+    print_counts(counts)
 
-    print("# of hadronic reco taus (with > 0 pions): " + str(n_reco_hadronic_events))
-    print("# of muons or electrons in hadronic reco tau: " + str(total_muons_or_electrons_in_hadronic_events))
-    print("# of hadronic reco taus with at least one muon or electron: " + str(n_reco_hadronic_events_with_muon_or_electron))
-    print("# of 3 charged particle reco taus linked to 3-prong MC tau: " + str(n_3_charged_particle_events_linked_3p))
-    print("# of 4 charged particle reco taus with one electron or muon: " + str(n_4_charged_particle_events_including_electron_or_muon))
+write_partial(state, args)
 
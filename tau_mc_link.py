@@ -94,6 +94,10 @@ def getDecayMode(mcTau):
     daughter_pdgs = []
 
     n_daughters = len(mcTau.getDaughters())
+
+    # No decay recorded (e.g. a tau copied between generator status codes): no mode
+    if (n_daughters < 2):
+        return None
     
     # Loop over daughters and store pdgs
     for daughter in mcTau.getDaughters():
@@ -1,16 +1,26 @@
 import math
 import os
-from array import array
 from argparse import ArgumentParser
-from pyLCIO import IOIMPL, EVENT, UTIL
-from ROOT import TFile, TTree
+import numpy as np
+
+from event_io import add_reader_args, get_input_files, iter_readers
+from ml_writer import open_writer
 
 # Args
-parser = ArgumentParser(description="Convert LCIO Reco Taus to ROOT Tree for BDT training")
-parser.add_argument('--input', type=str, required=True, help='TauFinder .slcio file')
-parser.add_argument('--output', type=str, default='tau_bdt_training.root', help='Name output .root file')
-parser.add_argument('--isBackground', action='store_true', help='Set if processing background (BIB/Neutrino Gun), sets isSignal=0')
+parser = ArgumentParser(description="Convert LCIO Reco Taus to a ROOT Tree, Parquet or HDF5 file for BDT training")
+parser.add_argument('--input', type=str, nargs='+', default=[], help='Signal TauFinder .slcio files (or event_cache.py .npz files), directories or file lists')
+parser.add_argument('--background', type=str, nargs='+', default=[], help='Background (BIB/Neutrino Gun) files, directories or file lists, their taus get isSignal=0')
+parser.add_argument('--output', type=str, default='tau_bdt_training.root', help='Name of the output file: .root (TTree), .parquet or .h5')
+parser.add_argument('--rowGroupSize', type=int, default=100000, help='Taus per Parquet row group / HDF5 write, larger groups read faster column by column')
+parser.add_argument('--isBackground', action='store_true', help='Set if the --input files are background (BIB/Neutrino Gun), sets isSignal=0')
+parser.add_argument('--append', action='store_true', help='Add the input files to an existing output instead of recreating it, files it already holds are skipped')
+add_reader_args(parser)
 args = parser.parse_args()
+if not args.input and not args.background:
+    parser.error('give the input files with --input and/or --background')
+
+# Collections read from the input files, everything else in the event is skipped
+COLLECTIONS = ["RecoTaus", "PandoraPFOs", "MCParticle"]
 
 # Pion info
 def calculate_delta_r(eta1, phi1, eta2, phi2):
@@ -40,144 +50,169 @@ def compute_dynamic_cone(pt): # Following default TauFinder.cc implementation
     else:
         return 0.05
 
-# Root tree
-out_file = TFile(args.output, "RECREATE")
-tree = TTree("tau_tree", "Tau BDT Training Data")
-
-# Define Buffers
-b_pt = array('f', [0.])
-b_eta = array('f', [0.])
-b_phi = array('f', [0.])
-b_theta = array('f', [0.])
-b_mass_inv = array('f', [0.])
-b_nTracks = array('i', [0])
-b_nCharged = array('i', [0])
-b_nNeutral = array('i', [0])
-b_isoE = array('f', [0.])
-b_isSignal = array('i', [0])
-b_daughter_types = array('i', [0] * 10)
-
-# Branches
-tree.Branch("pt", b_pt, "pt/F")
-tree.Branch("theta", b_theta, "theta/F")
-tree.Branch("eta", b_eta, "eta/F")
-tree.Branch("phi", b_phi, "phi/F")
-tree.Branch("invMass", b_mass_inv, "mass/F")
-tree.Branch("nTracks", b_nTracks, "nTracks/I")
-tree.Branch("nCharged", b_nCharged, "nCharged/I")
-tree.Branch("nNeutral", b_nNeutral, "nNeutral/I")
-tree.Branch("isoE", b_isoE, "isoE/F")
-tree.Branch("isSignal", b_isSignal, "isSignal/I")
-tree.Branch("daughterTypes", b_daughter_types, "daughterTypes[10]/I")
-
-# Read slcio file
-reader = IOIMPL.LCFactory.getInstance().createLCReader()
+# Output columns: name -> (numpy dtype, values per tau)
+COLUMNS = {
+    "pt": ("f4", 1),
+    "theta": ("f4", 1),
+    "eta": ("f4", 1),
+    "phi": ("f4", 1),
+    "invMass": ("f4", 1),
+    "nTracks": ("i4", 1),
+    "nCharged": ("i4", 1),
+    "nNeutral": ("i4", 1),
+    "isoE": ("f4", 1),
+    "isSignal": ("i4", 1),
+    "daughterTypes": ("i4", 10), # TauFinder limits to 10
+    "signalFile": ("i4", 1), # 1 if the tau comes from a signal input file, 0 from a background file
+    "sourceFile": ("i4", 1), # index of its input file in the source_files list of the output
+    # All daughters of the tau, nConstituents values per tau stored one after the other (see ml_writer.py)
+    "nConstituents": ("i4", 1),
+    "constituentType": ("i4", "nConstituents"),
+    "constituentCharge": ("f4", "nConstituents"),
+    "constituentE": ("f4", "nConstituents"),
+    "constituentPx": ("f4", "nConstituents"),
+    "constituentPy": ("f4", "nConstituents"),
+    "constituentPz": ("f4", "nConstituents"),
+    "constituentDR": ("f4", "nConstituents"), # dR to the tau axis
+}
+
+CONSTITUENT_COLUMNS = [name for name, (dtype, width) in COLUMNS.items() if width == "nConstituents"]
+
+# Output file, the format follows the extension of --output
 try:
-    reader.open(args.input)
-except Exception as e:
-    print(f"Error opening file: {e}")
+    writer = open_writer(args.output, COLUMNS, args.rowGroupSize, args.append)
+except (ImportError, ValueError) as e:
+    print(f"Error opening output: {e}")
     exit(1)
 
-print(f"Starting on: {args.input}")
-
-num_true_taus = 0 # For debugging, should be ~18-19k
-
-# Event loop
-for i, event in enumerate(reader):
-    if i % 1000 == 0: print(f"Processing Event {i}...")
-
-    try:
-        reco_taus = event.getCollection("RecoTaus")
-        pfos = event.getCollection("PandoraPFOs")
-        mc_particles = event.getCollection("MCParticle")
-    except Exception:
-        print(f"Missing collection in event: {i}")
-        continue
-
-    # MC taus for truth matching
-    true_taus = []
-    if not args.isBackground:
-        for mcp in mc_particles:
-            if abs(mcp.getPDG()) == 15: #and mcp.getGeneratorStatus() == 1:
-                _, m_eta, m_phi, _ = get_kinematics(mcp.getMomentum())
-                num_true_taus += 1
-                true_taus.append((m_eta, m_phi))
-
-    for tau in reco_taus:
-        t_pt, t_eta, t_phi, t_theta = get_kinematics(tau.getMomentum())
-
-        # Get daughter's tracks, inv mass, types (neutral/charged/pdg)
-        daughters = tau.getParticles()
-        n_tracks = 0
-        n_charged = 0
-        n_neutral = 0
-        sum_e, sum_px, sum_py, sum_pz = 0.0, 0.0, 0.0, 0.0
-        daughter_types = []
-
-        for d in daughters:
-            # 4 vector sum
-            sum_e += d.getEnergy()
-            dp = d.getMomentum()
-            sum_px += dp[0]; sum_py += dp[1]; sum_pz += dp[2]
-
-            # Type/PDG counting
-            daughter_types.append(d.getType())
-            if d.getCharge() != 0:
-                n_charged += 1
-                if d.getTracks().size() > 0:
-                    n_tracks += 1
-            else:
-                n_neutral += 1
-
-        # Calculate inv mass
-        p2 = sum_px**2 + sum_py**2 + sum_pz**2
-        m2 = sum_e**2 - p2
-        calc_mass = math.sqrt(m2) if m2 > 0 else 0.0
-
-        # Dynamic isolation cone
-        inner_cone = compute_dynamic_cone(t_pt)
-        outer_cone = inner_cone + 0.2
-        iso_e = 0.0
-        for pfo in pfos:
-            p_mom = pfo.getMomentum()
-            p_pt = math.sqrt(p_mom[0]**2 + p_mom[1]**2)
-            if p_pt < 0.2: continue
-            _, p_eta, p_phi, _ = get_kinematics(p_mom)
-            dr = calculate_delta_r(t_eta, t_phi, p_eta, p_phi)
-            if inner_cone < dr < outer_cone:
-                iso_e += pfo.getEnergy()
-
-        # Fill buffers
-        b_pt[0], b_theta[0], b_eta[0], b_phi[0] = t_pt, t_theta, t_eta, t_phi
-        b_mass_inv[0] = calc_mass
-        b_nTracks[0] = n_tracks
-        b_nCharged[0] = n_charged
-        b_nNeutral[0] = n_neutral
-        b_isoE[0] = iso_e
-
-        # Clear buffer
-        for j in range(10): 
-            b_daughter_types[j] = 0
-
-        # Add daughter types
-        for j, dtype in enumerate(daughter_types):
-            if j < 10:
-                b_daughter_types[j] = int(dtype)
-            else:
-                break # TauFinder limits to 10
-
-        # Truth matching
-        matched = False
-        for m_eta, m_phi in true_taus:
-            if calculate_delta_r(t_eta, t_phi, m_eta, m_phi) < 0.1:
-                matched = True; break
-        b_isSignal[0] = 1 if (matched and not args.isBackground) else 0
-
-        tree.Fill()
-
-reader.close()
-out_file.Write()
-out_file.Close()
-print(f"Processed {num_true_taus} true taus")
-print(f"Tree saved successfully to {args.output}")
+# Rows of the taus not written yet, one list per column
+rows = {name: [] for name in COLUMNS}
+
+def flush_rows():
+    if rows["pt"]:
+        writer.write({name: np.array(values, dtype=COLUMNS[name][0]) for name, values in rows.items()})
+    for values in rows.values():
+        values.clear()
+
+# Input files and whether they are signal, files the output already holds are skipped
+input_signal = {}
+for paths, signal in ((args.input, 0 if args.isBackground else 1), (args.background, 0)):
+    for path in paths:
+        for file in get_input_files(path):
+            input_signal.setdefault(os.path.abspath(file), signal)
+done_files = {source[0] for source in writer.sources}
+to_process = [file for file in input_signal if file not in done_files]
+if len(to_process) < len(input_signal):
+    print(f"Skipping {len(input_signal) - len(to_process)} files already in {args.output}")
+
+num_true_taus = 0 # For debugging, should be ~18-19k per signal sample (MC taus of background files are not counted)
+
+for file, reader in iter_readers(to_process, COLLECTIONS, args):
+    print(f"Starting on: {file}")
+    signal = input_signal[file]
+    source_index = len(writer.sources)
+    n_file_taus = 0
+
+    # Event loop
+    for i, event in enumerate(reader):
+        if i % 1000 == 0: print(f"Processing Event {i}...")
+
+        try:
+            reco_taus = event.getCollection("RecoTaus")
+            pfos = event.getCollection("PandoraPFOs")
+            mc_particles = event.getCollection("MCParticle")
+        except Exception:
+            print(f"Missing collection in event: {i}")
+            continue
+
+        # MC taus for truth matching
+        true_taus = []
+        if signal:
+            for mcp in mc_particles:
+                if abs(mcp.getPDG()) == 15: #and mcp.getGeneratorStatus() == 1:
+                    _, m_eta, m_phi, _ = get_kinematics(mcp.getMomentum())
+                    num_true_taus += 1
+                    true_taus.append((m_eta, m_phi))
+
+        for tau in reco_taus:
+            t_pt, t_eta, t_phi, t_theta = get_kinematics(tau.getMomentum())
+
+            # Get daughter's tracks, inv mass, types (neutral/charged/pdg)
+            daughters = tau.getParticles()
+            n_tracks = 0
+            n_charged = 0
+            n_neutral = 0
+            sum_e, sum_px, sum_py, sum_pz = 0.0, 0.0, 0.0, 0.0
+            daughter_types = []
+            constituents = []
+
+            for d in daughters:
+                # 4 vector sum
+                sum_e += d.getEnergy()
+                dp = d.getMomentum()
+                sum_px += dp[0]; sum_py += dp[1]; sum_pz += dp[2]
+
+                # Constituent kinematics
+                _, d_eta, d_phi, _ = get_kinematics(dp)
+                constituents.append((int(d.getType()), d.getCharge(), d.getEnergy(), dp[0], dp[1], dp[2],
+                                     calculate_delta_r(t_eta, t_phi, d_eta, d_phi)))
+
+                # Type/PDG counting
+                daughter_types.append(int(d.getType()))
+                if d.getCharge() != 0:
+                    n_charged += 1
+                    if d.getTracks().size() > 0:
+                        n_tracks += 1
+                else:
+                    n_neutral += 1
+
+            # Calculate inv mass
+            p2 = sum_px**2 + sum_py**2 + sum_pz**2
+            m2 = sum_e**2 - p2
+            calc_mass = math.sqrt(m2) if m2 > 0 else 0.0
+
+            # Dynamic isolation cone
+            inner_cone = compute_dynamic_cone(t_pt)
+            outer_cone = inner_cone + 0.2
+            iso_e = 0.0
+            for pfo in pfos:
+                p_mom = pfo.getMomentum()
+                p_pt = math.sqrt(p_mom[0]**2 + p_mom[1]**2)
+                if p_pt < 0.2: continue
+                _, p_eta, p_phi, _ = get_kinematics(p_mom)
+                dr = calculate_delta_r(t_eta, t_phi, p_eta, p_phi)
+                if inner_cone < dr < outer_cone:
+                    iso_e += pfo.getEnergy()
+
+            # Truth matching
+            matched = False
+            for m_eta, m_phi in true_taus:
+                if calculate_delta_r(t_eta, t_phi, m_eta, m_phi) < 0.1:
+                    matched = True; break
+
+            # Fill row
+            rows["pt"].append(t_pt); rows["theta"].append(t_theta); rows["eta"].append(t_eta); rows["phi"].append(t_phi)
+            rows["invMass"].append(calc_mass)
+            rows["nTracks"].append(n_tracks)
+            rows["nCharged"].append(n_charged)
+            rows["nNeutral"].append(n_neutral)
+            rows["isoE"].append(iso_e)
+            rows["isSignal"].append(1 if (matched and signal) else 0)
+            rows["daughterTypes"].append((daughter_types + [0] * 10)[:10])
+            rows["signalFile"].append(signal)
+            rows["sourceFile"].append(source_index)
+            rows["nConstituents"].append(len(constituents))
+            for name, values in zip(CONSTITUENT_COLUMNS, zip(*constituents)):
+                rows[name].extend(values)
+            n_file_taus += 1
+            if len(rows["pt"]) >= args.rowGroupSize:
+                flush_rows()
+
+    reader.close()
+    writer.add_source(file, signal, n_file_taus)
+
+flush_rows()
+writer.close()
+print(f"Processed {num_true_taus} true taus in the signal files read")
+print(f"Dataset saved successfully to {args.output}")
 
@@ -0,0 +1,51 @@
+# Decay modes of taus without a recorded decay, for every copy of tau_mc_link.py (the scripts import the one next to them)
+import importlib.util
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('ROOT')
+pytest.importorskip('pyLCIO')
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+import decay_modes
+
+
+class MCParticle:
+    def __init__(self, pdg, daughters=()):
+        self.pdg = pdg
+        self.daughters = list(daughters)
+
+    def getPDG(self):
+        return self.pdg
+
+    def getDaughters(self):
+        return self.daughters
+
+
+def load_copy(directory):
+    path = os.path.join(ROOT_DIR, directory, 'tau_mc_link.py')
+    spec = importlib.util.spec_from_file_location(f'tau_mc_link_{directory or "root"}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize('directory', ['', 'neutrals', 'multiple_reco_tau_per_event_study'])
+@pytest.mark.parametrize('daughters', [[], [MCParticle(15)], [MCParticle(-211)]])
+def test_tau_without_decay_has_no_mode(directory, daughters):
+    assert load_copy(directory).getDecayMode(MCParticle(15, daughters)) is None
+
+
+@pytest.mark.parametrize('directory', ['', 'neutrals', 'multiple_reco_tau_per_event_study'])
+def test_one_prong_mode(directory):
+    assert load_copy(directory).getDecayMode(MCParticle(15, [MCParticle(-211), MCParticle(16)])) == 0
+
+
+def test_zero_daughter_tau_only_masks_itself():
+    decaying = MCParticle(15, [MCParticle(-211), MCParticle(16)])
+    undecayed = MCParticle(15)
+    assert decay_modes.event_mode_mask([decaying, undecayed]) == (1 << 0) | (1 << decay_modes.OTHER_BIT)
@@ -0,0 +1,211 @@
+# Worker processes: read the input files in child processes, --jobs of them at the same time, each replaced after some
+# files or above a memory limit
+# pyLCIO and ROOT grow over thousands of files in one process (up to segfaults and memory errors), a new worker starts clean
+#   for file, reader in worker_readers(to_process, COLLECTIONS, state, args, checkpoint):
+# The loop body runs in the worker (a fork of the script) on an emptied copy of the state (see partials.py),
+# the worker sends its state back when it stops and the script merges it (histograms added, counters summed)
+# After the loop the script holds the results of all files as if it had read them itself
+import io
+import os
+import pickle
+import resource
+import select
+import signal
+import sys
+
+from event_io import read_files, reader_options
+from partials import merge_state, reset_state, state_delta, state_keys
+from result_cache import ResultCache
+
+# Times a job is started again after its worker was killed while sending its state, before the run fails
+MAX_STATE_RETRIES = 2
+
+
+def add_worker_args(parser):
+    parser.add_argument('--filesPerWorker', type=int, default=0,
+                        help='Read the input files in worker processes replaced after this many files (0: read all files in this process)')
+    parser.add_argument('--maxWorkerMemory', type=float, default=0,
+                        help='Replace the worker once its resident memory is above this many MB (also enables workers)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Read the input files in this many worker processes at the same time, the files are split between them by size')
+
+
+def resident_memory_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except OSError: # no /proc: peak instead of current memory
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Counts the events of the sampled files (see event_io --sampleFraction/--maxEvents/--modeFractions) in state['sampling']
+# as they are read, so the sampling is summed over workers, cached files, checkpoints and partial outputs like any other count
+# Only the events the loop actually used are counted (see event_io.EventReader), e.g. not those after a --targetPrecision stop
+def _count_sampling(readers, state):
+    for file, reader in readers:
+        if reader.sampled_from is not None:
+            reader.sampling = state.setdefault('sampling', {'events': 0, 'sampled': 0, 'weighted': 0.0})
+        yield file, reader
+
+
+# Child side: read files until the worker is due for replacement, then send the state and exit
+def _run_worker(files, collections, options, state, args, cache, write_end):
+    reset_state(state)
+    keys = state_keys(state)
+    if cache is not None: cache.start(state)
+    out = os.fdopen(write_end, 'wb')
+    done = []
+    for file, reader in _count_sampling(read_files(files, collections, options, args.prefetch), state):
+        yield file, reader
+        if cache is not None: cache.file_done(file, options.get(file), state)
+        done.append(file)
+        pickle.dump(('done', file), out)
+        out.flush()
+        if len(done) == args.filesPerWorker: break
+        if args.maxWorkerMemory and resident_memory_mb() > args.maxWorkerMemory: break
+    if cache is not None: cache.finish(state)
+    pickle.dump(('stop',), out)
+    out.flush()
+    pickle.dump(('state', state_delta(state, keys)), out, protocol=pickle.HIGHEST_PROTOCOL)
+    out.close()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
+
+
+# Parent side: the files the worker finished, whether it stopped reading and its state (None if it died before sending it)
+def _read_messages(f):
+    done = []
+    stopped = False
+    worker_state = None
+    while True:
+        try:
+            message = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            break
+        if message[0] == 'done':
+            done.append(message[1])
+        elif message[0] == 'stop':
+            stopped = True
+        else:
+            worker_state = message[1]
+    return done, stopped, worker_state
+
+
+# Files of each of n_jobs workers: the heaviest files (size, times the fraction of events read if only some are) go first,
+# each to the worker with the least work so far; every worker reads its files in input order
+def split_jobs(files, options, n_jobs):
+    weights = {}
+    for file in files:
+        positions = options.get(file, {}).get('positions')
+        weights[file] = os.path.getsize(file) * (len(positions) / (max(positions) + 1) if positions else 1)
+    jobs = [[] for _ in range(n_jobs)]
+    loads = [0] * n_jobs
+    for file in sorted(files, key=lambda file: -weights[file]):
+        i = min(range(n_jobs), key=lambda k: (loads[k], len(jobs[k])))
+        jobs[i].append(file)
+        loads[i] += weights[file]
+    order = {file: k for k, file in enumerate(files)}
+    return [sorted(job, key=order.get) for job in jobs if job]
+
+
+def _stop_workers(running):
+    for read_end, (_, pid, _) in running.items():
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        os.close(read_end)
+    running.clear()
+
+
+# Drop-in replacement for checkpoint.track(iter_readers(files, collections, args)) that reads the files in workers
+# if --jobs, --filesPerWorker or --maxWorkerMemory is given and takes the results of unchanged files from the --resultCache;
+# state holds everything the loop fills
+# A file whose worker is killed (segfault, abort) is skipped, the other files of that worker are read again by the next one
+def worker_readers(files, collections, state, args, checkpoint=None):
+    files, options = reader_options(files, collections, args)
+    cache = ResultCache(args) if getattr(args, 'resultCache', None) else None
+    if cache is not None:
+        files = cache.restore(state, files, options)
+        if checkpoint is not None and checkpoint.path is not None:
+            print("Not writing checkpoints, the result cache already keeps the results of every finished file")
+            checkpoint = None
+
+    if not args.filesPerWorker and not args.maxWorkerMemory and args.jobs <= 1:
+        readers = _count_sampling(read_files(files, collections, options, args.prefetch), state)
+        if cache is not None: readers = cache.track(readers, state, options)
+        yield from checkpoint.track(readers) if checkpoint is not None else readers
+        return
+
+    # Every job has its own list of remaining files and at most one worker at a time
+    jobs = split_jobs(files, options, max(1, args.jobs))
+    waiting = list(range(len(jobs)))
+    running = {} # read end of the pipe -> (job, pid, bytes received)
+    state_retries = [0] * len(jobs)
+    skipped = []
+    n_workers = 0
+    while waiting or running:
+        while waiting:
+            i = waiting.pop(0)
+            sys.stdout.flush() # otherwise output still buffered here is printed again by the worker
+            sys.stderr.flush()
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                # _run_worker exits the worker once it has sent its state; if the loop body leaves the loop instead
+                # (break, return or an exception) the worker must not go on into the script's code after the loop
+                try:
+                    os.close(read_end)
+                    for other in running: os.close(other)
+                    yield from _run_worker(jobs[i], collections, options, state, args, cache, write_end)
+                finally:
+                    print("Worker left the event loop before reading its files (break, return or an exception in the "
+                          "loop body, run without workers to see it), its results are dropped", file=sys.stderr)
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(1)
+            os.close(write_end)
+            running[read_end] = (i, pid, bytearray())
+            n_workers += 1
+
+        # Workers are read as they send, a worker is finished once its pipe is closed
+        for read_end in select.select(list(running), [], [])[0]:
+            data = os.read(read_end, 1 << 20)
+            if data:
+                running[read_end][2].extend(data)
+                continue
+            os.close(read_end)
+            i, pid, received = running.pop(read_end)
+            done, stopped, worker_state = _read_messages(io.BytesIO(received))
+            _, status = os.waitpid(pid, 0)
+
+            remaining = jobs[i]
+            if worker_state is not None:
+                merge_state(state, worker_state)
+                jobs[i] = remaining[len(done):]
+                if checkpoint is not None:
+                    for file in done: checkpoint.file_done(file)
+            elif stopped or (os.WIFSIGNALED(status) and len(done) == len(remaining)): # killed while sending the state, its files are read again
+                signal_name = f"signal {os.WTERMSIG(status)}" if os.WIFSIGNALED(status) else f"exit status {os.WEXITSTATUS(status)}"
+                state_retries[i] += 1
+                if state_retries[i] > MAX_STATE_RETRIES:
+                    _stop_workers(running)
+                    raise RuntimeError(f"Worker killed by {signal_name} while sending its state {state_retries[i]} times "
+                                       f"(files {remaining[0]} to {remaining[-1]}), use a smaller --filesPerWorker or a "
+                                       f"larger --maxWorkerMemory")
+                print(f"Worker killed by {signal_name} after reading its files, reading them again")
+            elif os.WIFSIGNALED(status): # files are read in order, the first unfinished one killed the worker
+                failed = remaining[len(done)]
+                print(f"Worker killed by signal {os.WTERMSIG(status)} while reading {failed}, skipping this file")
+                skipped.append(failed)
+                jobs[i] = [file for file in remaining if file != failed]
+            else: # an exception in the loop body fails the run as it would without workers
+                _stop_workers(running)
+                raise RuntimeError(f"Worker failed with exit status {os.WEXITSTATUS(status)} while reading {remaining[len(done)]}")
+            if jobs[i]:
+                waiting.append(i)
+
+    if checkpoint is not None and checkpoint.path is not None:
+        checkpoint.save()
+    print(f"Read {len(files) - len(skipped)} files in {n_workers} workers" + (f", {args.jobs} at a time" if args.jobs > 1 else ''))
+    if skipped:
+        print(f"Skipped {len(skipped)} files that killed their worker: {skipped}")